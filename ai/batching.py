@@ -0,0 +1,89 @@
+"""
+Redis-backed micro-batching of `analyze_message` calls.
+
+Each task pushes its message id onto a shared pending list, waits until a
+batch (HF_BATCH_SIZE for the HuggingFace provider, LLM_BATCH_SIZE for the LLM
+ones) is pending or HF_BATCH_WAIT_MS has passed, then pops at most one batch
+and hands it to the batch processor. There is no cluster-wide collector:
+every worker process collects for itself, and since each task pops after its
+own push, the list is empty once all submitted tasks have returned.
+
+When the batch processor raises, its ids go to `on_failure` (by default they
+are pushed back to the head of the list for the next task) instead of being
+dropped. Ids popped by a worker that dies before writing results are not
+retried; they can be re-queued by re-sending `analyze_message` for messages
+without `analysis`.
+"""
+import os
+import time
+from typing import Callable, List, Optional
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HF_BATCH_SIZE = int(os.getenv("HF_BATCH_SIZE", 1))
+# OpenAI / Gemini / fake: messages per multi-message request (ai.llm_batch)
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 1))
+HF_BATCH_WAIT_MS = int(os.getenv("HF_BATCH_WAIT_MS", 50))
+
+PENDING_KEY = "ai:batch:pending"
+
+_redis: Optional[redis.Redis] = None
+
+
+def _get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(os.environ["REDIS_URL"])
+    return _redis
+
+
+def batch_size(provider: str) -> int:
+    # LLM providers pack a collected batch into multi-message requests
+    if provider in ("openai", "gemini", "fake"):
+        return LLM_BATCH_SIZE
+    if provider == "huggingface":
+        return HF_BATCH_SIZE
+    return 1
+
+
+def enabled(provider: str) -> bool:
+    return batch_size(provider) > 1
+
+
+def _requeue(items: List[str], exc: Exception) -> None:
+    # back to the head, so they are the first ids the next task pops
+    _get_redis().lpush(PENDING_KEY, *reversed(items))
+    print(f"[batch] Failed to process batch of {len(items)} messages, re-queued: {exc}")
+
+
+def submit(
+    message_id: str,
+    process_batch: Callable[[List[str]], object],
+    size: int = HF_BATCH_SIZE,
+    on_failure: Callable[[List[str], Exception], None] = _requeue,
+) -> int:
+    """
+    Queue `message_id` for batched processing and process at most one batch
+    (possibly holding other tasks' ids). Returns how many messages this call
+    processed (0 when other tasks already took them).
+    """
+    client = _get_redis()
+    client.rpush(PENDING_KEY, message_id)
+
+    deadline = time.monotonic() + HF_BATCH_WAIT_MS / 1000
+    while client.llen(PENDING_KEY) < size and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    raw_items = client.lpop(PENDING_KEY, size)
+    if not raw_items:
+        return 0
+    items = [raw.decode() for raw in raw_items]
+    try:
+        process_batch(items)
+    except Exception as exc:  # noqa: BLE001
+        on_failure(items, exc)
+        return 0
+    return len(items)
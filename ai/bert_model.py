@@ -1,8 +1,79 @@
+"""
+Zero-shot classifier used by the HuggingFace provider.
+
+HF_INFERENCE_MODE selects how the model runs on CPU:
+
+* ``default`` - the full-precision transformers pipeline
+* ``int8``    - the same pipeline after torch dynamic quantization of every
+  ``nn.Linear`` layer (int8 weights, activations quantized on the fly)
+* ``onnx``    - the model exported to ONNX and run by onnxruntime through
+  optimum (optional dependency: ``pip install optimum[onnxruntime]``); the
+  export is cached in HF_ONNX_DIR
+
+All modes return the pipeline's output, so the provider's analysis schema does
+not depend on the mode.
+"""
 import os
-from transformers import pipeline
+from typing import Dict, Optional
+
 from dotenv import load_dotenv
 
 load_dotenv()
 model_name = os.getenv("AI_MODEL", "distilbert-base-uncased-finetuned-sst-2-english")
+HF_INFERENCE_MODE = os.getenv("HF_INFERENCE_MODE", "default").strip().lower()
+HF_ONNX_DIR = os.getenv("HF_ONNX_DIR", "data/onnx")
+
+INFERENCE_MODES = ("default", "int8", "onnx")
+
+_classifiers: Dict[str, object] = {}
+
+
+def _quantized_pipeline():
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("zero-shot-classification", model=model, tokenizer=AutoTokenizer.from_pretrained(model_name))
+
+
+def _onnx_pipeline():
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as exc:
+        raise RuntimeError("HF_INFERENCE_MODE=onnx requires `pip install optimum[onnxruntime]`") from exc
+    from transformers import AutoTokenizer, pipeline
+
+    export_dir = os.path.join(HF_ONNX_DIR, model_name.replace("/", "--"))
+    if os.path.exists(os.path.join(export_dir, "model.onnx")):
+        model = ORTModelForSequenceClassification.from_pretrained(export_dir)
+        tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    else:
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model.save_pretrained(export_dir)
+        tokenizer.save_pretrained(export_dir)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+def get_classifier(mode: Optional[str] = None):
+    """
+    Build the zero-shot pipeline for `mode` (HF_INFERENCE_MODE by default) on
+    first use. transformers (and torch) are imported here rather than at
+    module import time.
+    """
+    mode = mode or HF_INFERENCE_MODE
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"unknown HF_INFERENCE_MODE {mode!r}, use one of {INFERENCE_MODES}")
+    classifier = _classifiers.get(mode)
+    if classifier is None:
+        if mode == "int8":
+            classifier = _quantized_pipeline()
+        elif mode == "onnx":
+            classifier = _onnx_pipeline()
+        else:
+            from transformers import pipeline
 
-classifier = pipeline("zero-shot-classification", model=model_name)
+            classifier = pipeline("zero-shot-classification", model=model_name)
+        _classifiers[mode] = classifier
+    return classifier
@@ -0,0 +1,209 @@
+"""
+Two-level cache of classification results keyed by (provider, model, fingerprint).
+
+Lookups hit a small in-process LRU first and then a shared Redis layer with a
+TTL, so identical log lines are only sent to the model once per TTL across all
+workers. Hit/miss counters are kept per process and aggregated in Redis.
+
+Usage:
+    python -m ai.cache stats
+    python -m ai.cache invalidate [--fingerprint FP] [--provider NAME]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("CLASSIFICATION_CACHE", "1") == "1"
+LRU_SIZE = int(os.getenv("CLASSIFICATION_CACHE_LRU_SIZE", 1024))
+TTL_SECONDS = int(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", 24 * 3600))
+
+KEY_PREFIX = "clf"
+UNCACHED_FIELDS = ("raw", "usage")
+STATS_KEY = f"{KEY_PREFIX}:stats"
+
+_lock = threading.Lock()
+_local: "OrderedDict[str, Dict[str, object]]" = OrderedDict()
+_counters: Dict[str, int] = {"lru_hits": 0, "redis_hits": 0, "misses": 0}
+# counter deltas not yet pushed to the shared Redis hash
+_pending: Dict[str, int] = {"lru_hits": 0, "redis_hits": 0, "misses": 0}
+FLUSH_EVERY = 100
+_redis: Optional[redis.Redis] = None
+
+
+def _get_redis() -> Optional[redis.Redis]:
+    global _redis
+    if _redis is None:
+        url = os.getenv("CLASSIFICATION_CACHE_REDIS_URL") or os.getenv("REDIS_URL")
+        if not url:
+            return None
+        _redis = redis.Redis.from_url(url, socket_timeout=0.5)
+    return _redis
+
+
+def cache_key(fingerprint: str, provider: str, model: str) -> str:
+    return f"{KEY_PREFIX}:{provider}:{model}:{fingerprint}"
+
+
+def _remember(key: str, analysis: Dict[str, object]) -> None:
+    with _lock:
+        _local[key] = analysis
+        _local.move_to_end(key)
+        while len(_local) > LRU_SIZE:
+            _local.popitem(last=False)
+
+
+def _count(field: str) -> None:
+    with _lock:
+        _counters[field] += 1
+        _pending[field] += 1
+        if sum(_pending.values()) < FLUSH_EVERY:
+            return
+        deltas = dict(_pending)
+        for key in _pending:
+            _pending[key] = 0
+    _flush(deltas)
+
+
+def _flush(deltas: Dict[str, int]) -> None:
+    client = _get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for field, value in deltas.items():
+            if value:
+                pipe.hincrby(STATS_KEY, field, value)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def get(fingerprint: str, provider: str, model: str) -> Optional[Dict[str, object]]:
+    if not CACHE_ENABLED or not fingerprint:
+        return None
+    key = cache_key(fingerprint, provider, model)
+
+    with _lock:
+        analysis = _local.get(key)
+        if analysis is not None:
+            _local.move_to_end(key)
+    if analysis is not None:
+        _count("lru_hits")
+        return dict(analysis)
+
+    client = _get_redis()
+    raw = None
+    if client is not None:
+        try:
+            raw = client.get(key)
+        except redis.RedisError as exc:
+            print(f"[cache] Redis lookup failed: {exc}")
+
+    if raw:
+        analysis = json.loads(raw)
+        _remember(key, analysis)
+        _count("redis_hits")
+        return dict(analysis)
+
+    _count("misses")
+    return None
+
+
+def put(fingerprint: str, provider: str, model: str, analysis: Dict[str, object]) -> None:
+    if not CACHE_ENABLED or not fingerprint:
+        return
+    key = cache_key(fingerprint, provider, model)
+    # provider payloads are large and not needed to reuse a decision, and a
+    # hit costs no tokens, so it must not carry the original call's usage
+    cached = {k: v for k, v in analysis.items() if k not in UNCACHED_FIELDS}
+    _remember(key, cached)
+
+    client = _get_redis()
+    if client is None:
+        return
+    try:
+        client.set(key, json.dumps(cached, default=str), ex=TTL_SECONDS)
+    except redis.RedisError as exc:
+        print(f"[cache] Redis store failed: {exc}")
+
+
+def invalidate(fingerprint: Optional[str] = None, provider: Optional[str] = None) -> int:
+    """
+    Drop cached analyses matching `fingerprint` and/or `provider` (all when
+    both are omitted) from Redis and from this process' LRU. Other workers
+    keep their LRU copies until evicted; keep CLASSIFICATION_CACHE_LRU_SIZE
+    small if invalidation latency matters.
+    """
+    pattern = cache_key(fingerprint or "*", provider or "*", "*")
+    with _lock:
+        for key in [k for k in _local if _matches(k, fingerprint, provider)]:
+            del _local[key]
+
+    client = _get_redis()
+    if client is None:
+        return 0
+    removed = 0
+    keys: List[bytes] = []
+    for key in client.scan_iter(match=pattern, count=500):
+        keys.append(key)
+        if len(keys) >= 500:
+            removed += client.delete(*keys)
+            keys = []
+    if keys:
+        removed += client.delete(*keys)
+    return removed
+
+
+def _matches(key: str, fingerprint: Optional[str], provider: Optional[str]) -> bool:
+    key_provider = key.split(":", 2)[1]
+    key_fp = key.rsplit(":", 1)[1]
+    return (fingerprint is None or key_fp == fingerprint) and (provider is None or key_provider == provider)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """
+    Hit/miss counters of this process and, when Redis is reachable, of all
+    workers together (shared counters lag by up to FLUSH_EVERY lookups per
+    process).
+    """
+    with _lock:
+        result = {"process": dict(_counters, lru_size=len(_local))}
+    client = _get_redis()
+    if client is not None:
+        try:
+            shared = client.hgetall(STATS_KEY)
+            result["shared"] = {k.decode(): int(v) for k, v in shared.items()}
+        except redis.RedisError as exc:
+            print(f"[cache] Redis stats failed: {exc}")
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect the classification cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="print hit/miss counters")
+    p_inv = sub.add_parser("invalidate", help="drop cached analyses")
+    p_inv.add_argument("--fingerprint")
+    p_inv.add_argument("--provider")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        print(json.dumps(stats().get("shared", {}), indent=2))
+        return 0
+
+    removed = invalidate(fingerprint=args.fingerprint, provider=args.provider)
+    print(f"Removed {removed} cached analyses")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
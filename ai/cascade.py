@@ -0,0 +1,85 @@
+"""
+Confidence-based provider cascade (AI_PROVIDER=cascade).
+
+CASCADE_TIERS lists providers from cheapest to most expensive (default
+`local,openai`). Each message goes to the first tier; its answer is kept when
+its `confidence` reaches CASCADE_CONFIDENCE_THRESHOLD, unless the label is
+`critical` and CASCADE_CONFIRM_CRITICAL=1, in which case the next tier has to
+confirm it. The last tier always decides.
+
+The stored analysis is the deciding tier's analysis plus `tier` (its
+provider name) and `tiers`: one entry per tier that ran, with its label,
+confidence and `latency_ms`.
+
+A tier failing with `ProviderRetryableError` propagates, so `analyze_message`
+retries the message later. When an escalation tier is the one throttled, the
+error carries the previous tier's answer tagged `escalation_skipped:
+"throttled"` as its `fallback`, which is stored instead of `unknown` once the
+retries are exhausted. Any other failure of an escalation tier keeps the
+previous tier's answer and records the error.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from ai import providers
+from ai.rate_limit import ProviderRetryableError
+
+load_dotenv()
+
+CASCADE_TIERS = [
+    name.strip().lower()
+    for name in os.getenv("CASCADE_TIERS", "local,openai").split(",")
+    if name.strip() and name.strip().lower() != "cascade"
+]
+CASCADE_CONFIDENCE_THRESHOLD = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", 0.8))
+CASCADE_CONFIRM_CRITICAL = os.getenv("CASCADE_CONFIRM_CRITICAL", "1") == "1"
+
+
+def settled(analysis: Dict[str, object]) -> bool:
+    if CASCADE_CONFIRM_CRITICAL and analysis.get("label") == "critical":
+        return False
+    confidence = analysis.get("confidence")
+    return confidence is not None and float(confidence) >= CASCADE_CONFIDENCE_THRESHOLD
+
+
+def classify(content: str, stats: Optional[Dict[str, Any]] = None) -> Dict[str, object]:
+    decided: Dict[str, object] = {}
+    decided_by = ""
+    tiers: List[Dict[str, object]] = []
+    for position, name in enumerate(CASCADE_TIERS):
+        started = time.perf_counter()
+        try:
+            analysis = providers.classify(name, content, stats)
+        except Exception as exc:  # noqa: BLE001
+            if not decided:
+                raise
+            tiers.append({
+                "provider": name,
+                "error": str(exc),
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+            })
+            if isinstance(exc, ProviderRetryableError):
+                exc.fallback = {**decided, "tier": decided_by, "tiers": tiers, "escalation_skipped": "throttled"}
+                raise
+            break
+        tiers.append({
+            "provider": name,
+            "label": analysis.get("label"),
+            "confidence": analysis.get("confidence"),
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+        decided, decided_by = analysis, name
+        if position == len(CASCADE_TIERS) - 1 or settled(analysis):
+            break
+
+    return {**decided, "tier": decided_by, "tiers": tiers}
+
+
+def model_name() -> str:
+    # part of the classification cache key: changing tiers or the threshold
+    # must not serve analyses decided under the old settings
+    tiers = "+".join(f"{name}={providers.model_name(name)}" for name in CASCADE_TIERS)
+    return f"{tiers}@{CASCADE_CONFIDENCE_THRESHOLD}{'/confirm' if CASCADE_CONFIRM_CRITICAL else ''}"
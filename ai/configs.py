@@ -1,11 +1,6 @@
 
 
-prompt = """
-You are an expert Site Reliability Engineer.
-
-Classify the following error into one of: critical, high, medium, low.
-
-Severity criteria:
+severity_criteria = """Severity criteria:
 - ~100% of users impacted → critical
 - ~50% of users impacted → high
 - Several users impacted → medium
@@ -18,7 +13,14 @@ Examples of critical errors:
 Examples of low-severity errors:
 - Incorrect password
 - Resource not found
+"""
+
+prompt = """
+You are an expert Site Reliability Engineer.
+
+Classify the following error into one of: critical, high, medium, low.
 
+""" + severity_criteria + """
 Output format:
 Return ONLY a JSON object:
 {
@@ -46,4 +48,17 @@ Rules:
 - You must return only valid severities.
 - Do not include explanations or extra text.
 
-"""
\ No newline at end of file
+"""
+
+# multi-message requests (ai.llm_batch): the same role and rules without the
+# single-object answer format; ai.llm_batch adds the JSON array format
+batch_system_prompt = """
+You are an expert Site Reliability Engineer (SRE).
+Your task is to analyze incoming Web-application log records and classify the incident severity of each one.
+
+Rules:
+- Severity is determined by user impact.
+- You must return only valid severities.
+- Do not include explanations or extra text.
+
+"""
@@ -0,0 +1,37 @@
+"""
+Reader for `data_set.csv`, the labelled sample used to train the local model
+(`ai.local_model`) and to score the providers (`tests/model_metrics.py`).
+
+Columns are `service,text,expected_label,count_1h,count_24h`. Some texts
+contain unquoted commas, so a row is read from both ends: the service is the
+first field, the label and the counts are always the last three, and
+everything in between is the text.
+"""
+import csv
+from typing import Dict, List
+
+DATASET_PATH = "data_set.csv"
+
+
+def load_rows(path: str = DATASET_PATH) -> List[Dict[str, str]]:
+    rows = []
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        reader = csv.reader(fh)
+        next(reader, None)
+        for fields in reader:
+            if len(fields) < 5:
+                continue
+            rows.append({
+                "service": fields[0].strip(),
+                "text": ",".join(fields[1:-3]).strip(),
+                "expected_label": fields[-3].strip().lower(),
+                "count_1h": fields[-2].strip(),
+                "count_24h": fields[-1].strip(),
+            })
+    return rows
+
+
+def message_text(row: Dict[str, str]) -> str:
+    # a provider only gets the stored `content`: the CSV's service and event
+    # counts are not part of it, so training and scoring use the text alone
+    return (row.get("text") or "").strip()
@@ -0,0 +1,66 @@
+"""
+Sentence embeddings for similar-incident retrieval.
+
+A small local encoder (EMBEDDING_MODEL, MiniLM by default) runs on CPU in the
+worker: texts are sorted by length, encoded EMBEDDING_BATCH_SIZE at a time,
+mean-pooled over the attention mask and L2-normalized, so a dot product is a
+cosine similarity. transformers and torch are imported on first use only.
+"""
+import os
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", 128))
+
+_tokenizer = None
+_model = None
+
+
+def _load():
+    global _tokenizer, _model
+    if _model is None:
+        from transformers import AutoModel, AutoTokenizer
+
+        _tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+        _model = AutoModel.from_pretrained(EMBEDDING_MODEL).eval()
+    return _tokenizer, _model
+
+
+def dimension() -> int:
+    _, model = _load()
+    return int(model.config.hidden_size)
+
+
+def embed(texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+    """
+    Return a float32 array of shape (len(texts), dimension()) with unit rows.
+    """
+    import torch
+
+    tokenizer, model = _load()
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    out = np.zeros((len(texts), dimension()), dtype=np.float32)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = tokenizer(
+                [texts[i] for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=EMBEDDING_MAX_TOKENS,
+                return_tensors="pt",
+            )
+            hidden = model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            out[batch] = pooled.cpu().numpy()
+    return out
@@ -0,0 +1,96 @@
+"""
+Offline stand-in for the LLM clients (AI_PROVIDER=fake).
+
+It has the same `classify_severity` / `classify_severity_batch` interface as
+`ai.openai_client` and `ai.gemini_client`, but answers with keyword rules
+instead of a network call, so batching, parsing and fallbacks can be tested
+and benchmarked without API keys. Batched calls build the same instructions
+and numbered entries and return a JSON text answer for `ai.llm_batch` to parse.
+`usage` is estimated from the prompt length like the rate limiter does.
+
+FAKE_LLM_LATENCY_MS adds a fixed delay per request. FAKE_LLM_DROP_EVERY=n
+leaves every n-th entry of a batched answer out, to exercise the per-item
+fallback. `requests` counts the calls made by this process.
+"""
+import json
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ai import llm_batch, prompting
+from ai.rate_limit import estimate_tokens
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", 0))
+FAKE_LLM_DROP_EVERY = int(os.getenv("FAKE_LLM_DROP_EVERY", 0))
+
+RULES = [
+    ("critical", re.compile(r"\b(down|outage|unavailable|all users|connection failure|data loss|crash(ed)?)\b", re.I)),
+    ("high", re.compile(r"\b(timeout|timed out|5\d\d|rollback|degraded|refused|deadlock)\b", re.I)),
+    ("medium", re.compile(r"\b(slow|retry|retrying|pressure|latency|warning|lag)\b", re.I)),
+]
+_ENTRY = re.compile(r"^\[(\d+)\] (.*)$")
+
+requests = 0
+
+
+def _request() -> None:
+    global requests
+    requests += 1
+    if FAKE_LLM_LATENCY_MS:
+        time.sleep(FAKE_LLM_LATENCY_MS / 1000)
+
+
+def severity(message: str) -> str:
+    for label, pattern in RULES:
+        if pattern.search(message):
+            return label
+    return "low"
+
+
+def classify_severity(message: str, *, system_prompt: str, labels: List[str]) -> Dict[str, object]:
+    _request()
+    # providers prepend the instructions prompt, whose examples would match
+    label = severity(message.rsplit("Log entry:", 1)[-1])
+    return {
+        "label": label,
+        "scores": {label: 1.0},
+        "provider": "fake",
+        "usage": {"input_tokens": estimate_tokens(system_prompt, message, expected_output=0), "output_tokens": 8},
+        "raw": {"severity": label},
+    }
+
+
+def classify_severity_batch(
+    messages: List[str],
+    *,
+    system_prompt: str,
+    labels: List[str],
+    classify_one: Optional[Callable[[int], Dict[str, object]]] = None,
+) -> List[Dict[str, object]]:
+    def send(instructions: str, entries: str) -> Tuple[str, Dict[str, int]]:
+        _request()
+        answers = []
+        for line in entries.splitlines():
+            match = _ENTRY.match(line)
+            index = int(match.group(1))
+            if FAKE_LLM_DROP_EVERY and (index + 1) % FAKE_LLM_DROP_EVERY == 0:
+                continue
+            answers.append({"index": index, "severity": severity(match.group(2))})
+        text = json.dumps(answers)
+        return text, {
+            "input_tokens": estimate_tokens(instructions, entries, expected_output=0),
+            "output_tokens": estimate_tokens(text, expected_output=0),
+        }
+
+    return llm_batch.classify_batch(
+        messages,
+        send=send,
+        # a fallback item is a single message: it gets the single-object prompt
+        classify_one=classify_one or (
+            lambda i: classify_severity(messages[i], system_prompt=prompting.SYSTEM_PROMPT, labels=labels)
+        ),
+        system_prompt=system_prompt,
+        labels=labels,
+        provider="fake",
+    )
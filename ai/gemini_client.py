@@ -1,27 +1,61 @@
 import os
-import time
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import google.generativeai as genai
 from dotenv import load_dotenv
+from google.api_core import exceptions as google_exceptions
 
+from ai import llm_batch, prompting
 from ai.json_utils import extract_json_from_text
+from ai.rate_limit import ProviderRetryableError, acquire, estimate_tokens
 
 load_dotenv()
 
-_model: Optional[genai.GenerativeModel] = None
+# one model object per system instruction (the static prompt prefix)
+_models: Dict[str, genai.GenerativeModel] = {}
 
 
-def _get_model() -> genai.GenerativeModel:
-    global _model
-    if _model is None:
+def _get_model(system_instruction: str) -> genai.GenerativeModel:
+    model = _models.get(system_instruction)
+    if model is None:
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise RuntimeError("GEMINI_API_KEY environment variable is not set")
         genai.configure(api_key=api_key)
         model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-        _model = genai.GenerativeModel(model_name)
-    return _model
+        model = _models[system_instruction] = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+    return model
+
+
+def _generate(system_instruction: str, contents: str, expected_output: int = 32):
+    model = _get_model(system_instruction)
+    acquire("gemini", estimate_tokens(system_instruction, contents, expected_output=expected_output))
+    try:
+        return model.generate_content(
+            contents,
+            generation_config={
+                "response_mime_type": "application/json",
+            },
+        )
+    except google_exceptions.ResourceExhausted as exc:
+        raise ProviderRetryableError(f"Gemini rate limited: {exc}") from exc
+    except (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+    ) as exc:
+        raise ProviderRetryableError(f"Gemini unavailable: {exc}") from exc
+
+
+def _usage(response) -> Dict[str, int]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    return {
+        "input_tokens": int(getattr(usage, "prompt_token_count", 0) or 0),
+        "output_tokens": int(getattr(usage, "candidates_token_count", 0) or 0),
+        "cached_tokens": int(getattr(usage, "cached_content_token_count", 0) or 0),
+    }
 
 
 def classify_severity(message: str, *, system_prompt: str, labels: List[str]) -> Dict[str, object]:
@@ -29,31 +63,12 @@ def classify_severity(message: str, *, system_prompt: str, labels: List[str]) ->
     Call Gemini with instructions to return JSON containing the severity label and
     optional per-label scores.
     """
-    model = _get_model()
-    prompt = (
+    system_instruction = (
         f"{system_prompt}\n\n"
         "Respond with a JSON object: {\"severity\": <label>, \"scores\": {<label>: <score>}}. "
-        f"The severity must be one of: {', '.join(labels)}.\n\n"
-        f"Message:\n{message}"
+        f"The severity must be one of: {', '.join(labels)}."
     )
-
-    last_error: Optional[Exception] = None
-    for attempt in range(3):
-        try:
-            response = model.generate_content(
-                prompt,
-                generation_config={
-                    "response_mime_type": "application/json",
-                },
-            )
-            break
-        except Exception as exc:  # noqa: BLE001
-            last_error = exc
-            if attempt == 2:
-                raise
-            time.sleep(60)
-    else:  # pragma: no cover - defensive
-        raise last_error or RuntimeError("Gemini call failed without exception")
+    response = _generate(system_instruction, message)
 
     try:
         data = extract_json_from_text(response.text)
@@ -77,5 +92,35 @@ def classify_severity(message: str, *, system_prompt: str, labels: List[str]) ->
         "label": label,
         "scores": scores,
         "provider": "gemini",
+        "usage": _usage(response),
         "raw": response.to_dict() if hasattr(response, "to_dict") else response,
     }
+
+
+def classify_severity_batch(
+    messages: List[str],
+    *,
+    system_prompt: str,
+    labels: List[str],
+    classify_one: Optional[Callable[[int], Dict[str, object]]] = None,
+) -> List[Dict[str, object]]:
+    """
+    Classify several messages per Gemini call (see `ai.llm_batch`); entries
+    the model does not answer go through `classify_one(index)`, by default
+    `classify_severity`.
+    """
+    def send(instructions: str, entries: str) -> Tuple[str, Dict[str, int]]:
+        response = _generate(instructions, entries, expected_output=12 * (entries.count("\n") + 1))
+        return response.text, _usage(response)
+
+    return llm_batch.classify_batch(
+        messages,
+        send=send,
+        # a fallback item is a single message: it gets the single-object prompt
+        classify_one=classify_one or (
+            lambda i: classify_severity(messages[i], system_prompt=prompting.SYSTEM_PROMPT, labels=labels)
+        ),
+        system_prompt=system_prompt,
+        labels=labels,
+        provider="gemini",
+    )
@@ -0,0 +1,138 @@
+"""
+Multi-message LLM classification shared by the OpenAI, Gemini and fake clients.
+
+The worker collects up to LLM_BATCH_SIZE messages (`ai.batching`) and sends
+them in one request. The instructions are sent once, as a static system
+prefix that does not depend on the batch (`prompting.BATCH_SYSTEM_PROMPT`,
+which leaves the answer format to `instructions`); the messages follow as
+numbered entries (`[0] ...`, whitespace collapsed to one line each). The model answers with a JSON array of
+`{"index": n, "severity": label}` objects, read back by index. An entry is
+accepted only when its index is in range, is not repeated and its severity is
+one of the labels. Entries that are missing or invalid, or a whole response
+that cannot be parsed, fall back to one single-message call each. The
+request's token usage is split evenly over the entries it answered.
+`ProviderRetryableError`, from a batched call or a fallback, propagates with
+`partial` set to the results answered so far.
+"""
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ai.json_utils import extract_json_from_text
+from ai.rate_limit import ProviderRetryableError
+
+_WHITESPACE = re.compile(r"\s+")
+
+Result = Dict[str, object]
+# send(instructions, entries) -> (response text, token usage)
+Sender = Callable[[str, str], Tuple[str, Dict[str, int]]]
+
+
+def instructions(system_prompt: str, labels: Sequence[str]) -> str:
+    return (
+        f"{system_prompt.strip()}\n\n"
+        "You will receive numbered log entries. Classify each one independently. "
+        "Return ONLY a JSON array with one object per entry, in any order: "
+        '[{"index": <entry number>, "severity": "<label>"}]. '
+        f"The severity must be one of: {', '.join(labels)}."
+    )
+
+
+def entries(messages: Sequence[str]) -> str:
+    return "\n".join(f"[{i}] {_WHITESPACE.sub(' ', message).strip()}" for i, message in enumerate(messages))
+
+
+def parse_results(payload: Any, count: int, labels: Sequence[str]) -> List[Optional[Dict[str, object]]]:
+    """
+    Per-entry parsed `{"severity", "scores"}` or None where the response has
+    no valid answer for that entry.
+    """
+    results: List[Optional[Dict[str, object]]] = [None] * count
+    try:
+        data = extract_json_from_text(payload)
+    except ValueError:
+        return results
+    if isinstance(data, dict):
+        data = data.get("results") or data.get("items") or []
+    if not isinstance(data, list):
+        return results
+
+    seen, repeated = set(), set()
+    for position, item in enumerate(data):
+        if isinstance(item, str):
+            # a bare array of labels, matched by position
+            item = {"index": position, "severity": item}
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("index", position))
+        except (TypeError, ValueError):
+            continue
+        label = str(item.get("severity") or item.get("label") or "").strip().lower()
+        if not 0 <= index < count or label not in labels:
+            continue
+        if index in seen:
+            repeated.add(index)
+            continue
+        seen.add(index)
+        scores = item.get("scores")
+        results[index] = {"severity": label, "scores": scores if isinstance(scores, dict) else {}}
+    for index in repeated:
+        # answered twice: ask again rather than guess
+        results[index] = None
+    return results
+
+
+def classify_batch(
+    messages: Sequence[str],
+    *,
+    send: Sender,
+    classify_one: Callable[[int], Result],
+    system_prompt: str,
+    labels: Sequence[str],
+    provider: str,
+    batch_size: Optional[int] = None,
+) -> List[Result]:
+    """
+    Classify `messages` with one `send` per chunk of `batch_size` (all of
+    them in one request by default). Results
+    have the shape of the clients' `classify_severity`; entries the response
+    does not answer are `classify_one(index into messages)`. On
+    `ProviderRetryableError` the results so far are in its `partial`.
+    """
+    batch_size = batch_size or max(1, len(messages))
+    results: List[Optional[Result]] = [None] * len(messages)
+    try:
+        for start in range(0, len(messages), batch_size):
+            chunk = list(messages[start:start + batch_size])
+            text, usage = send(instructions(system_prompt, labels), entries(chunk))
+            parsed = parse_results(text, len(chunk), labels)
+            answered = sum(1 for item in parsed if item is not None)
+            share = {key: round(value / answered, 1) for key, value in usage.items()} if answered else {}
+            for index, item in enumerate(parsed):
+                if item is not None:
+                    results[start + index] = {
+                        "label": item["severity"],
+                        "scores": _float_scores(item["scores"]),
+                        "provider": provider,
+                        "usage": {**share, "batch_size": len(chunk)},
+                        "raw": {"batch_size": len(chunk), "index": index},
+                    }
+            # the fallbacks run after the answered entries are stored, so a
+            # throttled fallback does not lose them
+            for index, item in enumerate(parsed):
+                if item is None:
+                    results[start + index] = classify_one(start + index)
+    except ProviderRetryableError as exc:
+        exc.partial = results
+        raise
+    return results  # type: ignore[return-value]
+
+
+def _float_scores(raw_scores: Dict[str, Any]) -> Dict[str, float]:
+    scores: Dict[str, float] = {}
+    for key, value in raw_scores.items():
+        try:
+            scores[key] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return scores
@@ -0,0 +1,262 @@
+"""
+Fast local severity classifier: hashed n-gram features and a softmax model.
+
+Text is lower-cased and split into words; numbers become log2 magnitude
+buckets (`#3` for 5..8), so counts and status codes still carry signal without
+exploding the vocabulary. Features are word unigrams, word bigrams and
+character trigrams of each word, hashed with CRC32 into LOCAL_MODEL_FEATURES
+buckets. A linear softmax over `candidate_labels` is trained on those binary
+features with mini-batch AdaGrad in numpy.
+
+The artifact (LOCAL_MODEL_PATH, an `.npz`) holds the float16 weight matrix,
+the biases and the label order; with the default 2**18 buckets it is ~2 MiB.
+Classification is a gather-and-sum over a few dozen rows, so a core handles
+thousands of messages per second.
+
+Training data is `data_set.csv` (read with `ai.dataset`) plus `analysis.label`
+values already stored in Mongo by the other providers (analyses made by this
+model are skipped). Both are used as the bare message text, which is what the
+provider classifies: the CSV's service and event counts are not part of a
+stored message's `content`, so training on them would teach features that are
+never seen at serve time.
+
+Usage:
+    python -m ai.local_model train [--csv data_set.csv] [--mongo-limit 100000] [--epochs 20]
+    python -m ai.local_model predict "Database connection refused"
+"""
+import argparse
+import hashlib
+import math
+import os
+import re
+import sys
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from ai import dataset
+from ai.configs import candidate_labels
+
+load_dotenv()
+
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "data/local_model.npz")
+LOCAL_MODEL_FEATURES = int(os.getenv("LOCAL_MODEL_FEATURES", 1 << 18))
+
+_WORD = re.compile(r"[a-z]+|\d+")
+
+
+def _words(text: str) -> List[str]:
+    return [
+        word if not word.isdigit() else f"#{int(word).bit_length()}"
+        for word in _WORD.findall(text.lower())
+    ]
+
+
+def features(text: str, buckets: int = LOCAL_MODEL_FEATURES) -> np.ndarray:
+    """
+    Sorted unique hashed feature indices of `text`.
+    """
+    words = _words(text)
+    grams = [f"w:{w}" for w in words]
+    grams += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return np.unique(np.fromiter(
+        (zlib.crc32(gram.encode("utf-8")) % buckets for gram in grams),
+        dtype=np.int64,
+        count=len(grams),
+    ))
+
+
+class LocalModel:
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: Sequence[str]):
+        self.weights = weights
+        self.bias = bias.astype(np.float32)
+        self.labels = list(labels)
+        self._digest: Optional[str] = None
+
+    @property
+    def buckets(self) -> int:
+        return self.weights.shape[0]
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            sha = hashlib.sha1(self.weights.tobytes())
+            sha.update(self.bias.tobytes())
+            sha.update(",".join(self.labels).encode("utf-8"))
+            self._digest = sha.hexdigest()[:12]
+        return self._digest
+
+    def scores(self, text: str) -> np.ndarray:
+        idx = features(text, self.buckets)
+        logits = self.bias.copy()
+        if len(idx):
+            logits += self.weights[idx].astype(np.float32).sum(axis=0) / math.sqrt(len(idx))
+        logits -= logits.max()
+        probs = np.exp(logits)
+        return probs / probs.sum()
+
+    def classify(self, text: str) -> Dict[str, object]:
+        probs = self.scores(text)
+        score_map = {label: float(p) for label, p in zip(self.labels, probs)}
+        label = self.labels[int(np.argmax(probs))]
+        return {
+            "label": label,
+            "scores": score_map,
+            "confidence": score_map[label],
+            "provider": "local",
+            "raw": {"model": os.path.basename(LOCAL_MODEL_PATH)},
+        }
+
+    def save(self, path: str = LOCAL_MODEL_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(tmp, weights=self.weights.astype(np.float16), bias=self.bias,
+                            labels=np.array(self.labels))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_MODEL_PATH) -> "LocalModel":
+        with np.load(path) as data:
+            return cls(data["weights"], data["bias"], [str(label) for label in data["labels"]])
+
+
+def train(
+    texts: Sequence[str],
+    labels: Sequence[str],
+    epochs: int = 20,
+    learning_rate: float = 0.5,
+    l2: float = 1e-6,
+    batch_size: int = 256,
+    buckets: int = LOCAL_MODEL_FEATURES,
+    seed: int = 0,
+) -> LocalModel:
+    """
+    Fit the softmax model with mini-batch AdaGrad; classes are weighted by
+    inverse frequency so rare `critical` examples are not drowned out.
+    """
+    label_order = list(candidate_labels)
+    y = np.array([label_order.index(label) for label in labels], dtype=np.int64)
+    rows = [features(text, buckets) for text in texts]
+    n_classes = len(label_order)
+
+    counts = np.bincount(y, minlength=n_classes).astype(np.float32)
+    class_weight = np.where(counts > 0, len(y) / (n_classes * np.maximum(counts, 1)), 0.0).astype(np.float32)
+
+    weights = np.zeros((buckets, n_classes), dtype=np.float32)
+    bias = np.zeros(n_classes, dtype=np.float32)
+    grad_sq = np.full((buckets, n_classes), 1e-8, dtype=np.float32)
+    bias_sq = np.full(n_classes, 1e-8, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+
+    for _ in range(epochs):
+        order = rng.permutation(len(rows))
+        for start in range(0, len(rows), batch_size):
+            batch = order[start:start + batch_size]
+            idx = [rows[i] for i in batch]
+            lengths = np.array([len(r) for r in idx])
+            flat = np.concatenate(idx) if idx else np.zeros(0, dtype=np.int64)
+            owner = np.repeat(np.arange(len(batch)), lengths)
+            scale = (1.0 / np.sqrt(np.maximum(lengths, 1))).astype(np.float32)
+
+            logits = np.zeros((len(batch), n_classes), dtype=np.float32)
+            np.add.at(logits, owner, weights[flat])
+            logits = logits * scale[:, None] + bias
+            logits -= logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+            probs[np.arange(len(batch)), y[batch]] -= 1.0
+            delta = probs * class_weight[y[batch]][:, None] / len(batch)
+
+            touched, inverse = np.unique(flat, return_inverse=True)
+            grad = np.zeros((len(touched), n_classes), dtype=np.float32)
+            np.add.at(grad, inverse, delta[owner] * scale[owner][:, None])
+            grad += l2 * weights[touched]
+            grad_sq[touched] += grad ** 2
+            weights[touched] -= learning_rate * grad / np.sqrt(grad_sq[touched])
+
+            bias_grad = delta.sum(axis=0)
+            bias_sq += bias_grad ** 2
+            bias -= learning_rate * bias_grad / np.sqrt(bias_sq)
+
+    return LocalModel(weights, bias, label_order)
+
+
+def csv_examples(path: str) -> Tuple[List[str], List[str]]:
+    texts, labels = [], []
+    for row in dataset.load_rows(path):
+        if row["expected_label"] in candidate_labels:
+            texts.append(dataset.message_text(row))
+            labels.append(row["expected_label"])
+    return texts, labels
+
+
+def mongo_examples(limit: int) -> Tuple[List[str], List[str]]:
+    from api.services import get_sync_messages_collection
+
+    cursor = get_sync_messages_collection().find(
+        {"analysis.label": {"$in": list(candidate_labels)}, "analysis.provider": {"$ne": "local"}},
+        {"content": 1, "analysis.label": 1},
+    ).sort("_id", -1).limit(limit)
+    texts, labels = [], []
+    for doc in cursor:
+        texts.append(doc.get("content") or "")
+        labels.append(doc["analysis"]["label"])
+    return texts, labels
+
+
+_model: Optional[LocalModel] = None
+
+
+def get_model() -> LocalModel:
+    global _model
+    if _model is None:
+        _model = LocalModel.load(LOCAL_MODEL_PATH)
+    return _model
+
+
+def model_id() -> str:
+    # part of the cache keys: a retrained model gets a new id, so analyses
+    # of the previous weights are not reused
+    return f"{os.path.basename(LOCAL_MODEL_PATH)}:{get_model().digest}"
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Train or query the local severity classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help=f"train from the CSV and stored analyses, save to {LOCAL_MODEL_PATH}")
+    p_train.add_argument("--csv", default=dataset.DATASET_PATH)
+    p_train.add_argument("--mongo-limit", type=int, default=100_000, help="0 to skip stored analyses")
+    p_train.add_argument("--epochs", type=int, default=20)
+    p_predict = sub.add_parser("predict", help="classify one message")
+    p_predict.add_argument("text")
+    args = parser.parse_args(argv)
+
+    if args.command == "predict":
+        print(get_model().classify(args.text))
+        return 0
+
+    texts, labels = csv_examples(args.csv) if args.csv else ([], [])
+    if args.mongo_limit:
+        try:
+            stored_texts, stored_labels = mongo_examples(args.mongo_limit)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[local_model] Skipping stored analyses: {exc}")
+        else:
+            texts += stored_texts
+            labels += stored_labels
+    if not texts:
+        print("[local_model] No training examples")
+        return 1
+    model = train(texts, labels, epochs=args.epochs)
+    model.save(LOCAL_MODEL_PATH)
+    print(f"Trained on {len(texts)} examples, saved to {LOCAL_MODEL_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,20 @@
 import json
 import os
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
-from openai import OpenAI, OpenAIError
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    OpenAI,
+    OpenAIError,
+    RateLimitError,
+)
 
+from ai import llm_batch, prompting
 from ai.json_utils import extract_json_from_text
+from ai.rate_limit import ProviderRetryableError, acquire, estimate_tokens
 
 load_dotenv()
 
@@ -18,24 +27,55 @@ def _get_client() -> OpenAI:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY environment variable is not set")
-        _client = OpenAI(api_key=api_key)
+        # retries are rescheduled by Celery instead of sleeping in the SDK
+        _client = OpenAI(api_key=api_key, max_retries=0)
     return _client
 
 
+def _retry_after(exc: RateLimitError) -> Optional[float]:
+    try:
+        return float(exc.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _create(system: str, user: str, expected_output: int = 32):
+    client = _get_client()
+    acquire("openai", estimate_tokens(system, user, expected_output=expected_output))
+    try:
+        # the system message is identical across calls, so OpenAI can serve
+        # it from its prompt cache
+        return client.responses.create(
+            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            input=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+        )
+    except RateLimitError as exc:
+        raise ProviderRetryableError(f"OpenAI rate limited: {exc}", retry_after=_retry_after(exc)) from exc
+    except (APIConnectionError, APITimeoutError, InternalServerError) as exc:
+        raise ProviderRetryableError(f"OpenAI unavailable: {exc}") from exc
+
+
+def _usage(response) -> Dict[str, int]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "input_tokens": int(getattr(usage, "input_tokens", 0) or 0),
+        "output_tokens": int(getattr(usage, "output_tokens", 0) or 0),
+        "cached_tokens": int(getattr(details, "cached_tokens", 0) or 0),
+    }
+
+
 def classify_severity(message: str, *, system_prompt: str, labels: List[str]) -> Dict[str, object]:
     """
     Ask the OpenAI Responses API to classify the message and return a structured
     result that mirrors the HuggingFace zero-shot classifier output.
     """
-    client = _get_client()
-
-    response = client.responses.create(
-        model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": message},
-        ],
-    )
+    response = _create(system_prompt, message)
 
     try:
         data = extract_json_from_text(response.output_text)
@@ -59,5 +99,35 @@ def classify_severity(message: str, *, system_prompt: str, labels: List[str]) ->
         "label": label,
         "scores": scores,
         "provider": "openai",
+        "usage": _usage(response),
         "raw": response.model_dump(),
     }
+
+
+def classify_severity_batch(
+    messages: List[str],
+    *,
+    system_prompt: str,
+    labels: List[str],
+    classify_one: Optional[Callable[[int], Dict[str, object]]] = None,
+) -> List[Dict[str, object]]:
+    """
+    Classify several messages per Responses API call (see `ai.llm_batch`);
+    entries the model does not answer go through `classify_one(index)`, by
+    default `classify_severity`.
+    """
+    def send(instructions: str, entries: str) -> Tuple[str, Dict[str, int]]:
+        response = _create(instructions, entries, expected_output=12 * (entries.count("\n") + 1))
+        return response.output_text, _usage(response)
+
+    return llm_batch.classify_batch(
+        messages,
+        send=send,
+        # a fallback item is a single message: it gets the single-object prompt
+        classify_one=classify_one or (
+            lambda i: classify_severity(messages[i], system_prompt=prompting.SYSTEM_PROMPT, labels=labels)
+        ),
+        system_prompt=system_prompt,
+        labels=labels,
+        provider="openai",
+    )
@@ -0,0 +1,98 @@
+"""
+Celery worker hooks for the HuggingFace provider.
+
+HF_PRELOAD=1 loads the zero-shot model in the worker parent (`worker_init`)
+before the prefork pool is created. Weights are put in eval mode, detached from
+autograd and, with HF_SHARE_MEMORY=1, moved to shared memory, and `gc.freeze()`
+keeps the garbage collector from touching (and so copying) the preloaded
+objects. Children then share the weight pages instead of each loading a copy.
+
+TORCH_NUM_THREADS bounds the intra-op threads of each child; when unset with
+HF_PRELOAD=1 it defaults to cpu_count // concurrency so children do not
+oversubscribe cores. With TORCH_NUM_THREADS set, each child imports torch at
+start to apply it, so the limit holds even when the model is only loaded on
+the first task.
+"""
+import gc
+import os
+import sys
+from typing import Optional
+
+from celery.signals import worker_init, worker_process_init
+
+from ai import providers
+
+HF_PRELOAD = os.getenv("HF_PRELOAD", "0") == "1"
+HF_SHARE_MEMORY = os.getenv("HF_SHARE_MEMORY", "1") == "1"
+
+_worker_concurrency: Optional[int] = None
+
+
+def preload_classifier(share_memory: bool = HF_SHARE_MEMORY):
+    """
+    Load the pipeline and freeze its weights so forked children can share them.
+    Must not run inference in the parent: that would start torch thread pools
+    that do not survive fork.
+    """
+    import torch
+
+    from ai.bert_model import get_classifier
+
+    classifier = get_classifier()
+    model = classifier.model
+    # onnxruntime sessions (HF_INFERENCE_MODE=onnx) hold no torch weights
+    if isinstance(model, torch.nn.Module):
+        model.eval()
+        for param in model.parameters():
+            param.requires_grad_(False)
+        if share_memory:
+            model.share_memory()
+    gc.collect()
+    gc.freeze()
+    return classifier
+
+
+def torch_threads_per_child(concurrency: Optional[int] = None) -> Optional[int]:
+    configured = os.getenv("TORCH_NUM_THREADS")
+    if configured:
+        return max(1, int(configured))
+    if HF_PRELOAD and concurrency:
+        return max(1, (os.cpu_count() or 1) // concurrency)
+    return None
+
+
+def limit_torch_threads(threads: Optional[int], import_torch: bool = False) -> None:
+    # unless `import_torch`, only touch torch if this process already uses it
+    if not threads:
+        return
+    torch = sys.modules.get("torch")
+    if torch is None and import_torch:
+        try:
+            import torch
+        except ImportError:
+            return
+    if torch is None:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+@worker_init.connect
+def _preload_in_parent(sender=None, **kwargs):
+    global _worker_concurrency
+    _worker_concurrency = getattr(sender, "concurrency", None)
+    if HF_PRELOAD and providers.selected_provider() == "huggingface":
+        preload_classifier()
+        print(f"[preload] Zero-shot model loaded in worker parent (share_memory={HF_SHARE_MEMORY})")
+
+
+@worker_process_init.connect
+def _configure_child(**kwargs):
+    # an explicit TORCH_NUM_THREADS must also bind models loaded lazily later
+    limit_torch_threads(
+        torch_threads_per_child(_worker_concurrency),
+        import_torch=bool(os.getenv("TORCH_NUM_THREADS")),
+    )
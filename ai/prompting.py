@@ -0,0 +1,74 @@
+"""
+Prompt building for the LLM providers.
+
+Every request is split into a static part and a per-message part:
+
+* `SYSTEM_PROMPT` - `system_prompt` followed by the severity criteria. It is
+  byte-identical for every call, so it can be served from the providers'
+  prompt caches (OpenAI caches repeated prefixes; Gemini receives it as the
+  model's `system_instruction`).
+* `BATCH_SYSTEM_PROMPT` - the same for multi-message requests
+  (`ai.llm_batch`), without the single JSON object answer format, which
+  would contradict the array the batch asks for.
+* `user_message(content, stats)` - the log entry, cut to
+  PROMPT_MAX_CONTENT_TOKENS (head and tail kept, the middle elided), and with
+  PROMPT_INCLUDE_STATS=1 the compact `context_stats` snippet from
+  `api.stats.pack_prompt_snippet`.
+
+Token counts use the same ~4 characters per token estimate as the rate
+limiter; the providers' own counts are recorded as `analysis.usage`.
+"""
+import os
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from ai.configs import batch_system_prompt, severity_criteria, system_prompt
+
+load_dotenv()
+
+PROMPT_INCLUDE_STATS = os.getenv("PROMPT_INCLUDE_STATS", "0") == "1"
+PROMPT_MAX_CONTENT_TOKENS = int(os.getenv("PROMPT_MAX_CONTENT_TOKENS", 512))
+
+CHARS_PER_TOKEN = 4
+_ELISION = " [...{} chars omitted...] "
+
+SYSTEM_PROMPT = f"{system_prompt.strip()}\n\n{severity_criteria.strip()}\n"
+BATCH_SYSTEM_PROMPT = f"{batch_system_prompt.strip()}\n\n{severity_criteria.strip()}\n"
+
+
+def truncate(content: str, max_tokens: Optional[int] = None) -> str:
+    """
+    Cut `content` to about `max_tokens`, keeping the first two thirds and the
+    last third of the budget (stack traces end with the actual error).
+    """
+    budget = (max_tokens or PROMPT_MAX_CONTENT_TOKENS) * CHARS_PER_TOKEN
+    if len(content) <= budget:
+        return content
+    head = budget * 2 // 3
+    tail = budget - head
+    return content[:head] + _ELISION.format(len(content) - budget) + content[-tail:]
+
+
+def stats_snippet(stats: Optional[Dict[str, Any]]) -> str:
+    if not PROMPT_INCLUDE_STATS or not stats or "windows" not in stats:
+        return ""
+    from api.stats import pack_prompt_snippet
+
+    return pack_prompt_snippet(stats)
+
+
+def user_message(content: str, stats: Optional[Dict[str, Any]] = None) -> str:
+    message = f"Log entry:\n{truncate(content)}"
+    snippet = stats_snippet(stats)
+    if snippet:
+        message += f"\n\n{snippet}"
+    return message
+
+
+def entry(content: str, stats: Optional[Dict[str, Any]] = None) -> str:
+    """
+    One entry of a multi-message request (`ai.llm_batch`).
+    """
+    snippet = stats_snippet(stats)
+    return f"{truncate(content)} ({snippet})" if snippet else truncate(content)
@@ -0,0 +1,227 @@
+"""
+Lazy registry of classification providers.
+
+Provider adapters are registered by name and their client modules (torch /
+transformers, openai, google-generativeai) are imported on first use only, so
+processes that never classify (the API) or use another provider never load
+them.
+"""
+import importlib
+import os
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+from ai import prompting
+from ai.configs import candidate_labels, hypothesis_template, prompt
+from ai.rate_limit import ProviderRetryableError
+
+Classifier = Callable[..., Dict[str, object]]
+Stats = Optional[Dict[str, Any]]
+
+DEFAULT_PROVIDER = "huggingface"
+HF_INFERENCE_BATCH_SIZE = int(os.getenv("HF_INFERENCE_BATCH_SIZE", 8))
+
+_registry: Dict[str, Classifier] = {}
+_modules: Dict[str, ModuleType] = {}
+
+
+def register(name: str) -> Callable[[Classifier], Classifier]:
+    def decorator(func: Classifier) -> Classifier:
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def _load(module_path: str) -> ModuleType:
+    module = _modules.get(module_path)
+    if module is None:
+        module = _modules[module_path] = importlib.import_module(module_path)
+    return module
+
+
+def selected_provider() -> str:
+    return os.getenv("AI_PROVIDER", DEFAULT_PROVIDER).strip().lower()
+
+
+def available() -> List[str]:
+    return sorted(_registry)
+
+
+def get_classifier(name: str) -> Classifier:
+    """
+    Unknown names fall back to the HuggingFace pipeline, as before.
+    """
+    return _registry.get(name) or _registry[DEFAULT_PROVIDER]
+
+
+def classify(name: str, content: str, stats: Stats = None) -> Dict[str, object]:
+    """
+    Classify with provider `name`; the message's `context_stats` are passed to
+    the providers that can put them in the prompt (LLMs and the cascade).
+    """
+    if name in STATS_AWARE:
+        return get_classifier(name)(content, stats)
+    return get_classifier(name)(content)
+
+
+def _select_label(scores: Dict[str, float], *, fallback: str = "unknown") -> str:
+    if scores:
+        return max(scores.items(), key=lambda item: item[1])[0]
+    return fallback
+
+
+@register("huggingface")
+def classify_with_huggingface(content: str, mode: Optional[str] = None) -> Dict[str, object]:
+    # `mode` overrides HF_INFERENCE_MODE, e.g. to compare modes in one process
+    raw_result = _load("ai.bert_model").get_classifier(mode)(
+        prompt + content,
+        candidate_labels=candidate_labels,
+        hypothesis_template=hypothesis_template,
+    )
+    return _huggingface_analysis(raw_result)
+
+
+def classify_batch_with_huggingface(contents: List[str]) -> List[Dict[str, object]]:
+    """
+    Run the zero-shot pipeline over a whole batch. Inputs are sorted by length
+    so each forward pass pads sequences of similar size, then results are put
+    back in the original order.
+    """
+    order = sorted(range(len(contents)), key=lambda i: len(contents[i]))
+    raw_results = _load("ai.bert_model").get_classifier()(
+        [prompt + contents[i] for i in order],
+        candidate_labels=candidate_labels,
+        hypothesis_template=hypothesis_template,
+        batch_size=HF_INFERENCE_BATCH_SIZE,
+    )
+    if isinstance(raw_results, dict):
+        raw_results = [raw_results]
+
+    results: List[Dict[str, object]] = [{} for _ in contents]
+    for position, raw_result in zip(order, raw_results):
+        results[position] = _huggingface_analysis(raw_result)
+    return results
+
+
+def _huggingface_analysis(raw_result: Dict[str, object]) -> Dict[str, object]:
+    labels = raw_result.get("labels", [])
+    scores = raw_result.get("scores", [])
+    score_map = {label: float(score) for label, score in zip(labels, scores)}
+    label = _select_label(score_map)
+
+    return {
+        "label": label,
+        "scores": score_map,
+        "confidence": score_map.get(label),
+        "provider": "huggingface",
+        "raw": raw_result,
+    }
+
+
+LLM_CLIENTS = {
+    "openai": "ai.openai_client",
+    "gemini": "ai.gemini_client",
+    "fake": "ai.fake_client",
+}
+
+
+def _llm_analysis(response: Dict[str, object], provider: str) -> Dict[str, object]:
+    scores = {
+        key: float(value)
+        for key, value in (response.get("scores") or {}).items()
+        if key in candidate_labels
+    }
+    label = _select_label(scores, fallback=response.get("label", "unknown"))
+
+    analysis = {
+        "label": label,
+        "scores": scores,
+        "confidence": scores.get(label),
+        "provider": response.get("provider", provider),
+        "raw": response.get("raw", response),
+    }
+    if response.get("usage"):
+        analysis["usage"] = response["usage"]
+    return analysis
+
+
+def _llm_response(provider: str, content: str, stats: Stats = None) -> Dict[str, object]:
+    # static instructions as the system prompt, only the entry (and stats)
+    # in the per-message part; see ai.prompting
+    return _load(LLM_CLIENTS[provider]).classify_severity(
+        prompting.user_message(content, stats),
+        system_prompt=prompting.SYSTEM_PROMPT,
+        labels=candidate_labels,
+    )
+
+
+@register("openai")
+def classify_with_openai(content: str, stats: Stats = None) -> Dict[str, object]:
+    return _llm_analysis(_llm_response("openai", content, stats), "openai")
+
+
+@register("gemini")
+def classify_with_gemini(content: str, stats: Stats = None) -> Dict[str, object]:
+    return _llm_analysis(_llm_response("gemini", content, stats), "gemini")
+
+
+@register("fake")
+def classify_with_fake(content: str, stats: Stats = None) -> Dict[str, object]:
+    return _llm_analysis(_llm_response("fake", content, stats), "fake")
+
+
+def classify_batch(provider: str, contents: List[str], stats: Optional[List[Stats]] = None) -> List[Dict[str, object]]:
+    """
+    Classify a micro-batch: LLM providers pack it into multi-message requests
+    (`ai.llm_batch`), falling back to the single-message call per entry; any
+    other provider goes through the batched HuggingFace pipeline. A
+    `ProviderRetryableError` carries the analyses answered so far in `partial`.
+    """
+    if provider not in LLM_CLIENTS:
+        return classify_batch_with_huggingface(contents)
+    stats = stats or [None] * len(contents)
+    try:
+        responses = _load(LLM_CLIENTS[provider]).classify_severity_batch(
+            [prompting.entry(content, item_stats) for content, item_stats in zip(contents, stats)],
+            system_prompt=prompting.BATCH_SYSTEM_PROMPT,
+            labels=candidate_labels,
+            classify_one=lambda i: _llm_response(provider, contents[i], stats[i]),
+        )
+    except ProviderRetryableError as exc:
+        if exc.partial is not None:
+            exc.partial = [
+                _llm_analysis(response, provider) if response is not None else None for response in exc.partial
+            ]
+        raise
+    return [_llm_analysis(response, provider) for response in responses]
+
+
+@register("local")
+def classify_with_local(content: str) -> Dict[str, object]:
+    return _load("ai.local_model").get_model().classify(content)
+
+
+@register("cascade")
+def classify_with_cascade(content: str, stats: Stats = None) -> Dict[str, object]:
+    return _load("ai.cascade").classify(content, stats)
+
+
+STATS_AWARE = {*LLM_CLIENTS, "cascade"}
+
+
+def model_name(provider: str) -> str:
+    if provider == "cascade":
+        return _load("ai.cascade").model_name()
+    if provider == "openai":
+        return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    if provider == "gemini":
+        return os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    if provider == "fake":
+        return "fake"
+    if provider == "local":
+        return _load("ai.local_model").model_id()
+    name = os.getenv("AI_MODEL", "distilbert-base-uncased-finetuned-sst-2-english")
+    # quantized / exported runs may score slightly differently: keep their
+    # cached analyses apart
+    mode = os.getenv("HF_INFERENCE_MODE", "default").strip().lower()
+    return name if mode == "default" else f"{name}:{mode}"
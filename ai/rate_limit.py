@@ -0,0 +1,133 @@
+"""
+Provider rate limiting shared by all workers, and retry helpers.
+
+Each LLM provider has two Redis token buckets, one in requests/min and one in
+tokens/min (`<PROVIDER>_RPM` / `<PROVIDER>_TPM`, 0 or unset disables a bucket).
+Both are checked and debited atomically in one Lua script using the Redis
+clock. A call that would have to wait longer than RATE_LIMIT_MAX_INLINE_WAIT
+seconds raises `ProviderRetryableError` instead of sleeping, and
+`analyze_message` turns that into a Celery retry with a countdown.
+"""
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_INLINE_WAIT = float(os.getenv("RATE_LIMIT_MAX_INLINE_WAIT", 1.0))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 2.0))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 300.0))
+
+KEY_PREFIX = "ratelimit"
+
+# KEYS: buckets; ARGV: per bucket capacity, refill per ms, requested amount.
+# Returns 0 when all buckets were debited, otherwise the ms to wait.
+_TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local wait = 0
+local levels = {}
+for i = 1, #KEYS do
+  local cap = tonumber(ARGV[(i - 1) * 3 + 1])
+  local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+  local need = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), cap)
+  local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local tokens = tonumber(data[1]) or cap
+  local ts = tonumber(data[2]) or now
+  tokens = math.min(cap, tokens + math.max(0, now - ts) * rate)
+  levels[i] = tokens
+  if tokens < need then
+    wait = math.max(wait, math.ceil((need - tokens) / rate))
+  end
+end
+if wait == 0 then
+  for i = 1, #KEYS do
+    local cap = tonumber(ARGV[(i - 1) * 3 + 1])
+    local need = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), cap)
+    redis.call('HSET', KEYS[i], 'tokens', levels[i] - need, 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], 120000)
+  end
+end
+return wait
+"""
+
+_redis: Optional[redis.Redis] = None
+_script = None
+
+
+class ProviderRetryableError(RuntimeError):
+    """
+    Throttling or a transient provider failure; the call may succeed later.
+    `retry_after` is the provider's (or limiter's) hint in seconds, if any.
+    `fallback` is an analysis to store instead of `unknown` once retries are
+    exhausted (the cascade's lower-tier answer), if any. `partial` is set by
+    batch calls to the per-message results answered before the error (None
+    where a message still has no answer), so only those are retried.
+    """
+
+    def __init__(
+        self, message: str, retry_after: Optional[float] = None, fallback: Optional[Dict[str, object]] = None
+    ):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.fallback = fallback
+        self.partial: Optional[List[Optional[Dict[str, object]]]] = None
+
+
+def _get_script():
+    global _redis, _script
+    if _script is None:
+        _redis = redis.Redis.from_url(os.environ["REDIS_URL"])
+        _script = _redis.register_script(_TOKEN_BUCKET_LUA)
+    return _script
+
+
+def _limit(provider: str, suffix: str) -> int:
+    return int(os.getenv(f"{provider.upper()}_{suffix}", 0) or 0)
+
+
+def estimate_tokens(*texts: str, expected_output: int = 32) -> int:
+    # ~4 characters per token for English text is close enough for budgeting
+    return sum(len(text or "") for text in texts) // 4 + expected_output
+
+
+def acquire(provider: str, tokens: int) -> None:
+    """
+    Take one request and `tokens` tokens from the provider buckets, sleeping
+    for short waits and raising ProviderRetryableError for long ones.
+    """
+    keys: List[str] = []
+    args: List[float] = []
+    for suffix, amount in (("RPM", 1), ("TPM", tokens)):
+        per_minute = _limit(provider, suffix)
+        if per_minute > 0:
+            keys.append(f"{KEY_PREFIX}:{provider}:{suffix.lower()}")
+            args.extend([per_minute, per_minute / 60_000, amount])
+    if not keys:
+        return
+
+    script = _get_script()
+    deadline = time.monotonic() + MAX_INLINE_WAIT
+    while True:
+        wait = int(script(keys=keys, args=args)) / 1000
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise ProviderRetryableError(f"{provider} rate limit reached", retry_after=wait)
+        time.sleep(wait)
+
+
+def backoff_delay(retries: int, retry_after: Optional[float] = None) -> float:
+    """
+    Exponential backoff with jitter for the `retries`-th retry, never shorter
+    than the provider's `retry_after` hint.
+    """
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** retries))
+    delay = random.uniform(ceiling / 2, ceiling)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
@@ -1,112 +1,218 @@
 import os
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 from bson import ObjectId
-from api.services import get_sync_messages_collection
+from pymongo import UpdateOne
+from api.rollups import label_ops
+from api.services import get_sync_messages_collection, get_sync_rollups_collection
+from api.stats import group_value
 from celery_app import celery_app
 from notification_service.tasks import schedule_immediate_if_critical
 
-from ai.bert_model import classifier
-from ai.configs import candidate_labels, hypothesis_template, prompt, system_prompt
-from ai.openai_client import classify_severity as classify_with_openai
-from ai.gemini_client import classify_severity as classify_with_gemini
-
-def _select_label(scores: Dict[str, float], *, fallback: str = "unknown") -> str:
-    if scores:
-        return max(scores.items(), key=lambda item: item[1])[0]
-    return fallback
-
-
-def _classify_with_huggingface(content: str) -> Dict[str, object]:
-    raw_result = classifier(
-        prompt + content,
-        candidate_labels=candidate_labels,
-        hypothesis_template=hypothesis_template,
-    )
-
-    labels = raw_result.get("labels", [])
-    scores = raw_result.get("scores", [])
-    score_map = {label: float(score) for label, score in zip(labels, scores)}
-    label = _select_label(score_map)
-
-    return {
-        "label": label,
-        "scores": score_map,
-        "confidence": score_map.get(label),
-        "provider": "huggingface",
-        "raw": raw_result,
-    }
-
-
-def _classify_with_openai(content: str) -> Dict[str, object]:
-    response = classify_with_openai(
-        prompt + content,
-        system_prompt=system_prompt,
-        labels=candidate_labels,
-    )
-
-    scores = {
-        key: float(value)
-        for key, value in (response.get("scores") or {}).items()
-        if key in candidate_labels
-    }
-    label = _select_label(scores, fallback=response.get("label", "unknown"))
-
-    return {
-        "label": label,
-        "scores": scores,
-        "confidence": scores.get(label),
-        "provider": response.get("provider", "openai"),
-        "raw": response.get("raw", response),
-    }
-
-
-def _classify_with_gemini(content: str) -> Dict[str, object]:
-    response = classify_with_gemini(
-        prompt + content,
-        system_prompt=system_prompt,
-        labels=candidate_labels,
-    )
-
-    scores = {
-        key: float(value)
-        for key, value in (response.get("scores") or {}).items()
-        if key in candidate_labels
-    }
-    label = _select_label(scores, fallback=response.get("label", "unknown"))
-
-    return {
-        "label": label,
-        "scores": scores,
-        "confidence": scores.get(label),
-        "provider": response.get("provider", "gemini"),
-        "raw": response.get("raw", response),
-    }
-
-
-def _classify_message(content: str) -> Dict[str, object]:
-    provider = os.getenv("AI_PROVIDER", "huggingface").strip().lower()
-
-    if provider == "openai":
-        return _classify_with_openai(content)
-
-    if provider == "gemini":
-        return _classify_with_gemini(content)
-
-    return _classify_with_huggingface(content)
-
-
-@celery_app.task(name="ai.tasks.analyze_message")
-def analyze_message(message_id: str):
+from ai import batching, preload  # noqa: F401  (registers worker signals)
+from ai import cache as classification_cache
+from ai import providers
+from ai.prompting import PROMPT_INCLUDE_STATS
+from ai.rate_limit import ProviderRetryableError, backoff_delay
+from ai.configs import candidate_labels
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+
+# fields read to classify a stored message
+CLASSIFY_PROJECTION = {"content": 1, "fingerprint": 1, "cluster_id": 1, "created_at": 1, "analysis.label": 1}
+if PROMPT_INCLUDE_STATS:
+    CLASSIFY_PROJECTION["context_stats"] = 1
+
+
+def _classify_message(
+    content: str, fingerprint: Optional[str] = None, stats: Optional[Dict[str, object]] = None
+) -> Dict[str, object]:
+    """
+    Classify `content` with the configured provider. When the message
+    `fingerprint` (its GROUPING_KEY value) is known, a cached analysis of an
+    identical or near-duplicate message is returned (with `cached: True`)
+    instead of calling the model again. `stats` (the message's
+    `context_stats`) go into LLM prompts with PROMPT_INCLUDE_STATS=1.
+    """
+    provider = providers.selected_provider()
+    model = providers.model_name(provider)
+
+    cached = classification_cache.get(fingerprint, provider, model) if fingerprint else None
+    if cached is not None:
+        cached["cached"] = True
+        return cached
+
+    analysis = providers.classify(provider, content, stats)
+    if fingerprint and analysis.get("label") in candidate_labels:
+        classification_cache.put(fingerprint, provider, model, analysis)
+    return analysis
+
+
+def _record_labels(docs: List[Dict[str, object]], analyses: Dict[str, Dict[str, object]]) -> None:
+    # only a message's first analysis is counted, so a re-delivered
+    # analyze_message does not count the same message twice
+    ops = []
+    for doc in docs:
+        analysis = analyses.get(str(doc["_id"]))
+        if analysis and not doc.get("analysis"):
+            ops.extend(label_ops(group_value(doc), doc.get("created_at"), analysis.get("label")))
+    if not ops:
+        return
+    try:
+        get_sync_rollups_collection().bulk_write(ops, ordered=False)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[rollups] Failed to record labels for {len(docs)} messages: {exc}")
+
+
+def _batch_item(message_id: str, attempt: int = 0) -> str:
+    # the attempt travels with the id through the shared pending list
+    return f"{message_id}#{attempt}" if attempt else message_id
+
+
+def _parse_batch_item(item: str) -> Tuple[str, int]:
+    message_id, _, attempt = item.partition("#")
+    return message_id, int(attempt or 0)
+
+
+def _republish(attempts: Dict[str, int], retry_after: Optional[float] = None) -> List[str]:
+    """
+    Hand message ids back to `analyze_message` with the next attempt number
+    and a growing backoff. Returns the ids that are out of attempts.
+    """
+    exhausted = []
+    for message_id, attempt in attempts.items():
+        if attempt >= LLM_MAX_RETRIES:
+            exhausted.append(message_id)
+            continue
+        analyze_message.apply_async(
+            (message_id,), {"attempt": attempt + 1},
+            countdown=backoff_delay(attempt, retry_after),
+        )
+    return exhausted
+
+
+def _requeue_batch(items: List[str], exc: Exception) -> None:
+    # a batch that failed outside the provider call (e.g. MongoDB errors)
+    exhausted = _republish(dict(_parse_batch_item(item) for item in items))
+    print(f"[batch] Failed to process batch of {len(items)} messages, re-published: {exc}")
+    if exhausted:
+        print(f"[batch] Giving up on {len(exhausted)} messages after {LLM_MAX_RETRIES} attempts")
+
+
+def _analyze_batch(items: List[str]) -> Dict[str, Dict[str, object]]:
+    """
+    Classify a micro-batch collected by `ai.batching`: cache hits are reused,
+    the rest go through one batched pipeline call (or multi-message LLM
+    request), and all analyses are written back with a single `bulk_write`.
+
+    A throttled provider call keeps the analyses the batch already returned
+    and re-publishes the unanswered misses as `analyze_message` with the next
+    attempt number and a growing backoff; after LLM_MAX_RETRIES attempts they
+    are stored as `unknown`, like the single-message path.
+    """
+    attempts = dict(_parse_batch_item(item) for item in items)
+    message_ids = list(attempts)
+    coll = get_sync_messages_collection()
+    docs = list(coll.find(
+        {"_id": {"$in": [ObjectId(mid) for mid in message_ids]}},
+        CLASSIFY_PROJECTION,
+    ))
+    provider = providers.selected_provider()
+    model = providers.model_name(provider)
+
+    analyses: Dict[str, Dict[str, object]] = {}
+    misses: List[Dict[str, object]] = []
+    for doc in docs:
+        key = group_value(doc)
+        cached = classification_cache.get(key, provider, model) if key else None
+        if cached is not None:
+            cached["cached"] = True
+            analyses[str(doc["_id"])] = cached
+        else:
+            misses.append(doc)
+
+    if misses:
+        try:
+            results = providers.classify_batch(
+                provider, [doc["content"] for doc in misses], [doc.get("context_stats") for doc in misses],
+            )
+        except ProviderRetryableError as exc:
+            # throttled: keep what the batch already answered and hand the
+            # rest back to analyze_message so they are retried later; the ones
+            # out of attempts are stored as unknown
+            partial = exc.partial or [None] * len(misses)
+            answered = [(doc, analysis) for doc, analysis in zip(misses, partial) if analysis is not None]
+            pending = {
+                str(doc["_id"]): attempts[str(doc["_id"])]
+                for doc, analysis in zip(misses, partial) if analysis is None
+            }
+            exhausted = set(_republish(pending, exc.retry_after))
+            misses = [doc for doc, _ in answered] + [doc for doc in misses if str(doc["_id"]) in exhausted]
+            results = [analysis for _, analysis in answered] + [
+                {"label": "unknown", "error": str(exc), "provider": provider}
+                for _ in range(len(misses) - len(answered))
+            ]
+        except Exception as exc:  # noqa: BLE001
+            results = [
+                {"label": "unknown", "error": str(exc), "provider": provider}
+                for _ in misses
+            ]
+        for doc, analysis in zip(misses, results):
+            analyses[str(doc["_id"])] = analysis
+            key = group_value(doc)
+            if key and analysis.get("label") in candidate_labels:
+                classification_cache.put(key, provider, model, analysis)
+
+    if analyses:
+        coll.bulk_write(
+            [UpdateOne({"_id": ObjectId(mid)}, {"$set": {"analysis": analysis}}) for mid, analysis in analyses.items()],
+            ordered=False,
+        )
+    contents = {str(doc["_id"]): doc.get("content") for doc in docs}
+    for mid, analysis in analyses.items():
+        schedule_immediate_if_critical(mid, analysis, contents.get(mid))
+    _record_labels(docs, analyses)
+    return analyses
+
+
+@celery_app.task(name="ai.tasks.analyze_message", bind=True, max_retries=LLM_MAX_RETRIES)
+def analyze_message(self, message_id: str, attempt: int = 0):
+    """
+    Round trips to `messages` for one message: a projected `find_one` and the
+    `update_one` storing `analysis`. Criticality is decided from the in-memory
+    analysis and the notifier gets content and severity in its payload, so a
+    critical message reaches `send_message` after these two operations and
+    `send_message` only adds the `sent` update (3 in total, previously 5).
+    """
     print("-"*30)
     print("start analyzing")
+    if batching.enabled(providers.selected_provider()):
+        processed = batching.submit(
+            _batch_item(message_id, attempt), _analyze_batch, batching.batch_size(providers.selected_provider()),
+            on_failure=_requeue_batch,
+        )
+        return {"id": message_id, "status": "batched", "processed": processed}
+
     coll = get_sync_messages_collection()
-    doc = coll.find_one({"_id": ObjectId(message_id)})
+    doc = coll.find_one(
+        {"_id": ObjectId(message_id)},
+        CLASSIFY_PROJECTION,
+    )
     if not doc:
         return {"error": "not found"}
 
     try:
-        analysis = _classify_message(doc["content"])
+        analysis = _classify_message(doc["content"], group_value(doc), doc.get("context_stats"))
+    except ProviderRetryableError as exc:
+        retries = max(self.request.retries, attempt)
+        if retries < self.max_retries:
+            # free the worker slot instead of sleeping; Celery re-delivers later
+            raise self.retry(exc=exc, countdown=backoff_delay(retries, exc.retry_after))
+        analysis = exc.fallback or {
+            "label": "unknown",
+            "error": str(exc),
+            "provider": os.getenv("AI_PROVIDER", "huggingface"),
+        }
     except Exception as exc:  # noqa: BLE001
         analysis = {
             "label": "unknown",
@@ -118,5 +224,6 @@ def analyze_message(message_id: str):
         {"_id": ObjectId(message_id)},
         {"$set": {"analysis": analysis}}
     )
-    schedule_immediate_if_critical(message_id)
+    schedule_immediate_if_critical(message_id, analysis, doc["content"])
+    _record_labels([doc], {message_id: analysis})
     return {"id": message_id, "analysis": analysis}
@@ -0,0 +1,302 @@
+"""
+Append-only, memory-mapped vector index for similar-incident retrieval.
+
+Vectors (L2-normalized sentence embeddings) are stored as raw float16 or int8
+rows in `<path>/vectors.<dtype>` next to the 12-byte message ObjectIds in
+`<path>/ids.bin`. Files are only ever appended to, under an exclusive `flock`,
+so every worker process can append and search the same directory; readers
+re-map the files when they grow and take the row count from the file sizes.
+
+Search is cosine similarity (a dot product, as rows are normalized):
+
+* ``brute`` - scan all rows in chunks; exact, fine up to ~100k rows
+* ``ivf``   - inverted file: rows are assigned to the nearest of `lists`
+  k-means centroids (`train`), and a query scans the VECTOR_INDEX_NPROBE
+  closest lists plus any rows appended since the lists were last grouped
+
+int8 rows are the float vectors scaled by 127; both dtypes are converted to
+float32 chunk by chunk for the dot products.
+
+Usage:
+    python -m ai.vector_index train [--lists 1024] [--sample 100000]
+    python -m ai.vector_index info
+"""
+import argparse
+import fcntl
+import json
+import os
+import sys
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from bson import ObjectId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "data/vector_index")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "int8").strip().lower()
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "brute").strip().lower()
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", 8))
+
+DTYPES = {"float16": np.float16, "int8": np.int8}
+ID_BYTES = 12
+INT8_SCALE = 127.0
+# small enough for a decoded chunk to stay in cache
+CHUNK_ROWS = 8192
+# rows assigned after the inverted lists were grouped are scanned directly
+# until there are this many of them
+REGROUP_AFTER = 20_000
+
+
+class VectorIndex:
+    def __init__(self, path: str, dim: Optional[int] = None, dtype: str = "int8",
+                 mode: str = "brute", nprobe: int = 8):
+        self.path = path
+        self.mode = mode
+        self.nprobe = nprobe
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+            if dim is not None and meta["dim"] != dim:
+                raise ValueError(f"index at {path} has dim {meta['dim']}, not {dim}")
+            self.dim, self.dtype = meta["dim"], meta["dtype"]
+        elif dim is None:
+            raise ValueError(f"no index at {path}; pass `dim` to create one")
+        else:
+            if dtype not in DTYPES:
+                raise ValueError(f"unsupported dtype {dtype!r}, use one of {sorted(DTYPES)}")
+            self.dim, self.dtype = dim, dtype
+            with self._locked():
+                if not os.path.exists(meta_path):
+                    with open(meta_path, "w") as fh:
+                        json.dump({"dim": dim, "dtype": dtype}, fh)
+
+        self._np_dtype = DTYPES[self.dtype]
+        self._row_bytes = self.dim * np.dtype(self._np_dtype).itemsize
+        self._vectors_path = os.path.join(path, f"vectors.{self.dtype}")
+        self._ids_path = os.path.join(path, "ids.bin")
+        self._assign_path = os.path.join(path, "assign.i32")
+        self._centroids_path = os.path.join(path, "centroids.npy")
+
+        self._rows = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._centroids_mtime = 0.0
+        self._list_order: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+        self._grouped_rows = 0
+
+    # storage
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(os.path.join(self.path, "lock"), "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def __len__(self) -> int:
+        return min(self._size(self._vectors_path) // self._row_bytes, self._size(self._ids_path) // ID_BYTES)
+
+    def _refresh(self) -> None:
+        rows = len(self)
+        if rows != self._rows or self._vectors is None:
+            self._rows = rows
+            if rows:
+                self._vectors = np.memmap(self._vectors_path, dtype=self._np_dtype, mode="r", shape=(rows, self.dim))
+                self._ids = np.memmap(self._ids_path, dtype=np.uint8, mode="r", shape=(rows, ID_BYTES))
+            else:
+                self._vectors = np.zeros((0, self.dim), dtype=self._np_dtype)
+                self._ids = np.zeros((0, ID_BYTES), dtype=np.uint8)
+        if os.path.exists(self._centroids_path):
+            mtime = os.path.getmtime(self._centroids_path)
+            if mtime != self._centroids_mtime:
+                self._centroids = np.load(self._centroids_path)
+                self._centroids_mtime = mtime
+                self._list_order = None
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+        return vectors.astype(np.float16)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        decoded = rows.astype(np.float32)
+        if self.dtype == "int8":
+            decoded /= INT8_SCALE
+        return decoded
+
+    def append(self, ids: Sequence[str], vectors: np.ndarray) -> None:
+        """
+        Append rows for message `ids`. If the index is trained, the rows are
+        also assigned to their nearest list.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors differ in length")
+        if not len(ids):
+            return
+        encoded = self._encode(vectors).tobytes()
+        id_bytes = b"".join(ObjectId(i).binary for i in ids)
+        with self._locked():
+            self._refresh()
+            rows = len(self)
+            # drop a partial write left by a crashed process before appending
+            for file_path, size in ((self._vectors_path, rows * self._row_bytes), (self._ids_path, rows * ID_BYTES)):
+                if self._size(file_path) != size:
+                    with open(file_path, "r+b") as fh:
+                        fh.truncate(size)
+            with open(self._vectors_path, "ab") as fh:
+                fh.write(encoded)
+            with open(self._ids_path, "ab") as fh:
+                fh.write(id_bytes)
+            if self._centroids is not None and self._size(self._assign_path) // 4 == rows:
+                with open(self._assign_path, "ab") as fh:
+                    fh.write(self._nearest_lists(vectors).astype(np.int32).tobytes())
+
+    # IVF
+
+    def _nearest_lists(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def train(self, lists: int = 1024, sample: int = 100_000, iterations: int = 10, seed: int = 0) -> int:
+        """
+        Spherical k-means over a sample of the rows, then assign every row to
+        its nearest centroid. Appends keep going while the bulk is assigned;
+        only rows added meanwhile are assigned under the lock. Returns the
+        number of lists.
+        """
+        self._refresh()
+        rows = self._rows
+        if not rows:
+            raise ValueError("cannot train an empty index")
+        rng = np.random.default_rng(seed)
+        picked = np.sort(rng.choice(rows, size=min(sample, rows), replace=False))
+        data = self._decode(self._vectors[picked])
+        lists = min(lists, len(data))
+        centroids = data[rng.choice(len(data), size=lists, replace=False)].copy()
+        for _ in range(iterations):
+            nearest = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, data)
+            empty = np.bincount(nearest, minlength=lists) == 0
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(1e-12)
+        centroids = centroids.astype(np.float32)
+
+        def assign_rows(start: int, stop: int) -> np.ndarray:
+            out = np.empty(stop - start, dtype=np.int32)
+            for lo in range(start, stop, CHUNK_ROWS):
+                hi = min(stop, lo + CHUNK_ROWS)
+                out[lo - start:hi - start] = np.argmax(self._decode(self._vectors[lo:hi]) @ centroids.T, axis=1)
+            return out
+
+        assign = assign_rows(0, rows)
+        with self._locked():
+            self._refresh()
+            assign = np.concatenate([assign, assign_rows(rows, self._rows)])
+            assign.tofile(self._assign_path + ".tmp")
+            os.replace(self._assign_path + ".tmp", self._assign_path)
+            np.save(self._centroids_path + ".tmp.npy", centroids)
+            os.replace(self._centroids_path + ".tmp.npy", self._centroids_path)
+            self._centroids = centroids
+            self._list_order = None
+        return lists
+
+    def _group_lists(self, assigned: int) -> None:
+        assign = np.fromfile(self._assign_path, dtype=np.int32, count=assigned)
+        self._list_order = np.argsort(assign, kind="stable").astype(np.int64)
+        self._list_offsets = np.searchsorted(assign[self._list_order], np.arange(len(self._centroids) + 1))
+        self._grouped_rows = assigned
+
+    def _ivf_candidates(self, query: np.ndarray) -> np.ndarray:
+        assigned = min(self._rows, self._size(self._assign_path) // 4)
+        if self._list_order is None or assigned - self._grouped_rows > REGROUP_AFTER:
+            self._group_lists(assigned)
+        probe = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        parts = [self._list_order[self._list_offsets[l]:self._list_offsets[l + 1]] for l in probe]
+        parts.append(np.arange(self._grouped_rows, self._rows))
+        return np.sort(np.concatenate(parts))
+
+    # search
+
+    def search(self, query: np.ndarray, k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Top-`k` (message id, cosine similarity) for one normalized query vector.
+        """
+        self._refresh()
+        if not self._rows:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+
+        if self.mode == "ivf" and self._centroids is not None:
+            rows = self._ivf_candidates(query)
+            scores = self._decode(self._vectors[rows]) @ query
+        else:
+            rows = None
+            scores = np.empty(self._rows, dtype=np.float32)
+            for start in range(0, self._rows, CHUNK_ROWS):
+                stop = min(self._rows, start + CHUNK_ROWS)
+                scores[start:stop] = self._decode(self._vectors[start:stop]) @ query
+
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = top if rows is None else rows[top]
+        # int8 rounding can put an identical vector slightly above 1
+        similarities = np.minimum(scores[top], 1.0)
+        return [(str(ObjectId(bytes(self._ids[p]))), float(s)) for p, s in zip(positions, similarities)]
+
+
+_index: Optional[VectorIndex] = None
+
+
+def get_index(dim: Optional[int] = None) -> VectorIndex:
+    global _index
+    if _index is None:
+        _index = VectorIndex(VECTOR_INDEX_PATH, dim=dim, dtype=VECTOR_INDEX_DTYPE,
+                             mode=VECTOR_INDEX_MODE, nprobe=VECTOR_INDEX_NPROBE)
+    return _index
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the similar-incident vector index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="build IVF lists (used with VECTOR_INDEX_MODE=ivf)")
+    p_train.add_argument("--lists", type=int, default=1024)
+    p_train.add_argument("--sample", type=int, default=100_000)
+    sub.add_parser("info", help="print index size and layout")
+    args = parser.parse_args(argv)
+
+    index = get_index()
+    if args.command == "train":
+        lists = index.train(lists=args.lists, sample=args.sample)
+        print(f"Trained {lists} lists over {len(index)} vectors")
+        return 0
+
+    index._refresh()
+    trained = index._centroids is not None
+    print(f"path={index.path} rows={len(index)} dim={index.dim} dtype={index.dtype} "
+          f"mode={index.mode} lists={len(index._centroids) if trained else 0}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
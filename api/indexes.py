@@ -0,0 +1,254 @@
+# api/indexes.py
+"""
+Index bootstrap and query-plan checks for the hot access paths.
+
+Usage:
+    python -m api.indexes ensure [--skip-backfill]
+    python -m api.indexes explain
+
+Index creation is also run on API startup (disable with
+ENSURE_INDEXES_ON_STARTUP=0). Messages stored before ingest set `sent: false`
+are invisible to the dispatcher's `sent: false` filter until they are
+backfilled. `ensure` backfills them in one pass; otherwise the dispatcher
+backfills SENT_BACKFILL_BATCH of them before each run until none are left.
+Either way a `migrations` marker is written at the end, so later checks are a
+single lookup. `explain` runs `explain()` on every hot query and exits
+non-zero if any of them is not served by an index scan.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+
+from api.services import (
+    get_async_clusters_collection,
+    get_async_messages_collection,
+    get_async_rollups_collection,
+    get_async_templates_collection,
+    get_sync_clusters_collection,
+    get_sync_messages_collection,
+    get_sync_migrations_collection,
+    get_sync_rollups_collection,
+    get_sync_templates_collection,
+)
+
+MESSAGES_INDEXES = [
+    # api.stats raw aggregation and api.rollups rebuild/check
+    IndexModel([("fingerprint", ASCENDING), ("created_at", ASCENDING)], name="fingerprint_created_at"),
+    # the same with GROUPING_KEY=cluster_id; only clustered messages are indexed
+    IndexModel(
+        [("cluster_id", ASCENDING), ("created_at", ASCENDING)],
+        name="cluster_id_created_at",
+        partialFilterExpression={"cluster_id": {"$exists": True}},
+    ),
+    # notification_service dispatch: only unsent messages are indexed
+    IndexModel(
+        [("timestamp", ASCENDING)],
+        name="unsent_timestamp",
+        partialFilterExpression={"sent": False},
+    ),
+]
+
+ROLLUPS_INDEXES = [
+    IndexModel(
+        [("fingerprint", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+        name="fingerprint_granularity_bucket",
+    ),
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+]
+
+# api.similarity pulls the clusters created since its last refresh
+CLUSTERS_INDEXES = [IndexModel([("created_at", ASCENDING)], name="created_at")]
+
+# api.templates: stored templates of a parse-tree leaf, and refresh by update time
+TEMPLATES_INDEXES = [
+    IndexModel([("route", ASCENDING)], name="route"),
+    IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+]
+
+
+SENT_BACKFILL_MARKER = "sent_backfill"
+
+
+def backfill_sent(limit: int = 0, messages: Collection | None = None) -> bool:
+    """
+    Set `sent: False` on messages stored before ingest wrote it, at most
+    `limit` of them (0: all). Returns True once none are left, and records
+    that in `migrations` so later calls are a single lookup.
+    """
+    migrations = get_sync_migrations_collection()
+    if migrations.find_one({"_id": SENT_BACKFILL_MARKER}) is not None:
+        return True
+    messages = messages if messages is not None else get_sync_messages_collection()
+    missing = {"sent": {"$exists": False}}
+    if limit:
+        ids = [doc["_id"] for doc in messages.find(missing, {"_id": 1}).limit(limit)]
+        if ids:
+            messages.update_many({"_id": {"$in": ids}, **missing}, {"$set": {"sent": False}})
+        if len(ids) == limit:
+            return False
+    else:
+        messages.update_many(missing, {"$set": {"sent": False}})
+    # ingest always writes `sent`, so no new messages can miss it
+    migrations.update_one(
+        {"_id": SENT_BACKFILL_MARKER}, {"$set": {"done_at": datetime.utcnow()}}, upsert=True
+    )
+    return True
+
+
+def _changed_indexes(existing: Dict[str, Dict[str, Any]], models: List[IndexModel]) -> List[str]:
+    """
+    Names of existing indexes whose options differ from the model of the same
+    name (e.g. `cluster_id_created_at`, once sparse); creating them again
+    would fail with IndexOptionsConflict, so they are dropped first.
+    """
+    changed = []
+    for model in models:
+        wanted = model.document
+        current = existing.get(wanted["name"])
+        if current is None:
+            continue
+        if any(current.get(option) != wanted.get(option) for option in ("sparse", "partialFilterExpression")):
+            changed.append(wanted["name"])
+    return changed
+
+
+def ensure_indexes(backfill: bool = True) -> Dict[str, List[str]]:
+    messages = get_sync_messages_collection()
+    rollups = get_sync_rollups_collection()
+    if backfill:
+        backfill_sent(messages=messages)
+    for name in _changed_indexes(messages.index_information(), MESSAGES_INDEXES):
+        messages.drop_index(name)
+    return {
+        "messages": messages.create_indexes(MESSAGES_INDEXES),
+        "fingerprint_rollups": rollups.create_indexes(ROLLUPS_INDEXES),
+        "clusters": get_sync_clusters_collection().create_indexes(CLUSTERS_INDEXES),
+        "log_templates": get_sync_templates_collection().create_indexes(TEMPLATES_INDEXES),
+    }
+
+
+async def ensure_indexes_async() -> Dict[str, List[str]]:
+    messages = get_async_messages_collection()
+    for name in _changed_indexes(await messages.index_information(), MESSAGES_INDEXES):
+        await messages.drop_index(name)
+    return {
+        "messages": await messages.create_indexes(MESSAGES_INDEXES),
+        "fingerprint_rollups": await get_async_rollups_collection().create_indexes(ROLLUPS_INDEXES),
+        "clusters": await get_async_clusters_collection().create_indexes(CLUSTERS_INDEXES),
+        "log_templates": await get_async_templates_collection().create_indexes(TEMPLATES_INDEXES),
+    }
+
+
+def _plan_stages(node: Any, stages: List[str]) -> List[str]:
+    if isinstance(node, dict):
+        stage = node.get("stage")
+        if isinstance(stage, str):
+            stages.append(stage)
+        for value in node.values():
+            _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for value in node:
+            _plan_stages(value, stages)
+    return stages
+
+
+def _winning_plan_stages(explain: Dict[str, Any]) -> List[str]:
+    stages: List[str] = []
+
+    def visit(node: Any) -> None:
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "winningPlan":
+                    _plan_stages(value, stages)
+                else:
+                    visit(value)
+        elif isinstance(node, list):
+            for value in node:
+                visit(value)
+
+    visit(explain)
+    return stages
+
+
+def explain_hot_queries(now: datetime | None = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Explain each hot query with placeholder values and report the stages of
+    its winning plan. A query is `ok` when it uses an IXSCAN and no COLLSCAN.
+    """
+    from api.stats import TIME_WINDOWS
+    from notification_service.rules import digest_group_id, pending_non_critical_filter
+    from notification_service.tasks import DISPATCH_INTERVAL
+
+    now = now or datetime.utcnow()
+    messages = get_sync_messages_collection()
+    rollups = get_sync_rollups_collection()
+    oldest = now - max(TIME_WINDOWS.values())
+    pending = pending_non_critical_filter(now - timedelta(minutes=DISPATCH_INTERVAL))
+
+    def explain_aggregate(pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return messages.database.command("aggregate", messages.name, pipeline=pipeline, explain=True)
+
+    explains = {
+        "stats_raw": explain_aggregate(
+            [{"$match": {"fingerprint": "explain", "created_at": {"$gte": oldest, "$lte": now}}}]
+        ),
+        # GROUPING_KEY=cluster_id
+        "stats_raw_cluster": explain_aggregate(
+            [{"$match": {"cluster_id": "explain", "created_at": {"$gte": oldest, "$lte": now}}}]
+        ),
+        "stats_rollup": rollups.find(
+            {"fingerprint": "explain", "granularity": "hour", "bucket": {"$gte": oldest, "$lte": now}}
+        ).sort("bucket", 1).explain(),
+        "dispatch_non_critical": messages.find(pending, {"_id": 1}).explain(),
+        # DISPATCH_MODE=digest
+        "dispatch_digest": explain_aggregate([
+            {"$match": pending},
+            {"$sort": {"timestamp": 1}},
+            {"$group": {"_id": digest_group_id("fingerprint", by_service=True), "count": {"$sum": 1}}},
+        ]),
+        "cluster_refresh": get_sync_clusters_collection().find(
+            {"created_at": {"$gte": now}}, {"sig": 1, "keys": 1, "created_at": 1}
+        ).sort("created_at", -1).explain(),
+    }
+
+    report: Dict[str, Dict[str, Any]] = {}
+    for name, explain in explains.items():
+        stages = _winning_plan_stages(explain)
+        report[name] = {
+            "stages": stages,
+            "ok": "IXSCAN" in stages and "COLLSCAN" not in stages,
+        }
+    return report
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_ensure = sub.add_parser("ensure", help="create missing indexes")
+    p_ensure.add_argument(
+        "--skip-backfill", action="store_true", help="do not set sent=false on messages stored without it"
+    )
+    sub.add_parser("explain", help="verify hot queries use indexes")
+    args = parser.parse_args(argv)
+
+    if args.command == "ensure":
+        for collection, names in ensure_indexes(backfill=not args.skip_backfill).items():
+            print(f"{collection}: {', '.join(names)}")
+        return 0
+
+    failed = 0
+    for name, result in explain_hot_queries().items():
+        status = "ok" if result["ok"] else "NOT INDEXED"
+        print(f"{name:<24} {status:<12} {' > '.join(result['stages'])}")
+        failed += 0 if result["ok"] else 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,108 @@
+import os
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from typing import Any, Dict, List
+from celery import chain, group
+from fastapi import Body, FastAPI, HTTPException
 from fastapi.concurrency import run_in_threadpool
-from api.services import get_async_messages_collection
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from api.indexes import ensure_indexes_async
+from api.rollups import ingest_ops
+from api.services import get_async_messages_collection, get_async_rollups_collection
 from api.models import MessageIn
-from api.stats import build_stats_for_message, fingerprint
+from api.stats import (
+    CLUSTERING,
+    FINGERPRINT_ENGINE,
+    STATS_MODE,
+    STATS_ORDERING,
+    build_stats_by_fingerprint,
+    build_stats_for_message,
+    cluster_id,
+    context_stats_ops,
+    fingerprint,
+    group_value,
+)
 from celery_app import celery_app
-from ai.tasks import analyze_message
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+async def create_indexes():
+    if os.getenv("ENSURE_INDEXES_ON_STARTUP", "1") != "1":
+        return
+    try:
+        await ensure_indexes_async()
+    except Exception as exc:  # noqa: BLE001
+        print(f"[indexes] Failed to ensure indexes: {exc}")
+
+
+def _prepare_doc(message: MessageIn, now: datetime) -> Dict[str, Any]:
+    doc = message.dict()
+    if doc.get("timestamp") is None:
+        doc["timestamp"] = now
+    doc["created_at"] = doc["timestamp"]
+    doc["sent"] = False
+    return doc
+
+
+async def _fingerprints(contents: List[str]) -> Dict[str, str]:
+    """
+    Fingerprint each distinct content once. The drain engine may read and
+    write `log_templates`, so it runs in the threadpool.
+    """
+    def compute() -> Dict[str, str]:
+        return {content: fingerprint(content) for content in dict.fromkeys(contents)}
+
+    if FINGERPRINT_ENGINE == "drain":
+        return await run_in_threadpool(compute)
+    return compute()
+
+
+def _enqueue_background(message_ids: List[str]) -> None:
+    """
+    Publish the post-insert work for `message_ids` in one go: analysis only,
+    or (STATS_MODE=async) the stats stage chained before or alongside it.
+    """
+    analyze = [
+        celery_app.signature("ai.tasks.analyze_message", args=[mid], immutable=True)
+        for mid in message_ids
+    ]
+    if STATS_MODE != "async":
+        group(analyze).apply_async()
+        return
+
+    stats = celery_app.signature("api.tasks.build_context_stats", args=[message_ids], immutable=True)
+    if STATS_ORDERING == "parallel":
+        group([stats, *analyze]).apply_async()
+    else:
+        chain(stats, group(analyze)).apply_async()
+
+
 @app.post("/messages")
 async def create_message(message: MessageIn):
     messages_collection = get_async_messages_collection()
-    doc = message.dict()
-    now = datetime.utcnow()
-    doc.setdefault("timestamp", now)
-    doc["created_at"] = doc.get("timestamp", now)
-    doc["fingerprint"] = fingerprint(doc["content"])
+    doc = _prepare_doc(message, datetime.utcnow())
+    doc["fingerprint"] = (await _fingerprints([doc["content"]]))[doc["content"]]
+    if CLUSTERING:
+        doc["cluster_id"] = await run_in_threadpool(cluster_id, doc["content"], doc["fingerprint"])
 
     res = await messages_collection.insert_one(doc)
     if not res.acknowledged:
         raise HTTPException(500, "Cannot store message")
     message_id = str(res.inserted_id)
 
+    if STATS_MODE == "async":
+        _enqueue_background([message_id])
+        return {"id": message_id, "status": "queued_for_analysis"}
+
     try:
-        stats = await run_in_threadpool(build_stats_for_message, doc["content"])
+        await get_async_rollups_collection().bulk_write(ingest_ops([doc]), ordered=False)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[rollups] Failed to update rollups for message {message_id}: {exc}")
+
+    try:
+        stats = await run_in_threadpool(build_stats_for_message, doc["content"], group=group_value(doc))
         await messages_collection.update_one({"_id": res.inserted_id}, {"$set": {"context_stats": stats}})
     except Exception as exc:  # noqa: BLE001
         print(f"[stats] Failed to build stats for message {message_id}: {exc}")
@@ -33,3 +111,92 @@ async def create_message(message: MessageIn):
     celery_app.send_task("ai.tasks.analyze_message", args=[message_id])
 
     return {"id": message_id, "status": "queued_for_analysis"}
+
+
+@app.post("/messages/batch")
+async def create_messages_batch(payload: List[Any] = Body(...)):
+    """
+    Bulk variant of `/messages`: one unordered `insert_many`, one `bulk_write`
+    for `context_stats` and one grouped publish of `analyze_message` tasks.
+    Items are validated one by one (a non-object item is an error too), so
+    every input item gets a result entry at the same index, with either an
+    `id` or an `error`.
+    """
+    if not payload:
+        return {"items": [], "inserted": 0, "failed": 0}
+
+    messages_collection = get_async_messages_collection()
+    now = datetime.utcnow()
+
+    errors: Dict[int, str] = {}
+    docs: Dict[int, Dict[str, Any]] = {}
+    for index, item in enumerate(payload):
+        try:
+            docs[index] = _prepare_doc(MessageIn(**item), now)
+        except (TypeError, ValidationError) as exc:
+            errors[index] = str(exc)
+
+    fp_cache = await _fingerprints([doc["content"] for doc in docs.values()])
+    for doc in docs.values():
+        doc["fingerprint"] = fp_cache[doc["content"]]
+
+    if CLUSTERING and docs:
+        clusters: Dict[str, str] = {}
+
+        def assign_clusters() -> None:
+            for doc in docs.values():
+                if doc["fingerprint"] not in clusters:
+                    clusters[doc["fingerprint"]] = cluster_id(doc["content"], doc["fingerprint"])
+                doc["cluster_id"] = clusters[doc["fingerprint"]]
+
+        await run_in_threadpool(assign_clusters)
+
+    # `insert_many` assigns `_id` to every document client-side before sending;
+    # write error indexes refer to positions in `to_insert`.
+    positions = list(docs)
+    to_insert = [docs[index] for index in positions]
+    if to_insert:
+        try:
+            await messages_collection.insert_many(to_insert, ordered=False)
+        except BulkWriteError as exc:
+            for write_error in exc.details.get("writeErrors", []):
+                errors[positions[write_error["index"]]] = write_error.get("errmsg", "write error")
+        except Exception as exc:  # noqa: BLE001
+            raise HTTPException(500, f"Cannot store messages: {exc}")
+
+    stored = [docs[index] for index in positions if index not in errors]
+
+    if stored and STATS_MODE != "async":
+        try:
+            await get_async_rollups_collection().bulk_write(ingest_ops(stored), ordered=False)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[rollups] Failed to update rollups for batch of {len(stored)} messages: {exc}")
+
+        try:
+            stats_by_fp = await run_in_threadpool(build_stats_by_fingerprint, stored)
+            updates = context_stats_ops(stored, stats_by_fp)
+            if updates:
+                await messages_collection.bulk_write(updates, ordered=False)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[stats] Failed to attach stats for batch of {len(stored)} messages: {exc}")
+
+    queued = True
+    if stored:
+        try:
+            _enqueue_background([str(doc["_id"]) for doc in stored])
+        except Exception as exc:  # noqa: BLE001
+            queued = False
+            print(f"[batch] Failed to enqueue analysis for {len(stored)} messages: {exc}")
+
+    items = []
+    for index in range(len(payload)):
+        if index in errors:
+            items.append({"index": index, "error": errors[index]})
+        else:
+            items.append({
+                "index": index,
+                "id": str(docs[index]["_id"]),
+                "status": "queued_for_analysis" if queued else "stored",
+            })
+
+    return {"items": items, "inserted": len(stored), "failed": len(errors)}
@@ -0,0 +1,326 @@
+# api/rollups.py
+"""
+Incrementally maintained per-fingerprint counters.
+
+Every message increments one minute bucket and one hour bucket for its
+fingerprint (`$inc` at ingest, and again for `labels.*` when
+`analyze_message` stores `analysis.label`). Context stats are then served from
+at most ~60 minute buckets (1h window) and ~720 hour buckets (24h/7d/30d), so
+their cost no longer depends on how often a fingerprint has occurred.
+
+Window bounds are aligned down to the bucket size, so a window may include up
+to one extra minute (1h) or hour (24h/7d/30d) of history compared with the
+raw scan. Labels are counted once per message, when its first analysis is
+stored.
+
+Nothing updates a bucket when `resolved_at` is set later, so `median_ttr_sec`
+only reflects messages resolved before the last `rebuild`. Deployments that
+rely on time to resolution should keep `STATS_SOURCE=raw` (or rebuild
+regularly).
+
+Usage:
+    python -m api.rollups rebuild [--days 30]
+    python -m api.rollups check [--limit 20] [--fingerprint FP]
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from api.services import get_sync_messages_collection, get_sync_rollups_collection
+from api.stats import GROUPING_KEY, group_value
+
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+}
+
+# buckets are removed by the TTL index on `expires_at` once no window needs them
+RETENTION = {
+    "minute": timedelta(hours=2),
+    "hour": timedelta(days=31),
+}
+
+WINDOW_GRANULARITY = {
+    "1h": "minute",
+    "24h": "hour",
+    "7d": "hour",
+    "30d": "hour",
+}
+
+EXAMPLES_PER_BUCKET = 3
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket_id(fp: str, granularity: str, bucket: datetime) -> str:
+    return f"{fp}:{granularity}:{bucket:%Y%m%d%H%M}"
+
+
+def _encode_key(value: str) -> str:
+    # `.` and `$` are not allowed inside field paths used by `$inc`
+    return value.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def _decode_key(value: str) -> str:
+    return value.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def _ttr_seconds(doc: Dict[str, Any]) -> float | None:
+    ca = doc.get("created_at"); ra = doc.get("resolved_at")
+    if isinstance(ca, datetime) and isinstance(ra, datetime) and ra >= ca:
+        return (ra - ca).total_seconds()
+    return None
+
+
+def _bucket_fields(fp: str, granularity: str, bucket: datetime) -> Dict[str, Any]:
+    # `$setOnInsert` of every upsert, so a bucket looks the same whichever op creates it
+    return {
+        "fingerprint": fp,
+        "granularity": granularity,
+        "bucket": bucket,
+        "expires_at": bucket + RETENTION[granularity],
+    }
+
+
+def ingest_ops(docs: Iterable[Dict[str, Any]], with_history: bool = False) -> List[UpdateOne]:
+    """
+    Build one upsert per (group, granularity, bucket) touched by `docs`. The
+    group is the GROUPING_KEY value (stored in the bucket's `fingerprint`
+    field either way).
+
+    At ingest only counts, services, components and examples are known. With
+    `with_history=True` (used by `rebuild`) existing `analysis.label` and
+    `resolved_at` values are folded in as well.
+    """
+    buckets: Dict[Tuple[str, str, datetime], Dict[str, Any]] = {}
+    for doc in docs:
+        fp = group_value(doc); ca = doc.get("created_at")
+        if not fp or not isinstance(ca, datetime):
+            continue
+        for granularity in GRANULARITIES:
+            key = (fp, granularity, bucket_start(ca, granularity))
+            acc = buckets.setdefault(key, {"inc": {}, "examples": [], "ttrs": [], "last_seen": ca})
+            inc = acc["inc"]
+            inc["count"] = inc.get("count", 0) + 1
+            svc = doc.get("service"); cmp = doc.get("component")
+            if svc: inc[f"services.{_encode_key(svc)}"] = inc.get(f"services.{_encode_key(svc)}", 0) + 1
+            if cmp: inc[f"components.{_encode_key(cmp)}"] = inc.get(f"components.{_encode_key(cmp)}", 0) + 1
+            if ca > acc["last_seen"]:
+                acc["last_seen"] = ca
+            if len(acc["examples"]) < EXAMPLES_PER_BUCKET:
+                acc["examples"].append({"id": str(doc.get("_id")), "fragment": (doc.get("content") or "")[:200]})
+
+            if with_history:
+                lbl = (doc.get("analysis") or {}).get("label")
+                if lbl: inc[f"labels.{_encode_key(lbl)}"] = inc.get(f"labels.{_encode_key(lbl)}", 0) + 1
+                ttr = _ttr_seconds(doc)
+                if ttr is not None:
+                    acc["ttrs"].append(ttr)
+
+    ops: List[UpdateOne] = []
+    for (fp, granularity, bucket), acc in buckets.items():
+        update: Dict[str, Any] = {
+            "$setOnInsert": _bucket_fields(fp, granularity, bucket),
+            "$inc": acc["inc"],
+            "$max": {"last_seen": acc["last_seen"]},
+            "$push": {"examples": {"$each": acc["examples"], "$slice": EXAMPLES_PER_BUCKET}},
+        }
+        if acc["ttrs"]:
+            update["$push"]["ttrs"] = {"$each": acc["ttrs"]}
+        ops.append(UpdateOne({"_id": _bucket_id(fp, granularity, bucket)}, update, upsert=True))
+    return ops
+
+
+def label_ops(fp: str, created_at: datetime, label: str) -> List[UpdateOne]:
+    """
+    `$inc` the label counter in both buckets of a message getting its first
+    analysis. The buckets are upserted: the ingest write may have failed, or
+    the bucket may be a fresh one after the ingest bucket expired.
+    """
+    if not fp or not label or not isinstance(created_at, datetime):
+        return []
+    ops = []
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(created_at, granularity)
+        ops.append(UpdateOne(
+            {"_id": _bucket_id(fp, granularity, bucket)},
+            {
+                "$setOnInsert": _bucket_fields(fp, granularity, bucket),
+                "$inc": {f"labels.{_encode_key(label)}": 1},
+            },
+            upsert=True,
+        ))
+    return ops
+
+
+def window_bounds(now: datetime, windows: Dict[str, timedelta]) -> Dict[str, datetime]:
+    return {
+        key: bucket_start(now - delta, WINDOW_GRANULARITY.get(key, "hour"))
+        for key, delta in windows.items()
+    }
+
+
+def _merge_counts(target: Dict[str, int], source: Dict[str, int] | None) -> None:
+    for key, value in (source or {}).items():
+        name = _decode_key(key)
+        target[name] = target.get(name, 0) + int(value)
+
+
+def build_stats_from_rollups(
+    fp: str,
+    now: datetime,
+    windows: Dict[str, timedelta],
+    limit_examples: int = 3,
+    collection: Collection | None = None,
+) -> Dict[str, Any]:
+    """
+    Same `windows` structure as the raw aggregation, summed from buckets.
+    """
+    collection = collection if collection is not None else get_sync_rollups_collection()
+    since_by_window = window_bounds(now, windows)
+
+    by_granularity: Dict[str, List[Dict[str, Any]]] = {}
+    for granularity in sorted(set(WINDOW_GRANULARITY.get(key, "hour") for key in windows)):
+        since = min(since for key, since in since_by_window.items() if WINDOW_GRANULARITY.get(key, "hour") == granularity)
+        by_granularity[granularity] = list(collection.find(
+            {"fingerprint": fp, "granularity": granularity, "bucket": {"$gte": since, "$lte": now}},
+            {"_id": 0, "fingerprint": 0, "granularity": 0, "expires_at": 0},
+        ).sort("bucket", 1))
+
+    stats: Dict[str, Any] = {"windows": {}, "last_seen_at": None}
+    for key, since in since_by_window.items():
+        count = 0
+        labels: Dict[str, int] = {}
+        services: Dict[str, int] = {}
+        components: Dict[str, int] = {}
+        ttrs: List[float] = []
+        examples: List[Dict[str, str]] = []
+
+        for bucket in by_granularity[WINDOW_GRANULARITY.get(key, "hour")]:
+            if bucket["bucket"] < since:
+                continue
+            count += int(bucket.get("count", 0))
+            _merge_counts(labels, bucket.get("labels"))
+            _merge_counts(services, bucket.get("services"))
+            _merge_counts(components, bucket.get("components"))
+            ttrs.extend(bucket.get("ttrs") or [])
+            for example in bucket.get("examples") or []:
+                if len(examples) < limit_examples:
+                    examples.append(example)
+
+            last_seen = bucket.get("last_seen")
+            if last_seen and (stats["last_seen_at"] is None or last_seen > stats["last_seen_at"]):
+                stats["last_seen_at"] = last_seen
+
+        stats["windows"][key] = {
+            "count": count,
+            "labels_distribution": labels,
+            "top_services": sorted(services.items(), key=lambda x: (-x[1], x[0]))[:3],
+            "top_components": sorted(components.items(), key=lambda x: (-x[1], x[0]))[:3],
+            "median_ttr_sec": float(np.median(ttrs)) if ttrs else None,
+            "examples": examples,
+        }
+
+    return stats
+
+
+def rebuild(days: int = 30, batch_size: int = 1000) -> int:
+    """
+    Drop all buckets and re-create them from raw `messages` of the last `days`.
+    Run it while ingestion is paused, otherwise concurrent `$inc`s are lost.
+    """
+    messages = get_sync_messages_collection()
+    rollups = get_sync_rollups_collection()
+    rollups.delete_many({})
+
+    since = datetime.utcnow() - timedelta(days=days)
+    cursor = messages.find(
+        {"created_at": {"$gte": since}},
+        {"fingerprint": 1, "cluster_id": 1, "created_at": 1, "resolved_at": 1, "service": 1,
+         "component": 1, "content": 1, "analysis.label": 1},
+    ).sort("created_at", 1)
+
+    processed = 0
+    batch: List[Dict[str, Any]] = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            rollups.bulk_write(ingest_ops(batch, with_history=True), ordered=False)
+            processed += len(batch)
+            batch = []
+    if batch:
+        rollups.bulk_write(ingest_ops(batch, with_history=True), ordered=False)
+        processed += len(batch)
+    return processed
+
+
+def check(limit: int = 20, fingerprints: List[str] | None = None, now: datetime | None = None) -> List[str]:
+    """
+    Compare rollup stats with the raw aggregation over the same aligned
+    windows and return a list of human-readable mismatches.
+    """
+    from api.stats import TIME_WINDOWS, aggregate_window_stats
+
+    now = now or datetime.utcnow()
+    messages = get_sync_messages_collection()
+    if not fingerprints:
+        fingerprints = [
+            row["_id"] for row in messages.aggregate([
+                {"$match": {"created_at": {"$gte": now - timedelta(days=1)}}},
+                {"$group": {"_id": f"${GROUPING_KEY}", "n": {"$sum": 1}}},
+                {"$sort": {"n": -1}},
+                {"$limit": limit},
+            ])
+        ]
+
+    since_by_window = window_bounds(now, TIME_WINDOWS)
+    mismatches: List[str] = []
+    for fp in fingerprints:
+        rolled = build_stats_from_rollups(fp, now, TIME_WINDOWS)
+        raw = aggregate_window_stats(messages, {GROUPING_KEY: fp}, now, since_by_window)
+        for key in TIME_WINDOWS:
+            a = rolled["windows"][key]; b = raw["windows"][key]
+            for field in ("count", "labels_distribution", "top_services", "top_components"):
+                left = a[field]; right = b[field]
+                if field.startswith("top_"):
+                    left = sorted(left); right = sorted(right)
+                if left != right:
+                    mismatches.append(f"{fp} {key} {field}: rollup={a[field]!r} raw={b[field]!r}")
+    return mismatches
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain fingerprint rollup buckets")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild", help="backfill buckets from raw messages")
+    p_rebuild.add_argument("--days", type=int, default=30)
+    p_check = sub.add_parser("check", help="compare rollup stats with the raw scan")
+    p_check.add_argument("--limit", type=int, default=20)
+    p_check.add_argument("--fingerprint", action="append", dest="fingerprints")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        processed = rebuild(days=args.days)
+        print(f"Rebuilt rollups from {processed} messages")
+        return 0
+
+    mismatches = check(limit=args.limit, fingerprints=args.fingerprints)
+    for line in mismatches:
+        print(line)
+    print(f"{len(mismatches)} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
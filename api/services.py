@@ -16,11 +16,18 @@ if not MONGO_URI:
 _async_client = AsyncIOMotorClient(MONGO_URI)
 _async_db = _async_client.get_default_database()
 _async_messages_coll = _async_db["messages"]
+_async_rollups_coll = _async_db["fingerprint_rollups"]
+_async_clusters_coll = _async_db["clusters"]
+_async_templates_coll = _async_db["log_templates"]
 
 # 2) Sync client
 _sync_client = MongoClient(MONGO_URI)
 _sync_db = _sync_client.get_default_database()
 _sync_messages_coll = _sync_db["messages"]
+_sync_rollups_coll = _sync_db["fingerprint_rollups"]
+_sync_clusters_coll = _sync_db["clusters"]
+_sync_templates_coll = _sync_db["log_templates"]
+_sync_migrations_coll = _sync_db["migrations"]
 
 
 def get_async_messages_collection():
@@ -35,3 +42,52 @@ def get_sync_messages_collection():
     Повертає синхронну колекцію для використання у Celery-тасках.
     """
     return _sync_messages_coll
+
+
+def get_async_rollups_collection():
+    """
+    Асинхронна колекція агрегованих лічильників по fingerprint (для FastAPI).
+    """
+    return _async_rollups_coll
+
+
+def get_sync_rollups_collection():
+    """
+    Синхронна колекція агрегованих лічильників по fingerprint.
+    """
+    return _sync_rollups_coll
+
+
+def get_async_clusters_collection():
+    """
+    Асинхронна колекція кластерів схожих повідомлень (для FastAPI).
+    """
+    return _async_clusters_coll
+
+
+def get_sync_clusters_collection():
+    """
+    Синхронна колекція кластерів схожих повідомлень (MinHash, див. api.similarity).
+    """
+    return _sync_clusters_coll
+
+
+def get_async_templates_collection():
+    """
+    Асинхронна колекція шаблонів логів (для FastAPI).
+    """
+    return _async_templates_coll
+
+
+def get_sync_templates_collection():
+    """
+    Синхронна колекція шаблонів логів, вивчених api.templates (Drain).
+    """
+    return _sync_templates_coll
+
+
+def get_sync_migrations_collection():
+    """
+    Синхронна колекція маркерів завершених міграцій даних (див. api.indexes).
+    """
+    return _sync_migrations_coll
@@ -0,0 +1,297 @@
+# api/similarity.py
+"""
+Near-duplicate grouping of log lines with MinHash LSH.
+
+`normalize` only merges lines that become identical. Here each normalized line
+is reduced to a token set in which paths, hosts, quoted strings and `key=value`
+values are masked too, and a MinHash signature of that set estimates the
+Jaccard similarity between lines. The signature is cut into BANDS bands of ROWS
+values; lines that agree on a whole band become candidates, and a candidate is
+accepted when the estimated similarity reaches SIMILARITY_THRESHOLD. With
+10 x 4 a pair at similarity 0.7 collides with probability ~0.9 and a pair at
+0.2 with ~0.02.
+
+Memory per indexed line is NUM_PERM bytes of b-bit signature (the low byte of
+every MinHash, enough to verify candidates), 4 bytes per band of chain links
+and the cluster number; cluster ids are stored as 20-byte SHA-1 digests.
+Bucket heads are flat arrays and chains are walked newest first and at most
+MAX_CHAIN deep, which bounds lookups in buckets made of very common words.
+
+A line joins the cluster of its most similar candidate, otherwise it starts a
+new cluster named after its own fingerprint. New clusters are persisted to the
+`clusters` collection with their band keys and `created_at`. On a local miss
+the assigner pulls the clusters other processes created since its last pull,
+at most every CLUSTER_REFRESH_SECONDS, and queries again before creating a
+cluster, so API workers converge on the same ids without a MongoDB read per
+new line. A cluster is loaded into the local index only once.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import Binary
+
+from api.services import get_sync_clusters_collection
+
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.6))
+# clusters loaded from Mongo into the local index on first use
+CLUSTER_WARM_LIMIT = int(os.getenv("CLUSTER_WARM_LIMIT", 1_000_000))
+# minimum interval between pulls of clusters created by other processes
+CLUSTER_REFRESH_SECONDS = float(os.getenv("CLUSTER_REFRESH_SECONDS", 5))
+
+BANDS = 10
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+HEAD_BITS = 18
+MAX_CHAIN = 32
+
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_PATH = re.compile(r"(?:[\w.~-]*/[\w.~-]+)+/?")
+_HOST = re.compile(r"\b[a-z][\w-]*(?:\.[\w-]+)+\b")
+_ASSIGNED = re.compile(r"=\S+")
+
+
+def _constants(name: str, count: int) -> np.ndarray:
+    # derived from blake2b rather than a seeded RNG: signatures and band keys
+    # are persisted, so they must not change between processes or versions
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(f"{name}:{i}".encode(), digest_size=8).digest(), "little") | 1
+         for i in range(count)],
+        dtype=np.uint64,
+    )
+
+
+_PERM_A = _constants("minhash-a", NUM_PERM)[:, None]
+_PERM_B = _constants("minhash-b", NUM_PERM)[:, None]
+_BAND_MIX = _constants("band", ROWS)
+_HEAD_MASK = (1 << HEAD_BITS) - 1
+
+
+def tokens(normalized: str) -> List[str]:
+    # mask values that vary between otherwise identical lines, on top of the
+    # numbers / ids already replaced by `normalize`
+    masked = _QUOTED.sub("<str>", normalized)
+    masked = _PATH.sub("<path>", masked)
+    masked = _HOST.sub("<host>", masked)
+    masked = _ASSIGNED.sub("=<v>", masked)
+    return masked.split()
+
+
+def signature(normalized: str) -> np.ndarray:
+    """
+    NUM_PERM MinHash values of the masked token set (multiply-add hashing of
+    64-bit token digests, wrapping in uint64).
+    """
+    unique = set(tokens(normalized)) or {normalized}
+    values = np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little") for t in unique],
+        dtype=np.uint64,
+    )
+    return (_PERM_A * values[None, :] + _PERM_B).min(axis=1)
+
+
+def band_keys(sig: np.ndarray) -> List[int]:
+    """
+    One signed 64-bit key per band (storable as a BSON int64).
+    """
+    keys = (sig.reshape(BANDS, ROWS) * _BAND_MIX).sum(axis=1, dtype=np.uint64)
+    return keys.view(np.int64).tolist()
+
+
+def compact(sig: np.ndarray) -> np.ndarray:
+    return (sig & np.uint64(0xFF)).astype(np.uint8)
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Jaccard estimate from 8-bit signatures; `b` may be a stack of them.
+    """
+    agree = (b == a).mean(axis=-1)
+    return np.clip((agree - 1 / 256) / (1 - 1 / 256), 0.0, 1.0)
+
+
+class MinHashIndex:
+    def __init__(self, threshold: float = 0.6, max_chain: int = MAX_CHAIN, capacity: int = 1024):
+        self.threshold = threshold
+        self.max_chain = max_chain
+        self._size = 0
+        self._sigs = np.zeros((capacity, NUM_PERM), dtype=np.uint8)
+        self._members = array("i")
+        self._heads = [array("i", [-1]) * (1 << HEAD_BITS) for _ in range(BANDS)]
+        self._next = [array("i") for _ in range(BANDS)]
+        self._cluster_ids = bytearray()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def clusters(self) -> int:
+        return len(self._cluster_ids) // 20
+
+    def new_cluster(self, cluster_id: str) -> int:
+        """
+        Register a cluster; ids are SHA-1 hex digests (message fingerprints).
+        """
+        self._cluster_ids += bytes.fromhex(cluster_id)
+        return self.clusters - 1
+
+    def cluster_id(self, cluster: int) -> str:
+        return self._cluster_ids[cluster * 20:(cluster + 1) * 20].hex()
+
+    def add(self, compact_sig: np.ndarray, keys: List[int], cluster: int) -> None:
+        if self._size == len(self._sigs):
+            grown = np.zeros((self._size * 2, NUM_PERM), dtype=np.uint8)
+            grown[:self._size] = self._sigs
+            self._sigs = grown
+        position = self._size
+        self._sigs[position] = compact_sig
+        self._members.append(cluster)
+        self._size += 1
+        for band, key in enumerate(keys):
+            head = key & _HEAD_MASK
+            self._next[band].append(self._heads[band][head])
+            self._heads[band][head] = position
+
+    def candidates(self, keys: List[int]) -> List[int]:
+        seen = set()
+        for band, key in enumerate(keys):
+            chain = self._next[band]
+            position = self._heads[band][key & _HEAD_MASK]
+            steps = 0
+            while position >= 0 and steps < self.max_chain:
+                seen.add(position)
+                position = chain[position]
+                steps += 1
+        return list(seen)
+
+    def query(self, compact_sig: np.ndarray, keys: List[int]) -> Optional[Tuple[int, float]]:
+        """
+        Most similar indexed line at or above `threshold`, as (cluster, similarity).
+        """
+        positions = self.candidates(keys)
+        if not positions:
+            return None
+        similarity = estimate_similarity(compact_sig, self._sigs[positions])
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return self._members[positions[best]], float(similarity[best])
+
+    def memory_bytes(self) -> int:
+        arrays = [self._members, *self._heads, *self._next]
+        return (
+            self._sigs[:self._size].nbytes
+            + sum(a.buffer_info()[1] * a.itemsize for a in arrays)
+            + sys.getsizeof(self._cluster_ids)
+        )
+
+
+class ClusterAssigner:
+    """
+    Process-local index backed by the shared `clusters` collection. The API
+    calls it from threadpool threads, so lookups and inserts are serialized.
+    """
+
+    def __init__(self, threshold: float = 0.6, warm_limit: int = 1_000_000, refresh_seconds: float = 5.0):
+        self.index = MinHashIndex(threshold=threshold)
+        self.warm_limit = warm_limit
+        self.refresh_seconds = refresh_seconds
+        # cluster id -> local cluster number, so no cluster is loaded twice
+        self._loaded: Dict[str, int] = {}
+        self._refreshed_at: Optional[datetime] = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, doc: dict) -> int:
+        cluster = self._loaded.get(doc["_id"])
+        if cluster is None:
+            cluster = self._loaded[doc["_id"]] = self.index.new_cluster(doc["_id"])
+            self.index.add(np.frombuffer(doc["sig"], dtype=np.uint8), doc["keys"], cluster)
+        return cluster
+
+    def _refresh(self) -> bool:
+        """
+        Load the clusters created since the last refresh (the newest
+        `warm_limit` on first use). Returns False when not yet due.
+        """
+        if time.monotonic() < self._next_refresh:
+            return False
+        self._next_refresh = time.monotonic() + self.refresh_seconds
+        query: Dict[str, object] = {}
+        if self._refreshed_at is not None:
+            # `$gte`: clusters stored in the same millisecond as the last one
+            # seen; those already loaded are skipped by `_load`
+            query["created_at"] = {"$gte": self._refreshed_at}
+        try:
+            docs = list(
+                get_sync_clusters_collection().find(query, {"sig": 1, "keys": 1, "created_at": 1})
+                .sort("created_at", -1)
+                .limit(self.warm_limit)
+            )
+        except Exception as exc:  # noqa: BLE001
+            print(f"[clusters] Failed to refresh clusters: {exc}")
+            return False
+        for doc in reversed(docs):
+            self._load(doc)
+            created_at = doc.get("created_at")
+            if created_at is not None and (self._refreshed_at is None or created_at > self._refreshed_at):
+                self._refreshed_at = created_at
+        return True
+
+    def _find(self, normalized: str) -> Tuple[np.ndarray, List[int], Optional[int], float]:
+        sig = signature(normalized)
+        compact_sig, keys = compact(sig), band_keys(sig)
+        found = self.index.query(compact_sig, keys)
+        if found is None and self._refresh():
+            found = self.index.query(compact_sig, keys)
+        if found is None:
+            return compact_sig, keys, None, 0.0
+        return compact_sig, keys, found[0], found[1]
+
+    def lookup(self, normalized: str) -> Optional[str]:
+        with self._lock:
+            _, _, cluster, _ = self._find(normalized)
+            return None if cluster is None else self.index.cluster_id(cluster)
+
+    def assign(self, normalized: str, fingerprint: str) -> str:
+        with self._lock:
+            return self._assign(normalized, fingerprint)
+
+    def _assign(self, normalized: str, fingerprint: str) -> str:
+        compact_sig, keys, cluster, similarity = self._find(normalized)
+        if cluster is not None:
+            if similarity < 1.0:
+                # index variants too, so the cluster keeps matching as it drifts
+                self.index.add(compact_sig, keys, cluster)
+            return self.index.cluster_id(cluster)
+
+        get_sync_clusters_collection().update_one(
+            {"_id": fingerprint},
+            {"$setOnInsert": {"sig": Binary(compact_sig.tobytes()), "keys": keys, "created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        self._load({"_id": fingerprint, "sig": compact_sig.tobytes(), "keys": keys})
+        return fingerprint
+
+
+_assigner: Optional[ClusterAssigner] = None
+
+
+def get_assigner() -> ClusterAssigner:
+    global _assigner
+    if _assigner is None:
+        _assigner = ClusterAssigner(
+            threshold=SIMILARITY_THRESHOLD,
+            warm_limit=CLUSTER_WARM_LIMIT,
+            refresh_seconds=CLUSTER_REFRESH_SECONDS,
+        )
+    return _assigner
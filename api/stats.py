@@ -1,12 +1,40 @@
 # ai/context_stats.py
 from __future__ import annotations
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Tuple
-import hashlib, re
+from typing import Dict, Any, List, Optional
+import hashlib, os, re
+from bson import ObjectId
+from pymongo import UpdateOne
 from pymongo.collection import Collection
 import numpy as np
 from api.services import get_sync_messages_collection
 
+# "rollup" serves stats from api.rollups buckets, "raw" aggregates `messages`
+STATS_SOURCE = os.getenv("STATS_SOURCE", "rollup").strip().lower()
+
+# "inline" builds stats inside the ingest request, "async" in the
+# `api.tasks.build_context_stats` Celery stage
+STATS_MODE = os.getenv("STATS_MODE", "inline").strip().lower()
+
+# with STATS_MODE=async: "before_analysis" chains stats -> analyze_message,
+# "parallel" publishes both at once
+STATS_ORDERING = os.getenv("STATS_ORDERING", "before_analysis").strip().lower()
+
+# "normalize" hashes the regex-normalized line, "drain" uses the id of the
+# log template learned by api.templates
+FINGERPRINT_ENGINE = os.getenv("FINGERPRINT_ENGINE", "normalize").strip().lower()
+
+# field that groups messages for stats, rollups, the classification cache and
+# digests: "fingerprint" (identical normalized content) or "cluster_id"
+# (near-duplicates, assigned at ingest by api.similarity)
+GROUPING_KEY = os.getenv("GROUPING_KEY", "fingerprint").strip().lower()
+CLUSTERING = os.getenv("CLUSTERING", "0") == "1" or GROUPING_KEY == "cluster_id"
+
+# with STATS_MODE=async the stats task embeds messages (ai.embeddings) and
+# attaches the SIMILAR_INCIDENTS_K nearest past messages from ai.vector_index
+EMBEDDINGS = os.getenv("EMBEDDINGS", "0") == "1"
+SIMILAR_INCIDENTS_K = int(os.getenv("SIMILAR_INCIDENTS_K", 5))
+
 TIME_WINDOWS = {
     "1h": timedelta(hours=1),
     "24h": timedelta(hours=24),
@@ -25,70 +53,244 @@ def normalize(s: str) -> str:
     return s
 
 def fingerprint(s: str) -> str:
+    if FINGERPRINT_ENGINE == "drain":
+        from api.templates import template_fingerprint
+        return template_fingerprint(s)
     return hashlib.sha1(normalize(s).encode("utf-8")).hexdigest()
 
+def cluster_id(s: str, fp: str | None = None) -> str:
+    """
+    Near-duplicate cluster of `s`; a new cluster is named after `fp`.
+    """
+    from api.similarity import get_assigner
+    return get_assigner().assign(normalize(s), fp or fingerprint(s))
+
+def group_value(doc: Dict[str, Any]) -> Optional[str]:
+    return doc.get(GROUPING_KEY) or doc.get("fingerprint")
+
+def group_value_for_content(s: str) -> str:
+    if GROUPING_KEY != "cluster_id":
+        return fingerprint(s)
+    from api.similarity import get_assigner
+    return get_assigner().lookup(normalize(s)) or fingerprint(s)
+
+def _window_facets(since: datetime, limit_examples: int) -> Dict[str, List[Dict[str, Any]]]:
+    in_window = {"$match": {"created_at": {"$gte": since}}}
+    return {
+        "summary": [
+            in_window,
+            {"$group": {"_id": None, "count": {"$sum": 1}, "last_seen": {"$max": "$created_at"}}},
+        ],
+        "labels": [
+            in_window,
+            {"$match": {"label": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$label", "count": {"$sum": 1}}},
+        ],
+        "services": [
+            in_window,
+            {"$match": {"service": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$service", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": 3},
+        ],
+        "components": [
+            in_window,
+            {"$match": {"component": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$component", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": 3},
+        ],
+        # the median is computed server-side (MongoDB 7.0+): pushing every
+        # TTR of a busy group into one document could exceed the 16MB limit
+        "ttrs": [
+            in_window,
+            {"$match": {"ttr": {"$ne": None}}},
+            {"$group": {"_id": None, "median": {"$median": {"input": "$ttr", "method": "approximate"}}}},
+        ],
+        "examples": [
+            in_window,
+            {"$limit": limit_examples},
+            {"$project": {"_id": 1, "fragment": 1}},
+        ],
+    }
+
+
+def aggregate_window_stats(
+    collection: Collection,
+    match: Dict[str, Any],
+    now: datetime,
+    since_by_window: Dict[str, datetime],
+    limit_examples: int = 3,
+) -> Dict[str, Any]:
+    """
+    Compute every window in a single aggregation: the widest range is matched
+    once (index on `fingerprint` + `created_at`) and each window is a set of
+    `$facet` sub-pipelines over that one stream of documents.
+    """
+    oldest = min(since_by_window.values())
+    facets: Dict[str, List[Dict[str, Any]]] = {}
+    for key, since in since_by_window.items():
+        for name, sub_pipeline in _window_facets(since, limit_examples).items():
+            facets[f"{key}__{name}"] = sub_pipeline
+
+    pipeline = [
+        {"$match": {**match, "created_at": {"$gte": oldest, "$lte": now}}},
+        {"$project": {
+            "created_at": 1,
+            "service": 1,
+            "component": 1,
+            "label": "$analysis.label",
+            "fragment": {"$substrCP": [{"$ifNull": ["$content", ""]}, 0, 200]},
+            "ttr": {"$cond": [
+                {"$and": [
+                    {"$eq": [{"$type": "$created_at"}, "date"]},
+                    {"$eq": [{"$type": "$resolved_at"}, "date"]},
+                    {"$gte": ["$resolved_at", "$created_at"]},
+                ]},
+                {"$divide": [{"$subtract": ["$resolved_at", "$created_at"]}, 1000]},
+                None,
+            ]},
+        }},
+        {"$facet": facets},
+    ]
+    result = next(collection.aggregate(pipeline), {})
+
+    stats: Dict[str, Any] = {"windows": {}, "last_seen_at": None}
+    for key in since_by_window:
+        summary = (result.get(f"{key}__summary") or [{}])[0]
+        ttr_rows = result.get(f"{key}__ttrs") or []
+        median_ttr = ttr_rows[0].get("median") if ttr_rows else None
+
+        last_seen = summary.get("last_seen")
+        if last_seen and (stats["last_seen_at"] is None or last_seen > stats["last_seen_at"]):
+            stats["last_seen_at"] = last_seen
+
+        stats["windows"][key] = {
+            "count": summary.get("count", 0),
+            "labels_distribution": {row["_id"]: row["count"] for row in result.get(f"{key}__labels", [])},
+            "top_services": [(row["_id"], row["count"]) for row in result.get(f"{key}__services", [])],
+            "top_components": [(row["_id"], row["count"]) for row in result.get(f"{key}__components", [])],
+            "median_ttr_sec": float(median_ttr) if median_ttr is not None else None,
+            "examples": [
+                {"id": str(row.get("_id")), "fragment": row.get("fragment") or ""}
+                for row in result.get(f"{key}__examples", [])
+            ],
+        }
+
+    return stats
+
+
+def similar_incidents_batch(
+    embeddings: np.ndarray,
+    exclude_ids: List[str | None] | None = None,
+    k: int = SIMILAR_INCIDENTS_K,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Top-`k` most similar indexed messages for each embedding, with their
+    labels and resolution times fetched by one `$in` query for the batch.
+    """
+    from ai.vector_index import get_index
+
+    index = get_index(dim=embeddings.shape[1])
+    exclude_ids = exclude_ids or [None] * len(embeddings)
+    hits = [
+        [(mid, score) for mid, score in index.search(vector, k + 1) if mid != exclude][:k]
+        for vector, exclude in zip(embeddings, exclude_ids)
+    ]
+    wanted = {mid for row in hits for mid, _ in row}
+    docs: Dict[str, Dict[str, Any]] = {}
+    if wanted:
+        cursor = get_sync_messages_collection().find(
+            {"_id": {"$in": [ObjectId(mid) for mid in wanted]}},
+            {"analysis.label": 1, "created_at": 1, "resolved_at": 1, "service": 1, "content": 1},
+        )
+        docs = {str(doc["_id"]): doc for doc in cursor}
+
+    results: List[List[Dict[str, Any]]] = []
+    for row in hits:
+        incidents = []
+        for mid, score in row:
+            doc = docs.get(mid)
+            if doc is None:
+                continue
+            created_at, resolved_at = doc.get("created_at"), doc.get("resolved_at")
+            ttr = None
+            if isinstance(created_at, datetime) and isinstance(resolved_at, datetime) and resolved_at >= created_at:
+                ttr = (resolved_at - created_at).total_seconds()
+            incidents.append({
+                "id": mid,
+                "similarity": round(score, 4),
+                "label": (doc.get("analysis") or {}).get("label"),
+                "service": doc.get("service"),
+                "created_at": created_at,
+                "ttr_sec": ttr,
+                "fragment": (doc.get("content") or "")[:200],
+            })
+        results.append(incidents)
+    return results
+
+
 def build_stats_for_message(
     content: str,
     now: datetime | None = None,
     embedding: List[float] | None = None,
     limit_examples: int = 3,
+    group: str | None = None,
 ) -> Dict[str, Any]:
+    """
+    Stats of the GROUPING_KEY group of `content`; pass `group` when the
+    stored document already carries it. With an `embedding` the stats also
+    list the `similar_incidents` found in the vector index.
+    """
     now = now or datetime.utcnow()
     collection: Collection = get_sync_messages_collection()
 
-    fp = fingerprint(content)
-
-    stats: Dict[str, Any] = {"windows": {}, "last_seen_at": None}
+    group = group or group_value_for_content(content)
+    if STATS_SOURCE == "rollup":
+        from api.rollups import build_stats_from_rollups
+        stats = build_stats_from_rollups(group, now, TIME_WINDOWS, limit_examples)
+    else:
+        since_by_window = {key: now - delta for key, delta in TIME_WINDOWS.items()}
+        stats = aggregate_window_stats(collection, {GROUPING_KEY: group}, now, since_by_window, limit_examples)
 
-    for key, delta in TIME_WINDOWS.items():
-        since = now - delta
-        cur = collection.find(
-            {"fingerprint": fp, "created_at": {"$gte": since, "$lte": now}},
-            {"analysis.label": 1, "service": 1, "component": 1, "resolved_at": 1, "content": 1, "created_at": 1},
-        )
+    if embedding is not None:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        stats["similar_incidents"] = similar_incidents_batch(vector)[0]
+    return stats
 
-        count = 0
-        labels: Dict[str, int] = {}
-        services: Dict[str, int] = {}
-        components: Dict[str, int] = {}
-        ttrs: List[float] = []
-        examples: List[Tuple[str, str]] = []
-        last_seen = stats["last_seen_at"]
-
-        for d in cur:
-            count += 1
-            lbl = (d.get("analysis") or {}).get("label")
-            if lbl: labels[lbl] = labels.get(lbl, 0) + 1
-            svc = d.get("service"); cmp = d.get("component")
-            if svc: services[svc] = services.get(svc, 0) + 1
-            if cmp: components[cmp] = components.get(cmp, 0) + 1
-
-            ca = d.get("created_at")
-            if ca and (last_seen is None or ca > last_seen):
-                last_seen = ca
-
-            ra = d.get("resolved_at")
-            if ca and ra and isinstance(ca, datetime) and isinstance(ra, datetime) and ra >= ca:
-                ttrs.append((ra - ca).total_seconds())
-
-            if len(examples) < limit_examples:
-                cid = str(d.get("_id"))
-                fragment = (d.get("content") or "")[:200]
-                examples.append((cid, fragment))
+def build_stats_by_fingerprint(docs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Stats depend only on the group (GROUPING_KEY), so each distinct group in
+    a batch is computed once and shared by all of its messages.
+    """
+    stats_by_fp: Dict[str, Dict[str, Any]] = {}
+    for doc in docs:
+        fp = group_value(doc)
+        if fp in stats_by_fp:
+            continue
+        try:
+            stats_by_fp[fp] = build_stats_for_message(doc["content"], group=fp)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[stats] Failed to build stats for {GROUPING_KEY} {fp}: {exc}")
+    return stats_by_fp
 
-        if last_seen and (stats["last_seen_at"] is None or last_seen > stats["last_seen_at"]):
-            stats["last_seen_at"] = last_seen
 
-        stats["windows"][key] = {
-            "count": count,
-            "labels_distribution": labels,
-            "top_services": sorted(services.items(), key=lambda x: x[1], reverse=True)[:3],
-            "top_components": sorted(components.items(), key=lambda x: x[1], reverse=True)[:3],
-            "median_ttr_sec": float(np.median(ttrs)) if ttrs else None,
-            "examples": [{"id": eid, "fragment": txt} for eid, txt in examples],
-        }
+def context_stats_ops(
+    docs: List[Dict[str, Any]],
+    stats_by_fp: Dict[str, Dict[str, Any]],
+    similar_by_id: Dict[str, List[Dict[str, Any]]] | None = None,
+) -> List[UpdateOne]:
+    ops = []
+    for doc in docs:
+        stats = stats_by_fp.get(group_value(doc))
+        if stats is None:
+            continue
+        similar = (similar_by_id or {}).get(str(doc["_id"]))
+        if similar is not None:
+            stats = {**stats, "similar_incidents": similar}
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"context_stats": stats}}))
+    return ops
 
-    return stats
 
 def pack_prompt_snippet(stats: Dict[str, Any]) -> str:
     win = stats.get("windows", {}).get("24h", {})
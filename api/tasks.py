@@ -0,0 +1,62 @@
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from api.rollups import ingest_ops
+from api.services import get_sync_messages_collection, get_sync_rollups_collection
+from api.stats import EMBEDDINGS, build_stats_by_fingerprint, context_stats_ops, similar_incidents_batch
+from celery_app import celery_app
+
+
+@celery_app.task(name="api.tasks.build_context_stats")
+def build_context_stats(message_ids: List[str]):
+    """
+    Background variant of the ingest-time stats step (STATS_MODE=async):
+    update the rollups and attach `context_stats` for already stored messages.
+    With EMBEDDINGS=1 the messages are also embedded, matched against the
+    vector index (`similar_incidents`) and then appended to it.
+    Errors are logged and swallowed so a chained `analyze_message` still runs.
+    """
+    try:
+        coll = get_sync_messages_collection()
+        docs = list(coll.find(
+            {"_id": {"$in": [ObjectId(mid) for mid in message_ids]}},
+            {"fingerprint": 1, "cluster_id": 1, "created_at": 1, "service": 1, "component": 1, "content": 1},
+        ))
+    except Exception as exc:  # noqa: BLE001
+        print(f"[stats] Failed to load {len(message_ids)} messages: {exc}")
+        return {"error": str(exc), "ids": message_ids}
+    if not docs:
+        return {"error": "not found", "ids": message_ids}
+
+    try:
+        get_sync_rollups_collection().bulk_write(ingest_ops(docs), ordered=False)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[rollups] Failed to update rollups for {len(docs)} messages: {exc}")
+
+    similar_by_id = _similar_incidents(docs) if EMBEDDINGS else None
+
+    updated = 0
+    try:
+        ops = context_stats_ops(docs, build_stats_by_fingerprint(docs), similar_by_id)
+        if ops:
+            updated = coll.bulk_write(ops, ordered=False).modified_count
+    except Exception as exc:  # noqa: BLE001
+        print(f"[stats] Failed to attach stats for {len(docs)} messages: {exc}")
+
+    return {"ids": message_ids, "updated": updated}
+
+
+def _similar_incidents(docs: List[Dict[str, Any]]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    try:
+        from ai.embeddings import embed
+        from ai.vector_index import get_index
+
+        ids = [str(doc["_id"]) for doc in docs]
+        vectors = embed([doc.get("content") or "" for doc in docs])
+        # search before appending so a message never finds itself
+        similar = similar_incidents_batch(vectors, exclude_ids=ids)
+        get_index(dim=vectors.shape[1]).append(ids, vectors)
+        return dict(zip(ids, similar))
+    except Exception as exc:  # noqa: BLE001
+        print(f"[embeddings] Failed to find similar incidents for {len(docs)} messages: {exc}")
+        return None
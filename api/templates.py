@@ -0,0 +1,278 @@
+# api/templates.py
+"""
+Streaming log-template mining (Drain) as a fingerprinting engine.
+
+Each line is tokenized once: split on whitespace, lower-cased, and every token
+containing a digit (numbers, ids, IPs, UUIDs, durations) becomes `<*>`. The
+tokens are routed through a fixed-depth parse tree: token count, then the
+first DRAIN_DEPTH - 2 tokens (`<*>` for variable ones, and for any token once
+a node already has DRAIN_MAX_CHILDREN children). The leaf holds a few
+templates; the line joins the one sharing the most constant tokens if at least
+DRAIN_SIMILARITY of its positions agree, and positions that differ become
+`<*>` in that template. Otherwise it starts a new template.
+
+A template's id - the SHA-1 of the tokens of the line that created it - stays
+the same while the template generalizes, so it can serve as the message
+fingerprint (FINGERPRINT_ENGINE=drain).
+
+At most DRAIN_MAX_TEMPLATES templates are kept in memory, least recently
+matched first out. Templates are persisted to the `log_templates` collection:
+on a local miss the miner looks for a stored template with the same route
+before creating one (so API workers converge on the same ids and evicted
+templates come back), and every DRAIN_REFRESH_SECONDS it pulls templates that
+other workers created or generalized.
+
+Usage:
+    python -m api.templates show [--limit 20]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.collection import Collection
+
+WILDCARD = "<*>"
+
+DRAIN_DEPTH = int(os.getenv("DRAIN_DEPTH", 4))
+DRAIN_SIMILARITY = float(os.getenv("DRAIN_SIMILARITY", 0.5))
+DRAIN_MAX_CHILDREN = int(os.getenv("DRAIN_MAX_CHILDREN", 100))
+DRAIN_MAX_TEMPLATES = int(os.getenv("DRAIN_MAX_TEMPLATES", 50_000))
+DRAIN_REFRESH_SECONDS = float(os.getenv("DRAIN_REFRESH_SECONDS", 30))
+
+_DIGIT = re.compile(r"\d").search
+
+
+def tokenize(line: str) -> List[str]:
+    return [
+        token if token.isalpha() or not _DIGIT(token) else WILDCARD
+        for token in line.lower().split()
+    ]
+
+
+class Template:
+    __slots__ = ("id", "tokens", "size", "route")
+
+    def __init__(self, template_id: str, tokens: List[str], route: Tuple[str, ...], size: int = 0):
+        self.id = template_id
+        self.tokens = tokens
+        self.route = route
+        self.size = size
+
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+
+def _similarity(template: List[str], tokens: List[str]) -> Tuple[float, int]:
+    same = 0
+    wildcards = 0
+    for left, right in zip(template, tokens):
+        if left == WILDCARD:
+            wildcards += 1
+        elif left == right:
+            same += 1
+    return same / len(tokens), wildcards
+
+
+class TemplateMiner:
+    def __init__(
+        self,
+        collection: Optional[Collection] = None,
+        depth: int = DRAIN_DEPTH,
+        similarity: float = DRAIN_SIMILARITY,
+        max_children: int = DRAIN_MAX_CHILDREN,
+        max_templates: int = DRAIN_MAX_TEMPLATES,
+        refresh_seconds: float = DRAIN_REFRESH_SECONDS,
+    ):
+        self.collection = collection
+        self.prefix = max(1, depth - 2)
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_templates = max_templates
+        self.refresh_seconds = refresh_seconds
+        # route -> templates in that leaf; the tree levels above the leaf are
+        # folded into the route tuple (length, prefix tokens...)
+        self._leaves: Dict[Tuple[str, ...], List[Template]] = {}
+        self._children: Dict[Tuple[str, ...], set] = {}
+        self._templates: "OrderedDict[str, Template]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshed_at: Optional[datetime] = None
+        self._next_refresh = 0.0
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def _route(self, tokens: List[str]) -> Tuple[str, ...]:
+        route: Tuple[str, ...] = (str(len(tokens)),)
+        for token in tokens[:self.prefix]:
+            children = self._children.setdefault(route, set())
+            if token not in children and len(children) >= self.max_children:
+                token = WILDCARD
+            children.add(token)
+            route = route + (token,)
+        return route
+
+    def _match(self, leaf: List[Template], tokens: List[str]) -> Optional[Template]:
+        best: Optional[Template] = None
+        best_key = (-1.0, -1)
+        for template in leaf:
+            score, wildcards = _similarity(template.tokens, tokens)
+            if (score, wildcards) > best_key:
+                best, best_key = template, (score, wildcards)
+        if best is not None and best_key[0] >= self.similarity:
+            return best
+        return None
+
+    def _insert(self, template: Template) -> None:
+        self._leaves.setdefault(template.route, []).append(template)
+        self._templates[template.id] = template
+        while len(self._templates) > self.max_templates:
+            _, evicted = self._templates.popitem(last=False)
+            leaf = self._leaves.get(evicted.route, [])
+            if evicted in leaf:
+                leaf.remove(evicted)
+
+    def _generalize(self, template: Template, tokens: List[str]) -> bool:
+        changed = False
+        for i, (left, right) in enumerate(zip(template.tokens, tokens)):
+            if left != right and left != WILDCARD:
+                template.tokens[i] = WILDCARD
+                changed = True
+        return changed
+
+    def add(self, line: str) -> Template:
+        """
+        Match `line` against the learned templates (learning from it) and
+        return its template.
+        """
+        tokens = tokenize(line) or [WILDCARD]
+        with self._lock:
+            self._maybe_refresh()
+            route = self._route(tokens)
+            leaf = self._leaves.get(route, [])
+            template = self._match(leaf, tokens)
+            if template is None:
+                template = self._load_stored(route, tokens)
+            if template is None:
+                template_id = hashlib.sha1(" ".join(tokens).encode("utf-8")).hexdigest()
+                template = Template(template_id, list(tokens), route)
+                self._insert(template)
+                self._store(template, created=True)
+            elif self._generalize(template, tokens):
+                self._store(template)
+            template.size += 1
+            self._templates.move_to_end(template.id)
+            return template
+
+    # persistence
+
+    @staticmethod
+    def _route_key(route: Tuple[str, ...]) -> str:
+        return " ".join(route)
+
+    def _store(self, template: Template, created: bool = False) -> None:
+        if self.collection is None:
+            return
+        now = datetime.utcnow()
+        try:
+            if created:
+                self.collection.update_one(
+                    {"_id": template.id},
+                    {"$setOnInsert": {
+                        "route": self._route_key(template.route),
+                        "tokens": template.tokens,
+                        "created_at": now,
+                        "updated_at": now,
+                    }},
+                    upsert=True,
+                )
+            else:
+                self.collection.update_one(
+                    {"_id": template.id},
+                    {"$set": {"tokens": template.tokens, "updated_at": now}},
+                )
+        except Exception as exc:  # noqa: BLE001
+            print(f"[templates] Failed to store template {template.id}: {exc}")
+
+    def _from_doc(self, doc: Dict[str, Any], route: Tuple[str, ...]) -> Template:
+        existing = self._templates.get(doc["_id"])
+        if existing is not None:
+            # another worker generalized it: adopt the wider template
+            self._generalize(existing, doc["tokens"])
+            return existing
+        template = Template(doc["_id"], list(doc["tokens"]), route)
+        self._insert(template)
+        return template
+
+    def _load_stored(self, route: Tuple[str, ...], tokens: List[str]) -> Optional[Template]:
+        if self.collection is None:
+            return None
+        try:
+            docs = list(self.collection.find({"route": self._route_key(route)}, {"tokens": 1}).limit(100))
+        except Exception as exc:  # noqa: BLE001
+            print(f"[templates] Failed to load templates for {route}: {exc}")
+            return None
+        candidates = [self._from_doc(doc, route) for doc in docs if len(doc["tokens"]) == len(tokens)]
+        return self._match(candidates, tokens)
+
+    def _maybe_refresh(self) -> None:
+        if self.collection is None or time.monotonic() < self._next_refresh:
+            return
+        self._next_refresh = time.monotonic() + self.refresh_seconds
+        query: Dict[str, Any] = {}
+        if self._refreshed_at is not None:
+            query["updated_at"] = {"$gt": self._refreshed_at}
+        try:
+            docs = list(
+                self.collection.find(query, {"route": 1, "tokens": 1, "updated_at": 1})
+                .sort("updated_at", -1)
+                .limit(self.max_templates)
+            )
+        except Exception as exc:  # noqa: BLE001
+            print(f"[templates] Failed to refresh templates: {exc}")
+            return
+        for doc in reversed(docs):
+            self._from_doc(doc, tuple(doc["route"].split(" ")))
+            if self._refreshed_at is None or doc["updated_at"] > self._refreshed_at:
+                self._refreshed_at = doc["updated_at"]
+
+
+_miner: Optional[TemplateMiner] = None
+
+
+def get_miner() -> TemplateMiner:
+    global _miner
+    if _miner is None:
+        from api.services import get_sync_templates_collection
+        _miner = TemplateMiner(collection=get_sync_templates_collection())
+    return _miner
+
+
+def template_fingerprint(line: str) -> str:
+    return get_miner().add(line).id
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect mined log templates")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_show = sub.add_parser("show", help="print the most recently updated templates")
+    p_show.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    from api.services import get_sync_templates_collection
+    docs = get_sync_templates_collection().find({}, {"tokens": 1, "updated_at": 1}).sort("updated_at", -1)
+    for doc in docs.limit(args.limit):
+        print(f"{doc['_id']} {doc['updated_at']:%Y-%m-%d %H:%M:%S} {' '.join(doc['tokens'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
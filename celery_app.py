@@ -18,6 +18,7 @@ celery_app = Celery(
     backend=redis_url,
     include=[
         "ai.tasks",
+        "api.tasks",
         "notification_service.tasks",  # додаємо наш новий модуль
     ],
 )
@@ -25,7 +26,11 @@ celery_app = Celery(
 # черги
 celery_app.conf.task_routes = {
     "ai.tasks.analyze_message": {"queue": "ai_queue"},
+    "api.tasks.build_context_stats": {"queue": "stats_queue"},
     "notification_service.tasks.send_message": {"queue": "notification_queue"},
+    "notification_service.tasks.send_batch": {"queue": "notification_queue"},
+    "notification_service.tasks.send_digest": {"queue": "notification_queue"},
+    "notification_service.tasks.send_digests": {"queue": "notification_queue"},
     "notification_service.tasks.dispatch_non_critical": {"queue": "notification_queue"},
 }
 
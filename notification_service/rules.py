@@ -0,0 +1,69 @@
+"""
+Dispatch rules of the notification service, free of Celery and MongoDB.
+
+`notification_service.tasks` applies them to the `messages` collection, and
+`tests/notification_simulator.py` replays them against an in-memory store:
+
+* a message whose analysis is `critical` is sent on its own right away
+* every DISPATCH_INTERVAL_MINUTES the rest, stored before the cutoff and not
+  yet sent, go out in chunks of DISPATCH_CHUNK_SIZE (one notification per
+  message) or, with DISPATCH_MODE=digest, as one notification per group
+"""
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+SEVERITY_ORDER = ["critical", "high", "medium", "low"]
+
+
+def is_critical(analysis: Optional[Dict[str, Any]]) -> bool:
+    return (analysis or {}).get("label") == "critical"
+
+
+def dispatch_cutoff(now: datetime, interval_minutes: int) -> datetime:
+    """
+    Messages stored after the cutoff wait for the next dispatch, which gives
+    their analysis (and a critical send) time to finish first.
+    """
+    return now - timedelta(minutes=interval_minutes)
+
+
+def pending_non_critical_filter(cutoff: datetime) -> dict:
+    """
+    Неприорітетні невідправлені повідомлення, зареєстровані до cutoff.
+    `sent: False` відповідає частковому індексу `unsent_timestamp`.
+    """
+    return {
+        "sent": False,
+        "analysis.label": {"$ne": "critical"},
+        "timestamp": {"$lte": cutoff},
+    }
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def digest_group_id(grouping_key: str, by_service: bool) -> Dict[str, str]:
+    """
+    The `$group` `_id` of a digest: the GROUPING_KEY value, and the service
+    with DIGEST_GROUP_BY_SERVICE=1.
+    """
+    group_id = {"fingerprint": f"${grouping_key}"}
+    if by_service:
+        group_id["service"] = "$service"
+    return group_id
+
+
+def highest_severity(labels: List[str]) -> str:
+    for severity in SEVERITY_ORDER:
+        if severity in labels:
+            return severity
+    return "unknown"
@@ -0,0 +1,134 @@
+"""
+In-process HTTP and SMTP sinks for offline delivery benchmarks and tests.
+
+Both servers accept connections on localhost, speak just enough of their
+protocol for `WebhookTransport` / `SmtpTransport` (HTTP/1.1 keep-alive with
+Content-Length bodies; EHLO/MAIL/RCPT/DATA/RSET/NOOP/QUIT) and count what they
+received. `latency` adds a per-request delay and `fail_every` answers every
+N-th request with a retryable error to exercise retries.
+
+    sink = HttpSink(latency=0.005)
+    host, port = sink.start()          # runs in a background thread
+    ...
+    sink.stop(); print(sink.received)
+"""
+import asyncio
+import threading
+from typing import Optional, Tuple
+
+
+class _Sink:
+    def __init__(self, latency: float = 0.0, fail_every: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.received = 0
+        self.requests = 0
+        self.connections = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _should_fail(self) -> bool:
+        self.requests += 1
+        return bool(self.fail_every) and self.requests % self.fail_every == 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        raise NotImplementedError
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await self._handle(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        ready = threading.Event()
+
+        def serve() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._on_connect, host, port)
+            )
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self._server.sockets[0].getsockname()[:2]
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+
+        async def shutdown() -> None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class HttpSink(_Sink):
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            keep_alive = True
+            for line in head.split(b"\r\n")[1:]:
+                name, _, value = line.partition(b":")
+                name = name.strip().lower()
+                if name == b"content-length":
+                    length = int(value.strip())
+                elif name == b"connection" and value.strip().lower() == b"close":
+                    keep_alive = False
+            if length:
+                await reader.readexactly(length)
+
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self._should_fail():
+                writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+            else:
+                self.received += 1
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            if not keep_alive:
+                return
+
+
+class SmtpSink(_Sink):
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b"220 sink ESMTP\r\n")
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250 sink\r\n")
+            elif command in (b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                writer.write(b"250 OK\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                await writer.drain()
+                await reader.readuntil(b"\r\n.\r\n")
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self._should_fail():
+                    writer.write(b"451 Try again later\r\n")
+                else:
+                    self.received += 1
+                    writer.write(b"250 OK queued\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 Bye\r\n")
+                await writer.drain()
+                return
+            else:
+                writer.write(b"502 Command not implemented\r\n")
+            await writer.drain()
@@ -1,30 +1,86 @@
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 from celery_app import celery_app
+from celery.utils.time import get_exponential_backoff_interval
 from bson import ObjectId
 from dotenv import load_dotenv
+from pymongo import UpdateMany, UpdateOne
+from api.indexes import backfill_sent
 from api.services import get_sync_messages_collection
+from api.stats import GROUPING_KEY
+from notification_service.rules import (
+    chunked,
+    digest_group_id,
+    dispatch_cutoff,
+    highest_severity,
+    is_critical,
+    pending_non_critical_filter,
+)
+from notification_service.transports import DeliveryError, deliver, deliver_one
 
 load_dotenv()
 
 DISPATCH_INTERVAL = int(os.getenv("DISPATCH_INTERVAL_MINUTES", 5))
+DISPATCH_CHUNK_SIZE = int(os.getenv("DISPATCH_CHUNK_SIZE", 500))
+# "batch" - одне сповіщення на повідомлення, "digest" - одне на групу GROUPING_KEY
+DISPATCH_MODE = os.getenv("DISPATCH_MODE", "batch").strip().lower()
+DIGEST_GROUP_BY_SERVICE = os.getenv("DIGEST_GROUP_BY_SERVICE", "0") == "1"
+# критичні не потрапляють у dispatch, тому send_message повторює відправку сам
+SEND_MAX_RETRIES = int(os.getenv("NOTIFY_SEND_MAX_RETRIES", 8))
+SEND_BACKOFF_MAX_SECONDS = int(os.getenv("NOTIFY_SEND_BACKOFF_MAX_SECONDS", 600))
+# повідомлення без поля sent (збережені до оновлення) доповнюються пачками
+SENT_BACKFILL_BATCH = int(os.getenv("SENT_BACKFILL_BATCH", 10_000))
 
 messages_collection = get_sync_messages_collection()
+_sent_backfilled = False
 
 
-@celery_app.task(name="notification_service.tasks.send_message")
-def send_message(message_id: str):
+def _message_notification(message_id: str, severity: str, content: str) -> Dict[str, Any]:
+    return {"kind": "message", "id": message_id, "severity": severity, "content": content}
+
+
+@celery_app.task(name="notification_service.tasks.send_message", bind=True, max_retries=SEND_MAX_RETRIES)
+def send_message(
+    self,
+    message_id: str,
+    content: Optional[str] = None,
+    severity: Optional[str] = None,
+    delivered_to: Optional[List[str]] = None,
+):
     """
     Відправити одне повідомлення за його ID.
+    Якщо content і severity передані в payload (з analyze_message),
+    документ не читається повторно - лише один update_one для sent.
+    Невдала доставка повторюється з експоненційною затримкою до
+    NOTIFY_SEND_MAX_RETRIES разів, лише на ті адреси (delivered_to),
+    які ще не отримали сповіщення.
     """
-    doc = messages_collection.find_one({"_id": ObjectId(message_id)})
-    if not doc:
-        return {"error": "message not found", "id": message_id}
+    if content is None or severity is None:
+        doc = messages_collection.find_one(
+            {"_id": ObjectId(message_id)}, {"content": 1, "analysis.label": 1}
+        )
+        if not doc:
+            return {"error": "message not found", "id": message_id}
+        content = doc.get("content")
+        severity = doc.get("analysis", {}).get("label", "unknown")
 
-    # --- (email/SMS/Push) ---
-    content = doc.get("content")
-    severity = doc.get("analysis", {}).get("label", "unknown")
-    print(f"[SEND] ({severity}) {message_id}: {content}")
+    delivered_to = list(delivered_to or [])
+    try:
+        delivered_to += deliver_one(_message_notification(message_id, severity, content), skip=delivered_to)
+    except DeliveryError as exc:
+        delivered_to += exc.delivered
+        if self.request.retries >= self.max_retries:
+            print(f"[notify] Giving up on {message_id} after {self.max_retries} retries: {exc}")
+            raise
+        countdown = get_exponential_backoff_interval(
+            factor=1, retries=self.request.retries, maximum=SEND_BACKOFF_MAX_SECONDS, full_jitter=True,
+        )
+        raise self.retry(
+            exc=exc,
+            countdown=countdown,
+            kwargs={"content": content, "severity": severity, "delivered_to": delivered_to},
+        )
 
     messages_collection.update_one(
         {"_id": ObjectId(message_id)},
@@ -34,29 +90,184 @@ def send_message(message_id: str):
     return {"id": message_id, "sent": True}
 
 
+@celery_app.task(name="notification_service.tasks.send_batch")
+def send_batch(message_ids: List[str]):
+    """
+    Відправити пачку повідомлень: один find з проєкцією потрібних полів
+    і один bulk_write для позначки sent.
+    """
+    docs = messages_collection.find(
+        {"_id": {"$in": [ObjectId(mid) for mid in message_ids]}, "sent": False},
+        {"content": 1, "analysis.label": 1},
+    )
+
+    docs = list(docs)
+    errors = deliver([
+        _message_notification(str(doc["_id"]), (doc.get("analysis") or {}).get("label", "unknown"), doc.get("content"))
+        for doc in docs
+    ])
+
+    # недоставлені лишаються sent=False і підуть у наступний dispatch
+    now = datetime.utcnow()
+    updates = [
+        UpdateOne({"_id": doc["_id"]}, {"$set": {"sent": True, "sent_at": now}})
+        for doc, error in zip(docs, errors)
+        if error is None
+    ]
+    if updates:
+        messages_collection.bulk_write(updates, ordered=False)
+
+    return {"sent": len(updates), "failed": len(docs) - len(updates), "requested": len(message_ids)}
+
+
+def _digest_members(digest: Dict[str, Any]) -> Dict[str, Any]:
+    members = pending_non_critical_filter(datetime.fromisoformat(digest["cutoff"]))
+    members[digest.get("group_by", "fingerprint")] = digest["fingerprint"]
+    if "service" in digest:
+        members["service"] = digest["service"]
+    return members
+
+
+@celery_app.task(name="notification_service.tasks.send_digests")
+def send_digests(digests: List[Dict[str, Any]]):
+    """
+    Відправити пачку зведених сповіщень (до DISPATCH_CHUNK_SIZE груп)
+    одним конкурентним deliver і позначити членів доставлених груп
+    (до того ж cutoff) як відправлені одним bulk_write з UpdateMany.
+    """
+    errors = deliver([dict(digest, kind="digest") for digest in digests])
+
+    # члени недоставлених груп лишаються sent=False і підуть у наступний dispatch
+    now = datetime.utcnow()
+    updates = [
+        UpdateMany(_digest_members(digest), {"$set": {"sent": True, "sent_at": now}})
+        for digest, error in zip(digests, errors)
+        if error is None
+    ]
+    marked = messages_collection.bulk_write(updates, ordered=False).modified_count if updates else 0
+
+    return {"sent": len(updates), "failed": len(digests) - len(updates), "marked_sent": marked}
+
+
+@celery_app.task(name="notification_service.tasks.send_digest")
+def send_digest(digest: Dict[str, Any]):
+    """
+    Одна група; лишається для задач, поставлених у чергу до send_digests.
+    """
+    result = send_digests([digest])
+    if result["failed"]:
+        raise DeliveryError(f"Failed to deliver digest {digest['fingerprint']}")
+    return {"fingerprint": digest["fingerprint"], "count": digest["count"], "marked_sent": result["marked_sent"]}
+
+
+def _digest(group: Dict[str, Any], cutoff: datetime) -> Dict[str, Any]:
+    digest = {
+        "fingerprint": group["_id"].get("fingerprint"),
+        "group_by": GROUPING_KEY,
+        "count": group["count"],
+        "first_seen": group["first_seen"].isoformat(),
+        "last_seen": group["last_seen"].isoformat(),
+        "sample": group["sample"],
+        "severity": highest_severity(group["labels"]),
+        "cutoff": cutoff.isoformat(),
+    }
+    if DIGEST_GROUP_BY_SERVICE:
+        digest["service"] = group["_id"].get("service")
+    return digest
+
+
+def _dispatch_digests(cutoff: datetime) -> Dict[str, int]:
+    groups = messages_collection.aggregate([
+        {"$match": pending_non_critical_filter(cutoff)},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": digest_group_id(GROUPING_KEY, DIGEST_GROUP_BY_SERVICE),
+            "count": {"$sum": 1},
+            "first_seen": {"$min": "$timestamp"},
+            "last_seen": {"$max": "$timestamp"},
+            "sample": {"$first": "$content"},
+            "labels": {"$addToSet": "$analysis.label"},
+        }},
+    ])
+
+    count = 0
+    messages = 0
+    chunks = 0
+    for chunk in chunked((_digest(group, cutoff) for group in groups), DISPATCH_CHUNK_SIZE):
+        send_digests.apply_async(args=[chunk])
+        count += len(chunk)
+        messages += sum(digest["count"] for digest in chunk)
+        chunks += 1
+
+    return {"dispatched_non_critical": messages, "digests": count, "chunks": chunks}
+
+
+def _backfill_sent() -> None:
+    """
+    Доповнити sent=False старим повідомленням до фільтра dispatch, щоб вони
+    не лишились невідправленими, якщо `python -m api.indexes ensure` не
+    запускали після оновлення.
+    """
+    global _sent_backfilled
+    if _sent_backfilled:
+        return
+    try:
+        _sent_backfilled = backfill_sent(SENT_BACKFILL_BATCH, messages_collection)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[dispatch] Failed to backfill sent: {exc}")
+
+
 @celery_app.task(name="notification_service.tasks.dispatch_non_critical")
 def dispatch_non_critical():
     """
     Пакетна відправка всіх неприорітетних повідомлень,
     які ще не відправлені і були зареєстровані до моменту cutoff.
+    Читаються лише `_id`, а відправка йде пачками по DISPATCH_CHUNK_SIZE.
+    У режимі DISPATCH_MODE=digest - одне сповіщення на групу GROUPING_KEY,
+    групи відправляються пачками по DISPATCH_CHUNK_SIZE.
     """
-    cutoff = datetime.utcnow() - timedelta(minutes=DISPATCH_INTERVAL)
-    cursor = messages_collection.find({
-        "analysis.label": {"$ne": "critical"},
-        "sent": {"$ne": True},
-        "timestamp": {"$lte": cutoff}
-    })
+    _backfill_sent()
+    cutoff = dispatch_cutoff(datetime.utcnow(), DISPATCH_INTERVAL)
+    if DISPATCH_MODE == "digest":
+        return _dispatch_digests(cutoff)
+
+    cursor = messages_collection.find(
+        pending_non_critical_filter(cutoff), {"_id": 1}
+    ).batch_size(DISPATCH_CHUNK_SIZE)
 
     count = 0
-    for doc in cursor:
-        message_id = str(doc["_id"])
-        send_message.apply_async(args=[message_id])
-        count += 1
+    chunks = 0
+    for chunk in chunked((str(doc["_id"]) for doc in cursor), DISPATCH_CHUNK_SIZE):
+        send_batch.apply_async(args=[chunk])
+        count += len(chunk)
+        chunks += 1
 
-    return {"dispatched_non_critical": count}
+    return {"dispatched_non_critical": count, "chunks": chunks}
 
 
-def schedule_immediate_if_critical(message_id: str):
-    doc = messages_collection.find_one({"_id": ObjectId(message_id)})
-    if doc and doc.get("analysis", {}).get("label") == "critical":
-        send_message.apply_async(args=[message_id], queue="notification_queue")
+def schedule_immediate_if_critical(
+    message_id: str,
+    analysis: Optional[Dict[str, Any]] = None,
+    content: Optional[str] = None,
+) -> bool:
+    """
+    Критичність визначається з analysis, який уже є в пам'яті викликача;
+    документ читається лише якщо analysis не передано.
+    """
+    if analysis is None:
+        doc = messages_collection.find_one(
+            {"_id": ObjectId(message_id)}, {"content": 1, "analysis.label": 1}
+        )
+        if not doc:
+            return False
+        analysis = doc.get("analysis") or {}
+        content = doc.get("content")
+
+    if not is_critical(analysis):
+        return False
+    send_message.apply_async(
+        args=[message_id],
+        kwargs={"content": content, "severity": "critical"},
+        queue="notification_queue",
+    )
+    return True
@@ -0,0 +1,372 @@
+"""
+Notification delivery transports.
+
+A transport delivers notification dicts (``kind`` is ``message`` or ``digest``)
+to one or more destinations. Implementations are async so that a `send_batch`
+chunk of messages or a `send_digests` chunk of digests fans out concurrently
+inside one worker process:
+
+* ``ConsoleTransport`` - prints, the default and the previous behaviour
+* ``WebhookTransport`` - JSON POST over pooled keep-alive ``httpx`` connections
+* ``SmtpTransport`` - e-mail over a pool of persistent SMTP connections
+
+Each transport bounds its in-flight sends, rate-limits every destination with
+a token bucket and retries transient failures with jittered backoff. A
+destination that fails does not stop the others. Delivery is at least once
+per destination: `send_message` retries only the destinations that failed,
+but a batch or digest that failed anywhere is sent again in full by the next
+dispatch, so destinations that already got it receive a duplicate. Celery
+tasks are synchronous, so `run()` drives coroutines on one long-lived event
+loop per process, which keeps pooled connections alive between tasks.
+
+Selected with NOTIFY_TRANSPORT=console|webhook|smtp.
+"""
+import asyncio
+import os
+import random
+import smtplib
+import time
+from email.message import EmailMessage
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+Notification = Dict[str, Any]
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class DeliveryError(RuntimeError):
+    """
+    `delivered` lists the destinations that did get the notification, so a
+    retry can skip them.
+    """
+
+    def __init__(self, message: str, delivered: Iterable[str] = ()):
+        super().__init__(message)
+        self.delivered = list(delivered)
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` sends per second with bursts up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _backoff(attempt: int, base: float = 0.2, cap: float = 5.0) -> float:
+    ceiling = min(cap, base * (2 ** attempt))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def _subject(notification: Notification) -> str:
+    severity = notification.get("severity", "unknown")
+    if notification.get("kind") == "digest":
+        return f"[{severity}] x{notification['count']} {notification.get('sample', '')[:80]}"
+    return f"[{severity}] {(notification.get('content') or '')[:80]}"
+
+
+class Transport:
+    name = "base"
+
+    def __init__(self, concurrency: int = 10, rate_per_sec: Optional[float] = None, retries: int = 3):
+        self.concurrency = concurrency
+        self.rate_per_sec = rate_per_sec
+        self.retries = retries
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def destinations(self) -> List[str]:
+        return ["default"]
+
+    async def _send_to(self, destination: str, notification: Notification) -> None:
+        raise NotImplementedError
+
+    async def _throttle(self, destination: str) -> None:
+        if not self.rate_per_sec:
+            return
+        bucket = self._buckets.get(destination)
+        if bucket is None:
+            bucket = self._buckets[destination] = TokenBucket(self.rate_per_sec)
+        await bucket.acquire()
+
+    async def send(self, notification: Notification, skip: Iterable[str] = ()) -> List[str]:
+        """
+        Deliver to every destination not in `skip` and return them. A failed
+        destination does not stop the others; the DeliveryError raised at the
+        end lists the ones that succeeded.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        skip = set(skip)
+        delivered: List[str] = []
+        errors: List[str] = []
+        async with self._semaphore:
+            for destination in self.destinations():
+                if destination in skip:
+                    continue
+                try:
+                    await self._send_with_retries(destination, notification)
+                except DeliveryError as exc:
+                    errors.append(str(exc))
+                else:
+                    delivered.append(destination)
+        if errors:
+            raise DeliveryError("; ".join(errors), delivered=delivered)
+        return delivered
+
+    async def _send_with_retries(self, destination: str, notification: Notification) -> None:
+        for attempt in range(self.retries + 1):
+            await self._throttle(destination)
+            try:
+                await self._send_to(destination, notification)
+                return
+            except DeliveryError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                if attempt >= self.retries:
+                    raise DeliveryError(f"{self.name} delivery to {destination} failed: {exc}") from exc
+                await asyncio.sleep(_backoff(attempt))
+
+    async def send_many(self, notifications: Iterable[Notification]) -> List[Optional[str]]:
+        """
+        Deliver concurrently; returns an error string (or None) per item.
+        """
+        results = await asyncio.gather(
+            *(self.send(notification) for notification in notifications),
+            return_exceptions=True,
+        )
+        return [str(result) if isinstance(result, BaseException) else None for result in results]
+
+    async def aclose(self) -> None:
+        return None
+
+
+class ConsoleTransport(Transport):
+    name = "console"
+
+    async def _send_to(self, destination: str, notification: Notification) -> None:
+        if notification.get("kind") == "digest":
+            print(
+                f"[DIGEST] ({notification.get('severity')}) x{notification.get('count')} "
+                f"{notification.get('fingerprint')} {notification.get('first_seen')}.."
+                f"{notification.get('last_seen')}: {notification.get('sample')}"
+            )
+        else:
+            print(f"[SEND] ({notification.get('severity')}) {notification.get('id')}: {notification.get('content')}")
+
+
+class WebhookTransport(Transport):
+    name = "webhook"
+
+    def __init__(self, urls: List[str], timeout: float = 5.0, headers: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.urls = urls
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def destinations(self) -> List[str]:
+        return self.urls
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            per_host = self.concurrency
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=per_host * max(1, len(self.urls)),
+                    max_keepalive_connections=per_host * max(1, len(self.urls)),
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._client
+
+    async def _send_to(self, destination: str, notification: Notification) -> None:
+        response = await self._get_client().post(destination, json=notification)
+        if response.status_code in RETRYABLE_STATUS:
+            raise httpx.HTTPStatusError(
+                f"retryable status {response.status_code}", request=response.request, response=response
+            )
+        if response.status_code >= 400:
+            raise DeliveryError(f"webhook {destination} rejected notification: {response.status_code}")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class SmtpTransport(Transport):
+    """
+    smtplib is blocking, so each send runs in a thread with a connection
+    borrowed from a pool of `concurrency` persistent SMTP sessions.
+    """
+    name = "smtp"
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        sender: str,
+        recipients: List[str],
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = False,
+        timeout: float = 10.0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._pool: Optional[asyncio.Queue] = None
+        self._opened = 0
+
+    def destinations(self) -> List[str]:
+        return [f"{self.host}:{self.port}"]
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password or "")
+        return conn
+
+    async def _borrow(self) -> Optional[smtplib.SMTP]:
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+        if self._pool.empty() and self._opened < self.concurrency:
+            self._opened += 1
+            return None
+        return await self._pool.get()
+
+    def _deliver(self, conn: Optional[smtplib.SMTP], message: EmailMessage) -> smtplib.SMTP:
+        if conn is None:
+            conn = self._connect()
+        try:
+            conn.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            conn = self._connect()
+            conn.send_message(message)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    async def _send_to(self, destination: str, notification: Notification) -> None:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message["Subject"] = _subject(notification)
+        message.set_content(
+            "\n".join(f"{key}: {value}" for key, value in notification.items())
+        )
+
+        conn = await self._borrow()
+        try:
+            conn = await asyncio.to_thread(self._deliver, conn, message)
+        except Exception:
+            # drop the broken session; `None` hands its pool slot to the next
+            # borrower, which opens a fresh connection
+            self._pool.put_nowait(None)
+            raise
+        self._pool.put_nowait(conn)
+
+    async def aclose(self) -> None:
+        while self._pool is not None and not self._pool.empty():
+            conn = self._pool.get_nowait()
+            if conn is None:
+                continue
+            try:
+                await asyncio.to_thread(conn.quit)
+            except smtplib.SMTPException:
+                pass
+        self._opened = 0
+
+
+def _env_list(name: str) -> List[str]:
+    return [item.strip() for item in os.getenv(name, "").split(",") if item.strip()]
+
+
+def build_transport(kind: Optional[str] = None) -> Transport:
+    kind = (kind or os.getenv("NOTIFY_TRANSPORT", "console")).strip().lower()
+    common = {
+        "concurrency": int(os.getenv("NOTIFY_CONCURRENCY", 20)),
+        "rate_per_sec": float(os.getenv("NOTIFY_RATE_PER_SEC", 0)) or None,
+        "retries": int(os.getenv("NOTIFY_RETRIES", 3)),
+    }
+    if kind == "webhook":
+        urls = _env_list("NOTIFY_WEBHOOK_URLS")
+        if not urls:
+            raise RuntimeError("NOTIFY_WEBHOOK_URLS environment variable is not set")
+        return WebhookTransport(urls, **common)
+    if kind == "smtp":
+        return SmtpTransport(
+            host=os.getenv("SMTP_HOST", "localhost"),
+            port=int(os.getenv("SMTP_PORT", 25)),
+            sender=os.getenv("SMTP_SENDER", "alerts@localhost"),
+            recipients=_env_list("SMTP_RECIPIENTS") or ["oncall@localhost"],
+            username=os.getenv("SMTP_USERNAME") or None,
+            password=os.getenv("SMTP_PASSWORD") or None,
+            starttls=os.getenv("SMTP_STARTTLS", "0") == "1",
+            **common,
+        )
+    return ConsoleTransport(**common)
+
+
+_transport: Optional[Transport] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_transport() -> Transport:
+    global _transport
+    if _transport is None:
+        _transport = build_transport()
+    return _transport
+
+
+def run(coro):
+    """
+    Run `coro` on this process' persistent loop (created lazily, so each
+    prefork child gets its own).
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+def deliver(notifications: List[Notification]) -> List[Optional[str]]:
+    return run(get_transport().send_many(notifications))
+
+
+def deliver_one(notification: Notification, skip: Iterable[str] = ()) -> List[str]:
+    return run(get_transport().send(notification, skip))
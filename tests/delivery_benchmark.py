@@ -0,0 +1,77 @@
+"""Benchmark notification delivery throughput against local sinks.
+
+Usage:
+    python tests/delivery_benchmark.py [--notifications 2000] [--latency-ms 5]
+
+Starts the in-process HTTP and SMTP sinks from ``notification_service.sink``
+and delivers the same set of notifications through ``WebhookTransport`` and
+``SmtpTransport`` at several concurrency levels, the way ``send_batch`` fans
+out a chunk inside one worker. Concurrency 1 approximates the old one
+blocking request per task. Nothing leaves the machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from notification_service.sink import HttpSink, SmtpSink
+from notification_service.transports import SmtpTransport, Transport, WebhookTransport
+
+
+def _notifications(count: int) -> List[Dict[str, object]]:
+    return [
+        {"kind": "message", "id": f"bench-{i}", "severity": "medium", "content": f"Query took too long ({i} ms)"}
+        for i in range(count)
+    ]
+
+
+async def _run(transport: Transport, notifications: List[Dict[str, object]]) -> Dict[str, float]:
+    started = time.perf_counter()
+    errors = await transport.send_many(notifications)
+    elapsed = time.perf_counter() - started
+    await transport.aclose()
+    failed = sum(1 for error in errors if error)
+    return {"elapsed": elapsed, "failed": failed, "per_sec": len(notifications) / elapsed if elapsed else 0.0}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notifications", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated server latency per request")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every N-th request with a retryable error")
+    args = parser.parse_args()
+
+    notifications = _notifications(args.notifications)
+    header = f"{'transport':<10} {'concurrency':>11} {'sent/sec':>10} {'seconds':>8} {'failed':>7} {'conns':>6}"
+    print(header)
+    print("-" * len(header))
+
+    for concurrency in args.concurrency:
+        sink = HttpSink(latency=args.latency_ms / 1000, fail_every=args.fail_every)
+        host, port = sink.start()
+        transport = WebhookTransport([f"http://{host}:{port}/hook"], concurrency=concurrency)
+        result = asyncio.run(_run(transport, notifications))
+        sink.stop()
+        print(f"{'webhook':<10} {concurrency:>11} {result['per_sec']:>10.1f} {result['elapsed']:>8.2f} {result['failed']:>7} {sink.connections:>6}")
+
+    for concurrency in args.concurrency:
+        sink = SmtpSink(latency=args.latency_ms / 1000, fail_every=args.fail_every)
+        host, port = sink.start()
+        transport = SmtpTransport(host, port, "bench@localhost", ["oncall@localhost"], concurrency=concurrency)
+        result = asyncio.run(_run(transport, notifications))
+        sink.stop()
+        print(f"{'smtp':<10} {concurrency:>11} {result['per_sec']:>10.1f} {result['elapsed']:>8.2f} {result['failed']:>7} {sink.connections:>6}")
+
+
+if __name__ == "__main__":
+    main()
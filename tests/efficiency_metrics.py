@@ -17,7 +17,6 @@ the app and the reduction ratio (with / without).
 
 from __future__ import annotations
 
-import csv
 import os
 import sys
 from collections import Counter
@@ -45,6 +44,7 @@ if str(ROOT_DIR) not in sys.path:
 
 load_dotenv(ROOT_DIR / ".env", override=False)
 
+from ai import dataset
 from ai.configs import candidate_labels, hypothesis_template, prompt
 
 try:
@@ -56,7 +56,9 @@ else:  # pragma: no cover
     OPENAI_IMPORT_ERROR = None
 
 try:
-    from ai.bert_model import classifier as hf_classifier
+    from ai.bert_model import get_classifier
+
+    hf_classifier = get_classifier()
 except Exception as exc:  # noqa: BLE001
     hf_classifier = None
     HF_IMPORT_ERROR = exc
@@ -67,12 +69,7 @@ DATASET_PATH = ROOT_DIR / "data_set.csv"
 
 
 def load_rows(limit: int) -> Iterable[dict]:
-    with DATASET_PATH.open("r", encoding="utf-8", newline="") as fh:
-        reader = csv.DictReader(fh)
-        for index, row in enumerate(reader):
-            if index >= limit:
-                break
-            yield row
+    return dataset.load_rows(str(DATASET_PATH))[:limit]
 
 
 def _to_int(value: str | None) -> int:
@@ -0,0 +1,360 @@
+"""Benchmark POST /messages in-process, per ingest phase.
+
+Usage:
+    python tests/ingest_benchmark.py [--requests 500] [--concurrency 1 8 32] [--history 0 1000 10000]
+                                     [--mongo memory|live] [--broker memory|live] [--output ingest.json]
+
+Drives the FastAPI app through httpx's ASGI transport (no server, no sockets)
+and sweeps concurrency and history size, i.e. the number of earlier messages
+with the same fingerprint (spread over 30 days and folded into the rollups)
+before the measured requests. Each request is timed as a whole and split into
+phases:
+
+* insert  - the ``messages.insert_one``
+* stats   - the rollups ``bulk_write``, ``build_stats_for_message`` and the
+            ``context_stats`` update (``STATS_MODE=inline`` only)
+* enqueue - publishing ``analyze_message`` (or the async stats chain)
+
+By default MongoDB and the Celery broker are replaced by in-process stand-ins
+(``tests/memory_store.py`` and kombu's ``memory://`` transport), so the numbers
+show the API's own cost; ``--mongo-latency-ms`` adds a simulated round trip
+per operation. ``--mongo live`` / ``--broker live`` use MONGO_URI and
+REDIS_URL instead; point them at scratch instances, since the published tasks
+stay queued for any worker listening there. Benchmark messages are deleted
+from a live database after each run. The in-memory store has no aggregation
+pipeline, so it always uses ``STATS_SOURCE=rollup``.
+
+Results are printed as a table and, with ``--output``, written as JSON
+(settings, git commit, and throughput plus p50/p95/p99 per phase for every
+cell) so runs from different releases can be compared.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+PHASES = ("insert", "stats", "enqueue")
+SERVICE = "ingest-benchmark"
+
+_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("ingest_benchmark_phases", default=None)
+
+
+def _configure(args: argparse.Namespace) -> None:
+    """
+    Environment for the API modules; must run before they are imported.
+    """
+    os.environ["ENSURE_INDEXES_ON_STARTUP"] = "0"
+    if args.mongo == "memory":
+        os.environ["STATS_SOURCE"] = "rollup"
+        # the clients are created lazily and never used
+        os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/ingest_benchmark")
+    if args.broker == "memory":
+        os.environ["REDIS_URL"] = "memory://"
+
+
+def _add(phase: str, seconds: float) -> None:
+    phases = _phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class Timed:
+    """
+    Proxy over a (motor or in-memory) collection adding the time spent in the
+    methods listed in `phases` to the current request's phase totals.
+    """
+
+    def __init__(self, inner: Any, phases: Dict[str, str]):
+        self._inner = inner
+        self._method_phases = phases
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._inner, name)
+        phase = self._method_phases.get(name)
+        if phase is None:
+            return attr
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                _add(phase, time.perf_counter() - started)
+
+        return call
+
+
+def _timed_sync(func: Callable[..., Any], phase: str) -> Callable[..., Any]:
+    def call(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add(phase, time.perf_counter() - started)
+
+    return call
+
+
+def _content(token: str, i: int) -> str:
+    # digits are masked by `normalize`, so every request shares one fingerprint
+    return f"Payment gateway {token} timeout after {1000 + i % 500} ms for order {i}"
+
+
+def _history_docs(token: str, count: int, now: datetime, rng: random.Random) -> List[Dict[str, Any]]:
+    from api.stats import fingerprint
+
+    fp = fingerprint(_content(token, 0))
+    docs = []
+    for i in range(count):
+        created_at = now - timedelta(seconds=rng.uniform(0, 30 * 86400))
+        docs.append({
+            "content": _content(token, i),
+            "service": SERVICE,
+            "level": "error",
+            "component": rng.choice(["checkout", "billing", "refunds"]),
+            "timestamp": created_at,
+            "created_at": created_at,
+            "fingerprint": fp,
+            "sent": True,
+        })
+    return docs
+
+
+def _seed(messages: Any, rollups: Any, docs: List[Dict[str, Any]], now: datetime, chunk: int = 1000) -> None:
+    from api.rollups import ingest_ops
+
+    for start in range(0, len(docs), chunk):
+        batch = docs[start:start + chunk]
+        messages.insert_many(batch, ordered=False)
+        rollups.bulk_write(ingest_ops(batch), ordered=False)
+    # what the TTL index on `expires_at` would have removed by now
+    rollups.delete_many({"expires_at": {"$lt": now}})
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    values = np.asarray(samples) * 1000
+    return {f"p{q}": round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+
+async def _drive(app: Any, token: str, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    import httpx
+
+    samples: Dict[str, List[float]] = {"total": [], **{phase: [] for phase in PHASES}}
+    errors = 0
+    first_error: Optional[str] = None
+    counter = iter(range(warmup + requests))
+
+    async def one(client: httpx.AsyncClient, i: int) -> None:
+        nonlocal errors, first_error
+        phases: Dict[str, float] = {}
+        token_ctx = _phases.set(phases)
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                "/messages", json={"service": SERVICE, "level": "error", "content": _content(token, i)},
+            )
+            failed = response.status_code != 200
+        finally:
+            _phases.reset(token_ctx)
+        elapsed = time.perf_counter() - started
+        if i < warmup:
+            return
+        if failed:
+            errors += 1
+            first_error = first_error or f"{response.status_code} {response.text[:200]}"
+            return
+        samples["total"].append(elapsed)
+        for phase in PHASES:
+            if phase in phases:
+                samples[phase].append(phases[phase])
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for i in counter:
+            await one(client, i)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        # warmup requests run first, one at a time
+        for _ in range(warmup):
+            await one(client, next(counter))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(samples["total"]) / elapsed, 1) if elapsed else None,
+        "errors": errors,
+        "first_error": first_error,
+        "latency_ms": {name: _percentiles(values) for name, values in samples.items()},
+    }
+
+
+def _run_cell(args: argparse.Namespace, concurrency: int, history: int, rng: random.Random) -> Dict[str, Any]:
+    import api.main as api_main
+    import api.rollups as api_rollups
+    import api.stats as api_stats
+    from api.services import (
+        get_async_messages_collection,
+        get_async_rollups_collection,
+        get_sync_messages_collection,
+        get_sync_rollups_collection,
+    )
+    from api.stats import fingerprint
+    from celery_app import celery_app
+
+    token = "".join(rng.choices(string.ascii_lowercase, k=8))
+    now = datetime.utcnow()
+
+    if args.mongo == "memory":
+        from tests.memory_store import AsyncMemoryCollection, MemoryCollection
+
+        sync_messages = MemoryCollection(indexed=["fingerprint"], latency_ms=args.mongo_latency_ms)
+        sync_rollups = MemoryCollection(indexed=["fingerprint"], latency_ms=args.mongo_latency_ms)
+        async_messages: Any = AsyncMemoryCollection(sync_messages)
+        async_rollups: Any = AsyncMemoryCollection(sync_rollups)
+    else:
+        sync_messages, sync_rollups = get_sync_messages_collection(), get_sync_rollups_collection()
+        async_messages, async_rollups = get_async_messages_collection(), get_async_rollups_collection()
+
+    _seed(sync_messages, sync_rollups, _history_docs(token, history, now, rng), now)
+
+    saved = {
+        (api_main, "get_async_messages_collection"): api_main.get_async_messages_collection,
+        (api_main, "get_async_rollups_collection"): api_main.get_async_rollups_collection,
+        (api_main, "build_stats_for_message"): api_main.build_stats_for_message,
+        (api_main, "_enqueue_background"): api_main._enqueue_background,
+        (api_main, "STATS_MODE"): api_main.STATS_MODE,
+        (api_stats, "get_sync_messages_collection"): api_stats.get_sync_messages_collection,
+        (api_rollups, "get_sync_rollups_collection"): api_rollups.get_sync_rollups_collection,
+    }
+    timed_messages = Timed(async_messages, {"insert_one": "insert", "update_one": "stats"})
+    timed_rollups = Timed(async_rollups, {"bulk_write": "stats"})
+    api_main.get_async_messages_collection = lambda: timed_messages
+    api_main.get_async_rollups_collection = lambda: timed_rollups
+    api_main.build_stats_for_message = _timed_sync(api_main.build_stats_for_message, "stats")
+    api_main._enqueue_background = _timed_sync(api_main._enqueue_background, "enqueue")
+    api_main.STATS_MODE = args.stats_mode
+    api_stats.get_sync_messages_collection = lambda: sync_messages
+    api_rollups.get_sync_rollups_collection = lambda: sync_rollups
+    send_task = celery_app.send_task
+    celery_app.send_task = _timed_sync(send_task, "enqueue")
+
+    try:
+        result = asyncio.run(_drive(api_main.app, token, args.requests, concurrency, args.warmup))
+    finally:
+        for (module, name), value in saved.items():
+            setattr(module, name, value)
+        celery_app.send_task = send_task
+        if args.mongo == "live":
+            fp = fingerprint(_content(token, 0))
+            sync_messages.delete_many({"fingerprint": fp, "service": SERVICE})
+            sync_rollups.delete_many({"fingerprint": fp})
+
+    result.update({"concurrency": concurrency, "history": history})
+    if args.mongo == "memory":
+        result["mongo_ops"] = sync_messages.ops + sync_rollups.ops
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per cell")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each cell")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--history", type=int, nargs="*", default=[0, 1000, 10000],
+                        help="earlier messages with the same fingerprint")
+    parser.add_argument("--stats-mode", choices=["inline", "async"], default=os.getenv("STATS_MODE", "inline"))
+    parser.add_argument("--mongo", choices=["memory", "live"], default="memory")
+    parser.add_argument("--broker", choices=["memory", "live"], default="memory")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.0,
+                        help="simulated round trip per in-memory Mongo operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    _configure(args)
+    from celery_app import celery_app
+
+    if args.broker == "memory":
+        celery_app.conf.broker_url = "memory://"
+        celery_app.conf.result_backend = "cache+memory://"
+
+    rng = random.Random(args.seed)
+    results = []
+    header = (f"{'conc':>5} {'history':>8} {'req/sec':>9} {'total p50/p95/p99 ms':>22} "
+              + " ".join(f"{phase + ' p50/p99':>16}" for phase in PHASES))
+    print(header)
+    print("-" * len(header))
+    for history in args.history:
+        for concurrency in args.concurrency:
+            result = _run_cell(args, concurrency, history, rng)
+            results.append(result)
+            latency = result["latency_ms"]
+            total = "/".join(_ms(latency["total"][q]) for q in ("p50", "p95", "p99"))
+            phases = " ".join(
+                f"{_ms(latency[phase]['p50']) + '/' + _ms(latency[phase]['p99']):>16}" for phase in PHASES
+            )
+            print(f"{concurrency:>5} {history:>8} {result['throughput_rps'] or 0:>9.1f} {total:>22} {phases}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "settings": {
+                    "requests": args.requests,
+                    "warmup": args.warmup,
+                    "stats_mode": args.stats_mode,
+                    "stats_source": os.getenv("STATS_SOURCE", "rollup"),
+                    "fingerprint_engine": os.getenv("FINGERPRINT_ENGINE", "normalize"),
+                    "clustering": os.getenv("CLUSTERING", "0"),
+                    "mongo": args.mongo,
+                    "broker": args.broker,
+                    "mongo_latency_ms": args.mongo_latency_ms,
+                },
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
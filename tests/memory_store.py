@@ -0,0 +1,449 @@
+"""In-memory stand-ins for the MongoDB collections used by the benchmarks.
+
+``MemoryCollection`` implements the subset of the pymongo ``Collection`` API
+the ingest path and the rollups use: ``insert_one``/``insert_many``,
+``update_one``/``update_many`` and ``bulk_write`` of ``UpdateOne`` and
+``UpdateMany`` ops (``$set``, ``$setOnInsert``, ``$inc``, ``$max`` and
+``$push`` with ``$each``/``$slice``, upserts), ``find`` with equality /
+``$in`` / ``$nin`` / ``$ne`` / range filters on dotted paths plus ``sort``, ``limit``
+and ``batch_size``, ``delete_many`` and ``count_documents``.
+Equality lookups on the ``indexed`` fields use a hash index instead of a
+scan. ``aggregate`` runs the stages and expressions of the raw stats pipeline
+(``api.stats.aggregate_window_stats``): ``$match``, ``$project``, ``$group``
+with ``$sum``/``$max``/``$median``, ``$sort``, ``$limit`` and ``$facet``;
+``$median`` is exact here, MongoDB's ``approximate`` method may differ
+slightly on large inputs. There is no TTL monitor.
+
+``AsyncMemoryCollection`` wraps one for the motor-style ``await`` calls made
+by the API. ``latency_ms`` adds a fixed delay per operation to mimic a
+network round trip.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateMany
+
+_MISSING = object()
+
+
+def _get(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _clone(value: Any) -> Any:
+    # stored values are BSON-like: only dicts and lists are mutable
+    if isinstance(value, dict):
+        return {key: _clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_clone(item) for item in value]
+    return value
+
+
+def _parent(doc: Dict[str, Any], path: str) -> Tuple[Dict[str, Any], str]:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    return doc, parts[-1]
+
+
+def _matches_value(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for op, operand in condition.items():
+            if op == "$in":
+                if value is _MISSING or value not in operand:
+                    return False
+            elif op == "$nin":
+                # as in MongoDB, a missing field compares equal to null
+                if (None if value is _MISSING else value) in operand:
+                    return False
+            elif op == "$ne":
+                if (None if value is _MISSING else value) == operand:
+                    return False
+            elif op in ("$gte", "$gt", "$lte", "$lt"):
+                if value is _MISSING or value is None:
+                    return False
+                if op == "$gte" and not value >= operand:
+                    return False
+                if op == "$gt" and not value > operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+                if op == "$lt" and not value < operand:
+                    return False
+            elif op == "$exists":
+                if (value is not _MISSING) != bool(operand):
+                    return False
+            else:
+                raise NotImplementedError(f"filter operator {op} is not supported in memory")
+        return True
+    return value is not _MISSING and value == condition
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    return all(_matches_value(_get(doc, path), condition) for path, condition in query.items())
+
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserted: bool) -> None:
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserted:
+            continue
+        for path, value in fields.items():
+            target, key = _parent(doc, path)
+            if op in ("$set", "$setOnInsert"):
+                target[key] = _clone(value)
+            elif op == "$inc":
+                target[key] = target.get(key, 0) + value
+            elif op == "$max":
+                if key not in target or target[key] < value:
+                    target[key] = value
+            elif op == "$min":
+                if key not in target or target[key] > value:
+                    target[key] = value
+            elif op == "$push":
+                items = target.setdefault(key, [])
+                if isinstance(value, dict) and "$each" in value:
+                    items.extend(_clone(value["$each"]))
+                    if "$slice" in value:
+                        limit = value["$slice"]
+                        items[:] = items[:limit] if limit >= 0 else items[limit:]
+                else:
+                    items.append(_clone(value))
+            elif op == "$unset":
+                target.pop(key, None)
+            else:
+                raise NotImplementedError(f"update operator {op} is not supported in memory")
+
+
+def _bson_type(value: Any) -> str:
+    if value is _MISSING:
+        return "missing"
+    if value is None:
+        return "null"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, str):
+        return "string"
+    return "object" if isinstance(value, dict) else "array" if isinstance(value, list) else "objectId"
+
+
+def _subtract(left: Any, right: Any) -> Any:
+    if isinstance(left, datetime) and isinstance(right, datetime):
+        # date - date is a number of milliseconds
+        return int((left - right).total_seconds() * 1000)
+    return left - right
+
+
+_EXPRESSIONS = {
+    "$and": lambda *args: all(args),
+    "$eq": lambda left, right: left == right,
+    "$gte": lambda left, right: left is not None and right is not None and left >= right,
+    "$divide": lambda left, right: left / right,
+    "$subtract": _subtract,
+    "$ifNull": lambda value, default: default if value is None else value,
+    "$substrCP": lambda text, start, length: text[start:start + length],
+}
+
+
+def evaluate(doc: Dict[str, Any], expr: Any) -> Any:
+    """Value of an aggregation expression over `doc` (None for a missing field)."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and len(expr) == 1 and next(iter(expr)).startswith("$"):
+        op, args = next(iter(expr.items()))
+        if op == "$type":
+            return _bson_type(_get(doc, args[1:]) if isinstance(args, str) and args.startswith("$") else args)
+        if op == "$cond":
+            condition, then, otherwise = args
+            return evaluate(doc, then if evaluate(doc, condition) else otherwise)
+        if op not in _EXPRESSIONS:
+            raise NotImplementedError(f"expression {op} is not supported in memory")
+        return _EXPRESSIONS[op](*[evaluate(doc, arg) for arg in args])
+    if isinstance(expr, dict):
+        return {key: evaluate(doc, value) for key, value in expr.items()}
+    return expr
+
+
+def _project(doc: Dict[str, Any], spec: Dict[str, Any]) -> Dict[str, Any]:
+    projected = {"_id": doc["_id"]} if spec.get("_id", 1) and "_id" in doc else {}
+    for path, expr in spec.items():
+        if path == "_id":
+            continue
+        if expr in (1, True):
+            value = _get(doc, path)
+            if value is not _MISSING:
+                projected[path] = value
+        else:
+            projected[path] = evaluate(doc, expr)
+    return projected
+
+
+def _accumulate(op: str, arg: Any, docs: List[Dict[str, Any]]) -> Any:
+    if op == "$sum":
+        return sum(evaluate(doc, arg) or 0 for doc in docs)
+    if op == "$median":
+        values = [evaluate(doc, arg["input"]) for doc in docs]
+        numbers = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        return statistics.median(numbers) if numbers else None
+    if op == "$max":
+        values = [value for value in (evaluate(doc, arg) for doc in docs) if value is not None]
+        return max(values) if values else None
+    raise NotImplementedError(f"accumulator {op} is not supported in memory")
+
+
+def _group(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        groups.setdefault(evaluate(doc, spec["_id"]), []).append(doc)
+    return [
+        {"_id": key, **{
+            name: _accumulate(*next(iter(accumulator.items())), members)
+            for name, accumulator in spec.items() if name != "_id"
+        }}
+        for key, members in groups.items()
+    ]
+
+
+def run_pipeline(docs: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif name == "$project":
+            docs = [_project(doc, spec) for doc in docs]
+        elif name == "$group":
+            docs = _group(docs, spec)
+        elif name == "$sort":
+            docs = list(MemoryCursor(docs).sort(list(spec.items()))._docs)
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$facet":
+            docs = [{facet: run_pipeline(docs, sub_pipeline) for facet, sub_pipeline in spec.items()}]
+        else:
+            raise NotImplementedError(f"aggregation stage {name} is not supported in memory")
+    return docs
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self._docs = docs
+
+    def sort(self, key: Any, direction: int = 1) -> "MemoryCursor":
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for path, order in reversed(keys):
+            self._docs.sort(key=lambda doc: (_get(doc, path) is _MISSING, _get(doc, path)), reverse=order < 0)
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        # everything is already in memory, there are no getMore round trips
+        return self
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter([_clone(doc) for doc in self._docs])
+
+
+class MemoryCollection:
+    def __init__(self, indexed: Sequence[str] = (), latency_ms: float = 0.0):
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self.indexed = tuple(indexed)
+        self.latency_ms = latency_ms
+        self.ops = 0
+        self._index: Dict[str, Dict[Any, set]] = {field: defaultdict(set) for field in self.indexed}
+
+    # storage
+
+    def _reindex(self, doc: Dict[str, Any], add: bool) -> None:
+        for field in self.indexed:
+            value = _get(doc, field)
+            if value is _MISSING:
+                continue
+            bucket = self._index[field][value]
+            (bucket.add if add else bucket.discard)(doc["_id"])
+
+    def _store(self, doc: Dict[str, Any]) -> None:
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise ValueError(f"duplicate _id {doc['_id']}")
+        stored = _clone(doc)
+        self.docs[stored["_id"]] = stored
+        self._reindex(stored, add=True)
+
+    def _candidates(self, query: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self.docs.get(query["_id"])
+            return [doc] if doc is not None else []
+        for field in self.indexed:
+            value = query.get(field, _MISSING)
+            if value is not _MISSING and not isinstance(value, dict):
+                return [self.docs[i] for i in self._index[field].get(value, ())]
+        return list(self.docs.values())
+
+    def _find(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [doc for doc in self._candidates(query or {}) if matches(doc, query or {})]
+
+    def _update(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool) -> Tuple[int, int]:
+        found = self._find(query)
+        if found:
+            doc = found[0]
+            self._reindex(doc, add=False)
+            apply_update(doc, update, inserted=False)
+            self._reindex(doc, add=True)
+            return 1, 0
+        if not upsert:
+            return 0, 0
+        doc = {key: value for key, value in query.items() if not isinstance(value, dict)}
+        apply_update(doc, update, inserted=True)
+        self._store(doc)
+        return 0, 1
+
+    # pymongo API; `_do_<name>` does the work, `<name>` adds the round trip
+
+    def _do_insert_one(self, doc: Dict[str, Any]) -> SimpleNamespace:
+        self._store(doc)
+        return SimpleNamespace(inserted_id=doc["_id"], acknowledged=True)
+
+    def _do_insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True) -> SimpleNamespace:
+        for doc in docs:
+            self._store(doc)
+        return SimpleNamespace(inserted_ids=[doc["_id"] for doc in docs], acknowledged=True)
+
+    def _do_update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> SimpleNamespace:
+        modified, upserted = self._update(query, update, upsert)
+        return SimpleNamespace(matched_count=modified, modified_count=modified, upserted_count=upserted)
+
+    def _update_all(self, query: Dict[str, Any], update: Dict[str, Any]) -> int:
+        found = self._find(query)
+        for doc in found:
+            self._reindex(doc, add=False)
+            apply_update(doc, update, inserted=False)
+            self._reindex(doc, add=True)
+        return len(found)
+
+    def _do_update_many(self, query: Dict[str, Any], update: Dict[str, Any]) -> SimpleNamespace:
+        modified = self._update_all(query, update)
+        return SimpleNamespace(matched_count=modified, modified_count=modified)
+
+    def _do_bulk_write(self, ops: List[Any], ordered: bool = True) -> SimpleNamespace:
+        modified = upserted = 0
+        for op in ops:
+            if isinstance(op, UpdateMany):
+                modified += self._update_all(op._filter, op._doc)
+                continue
+            m, u = self._update(op._filter, op._doc, op._upsert)
+            modified += m
+            upserted += u
+        return SimpleNamespace(modified_count=modified, upserted_count=upserted, acknowledged=True)
+
+    def _do_find(self, query: Optional[Dict[str, Any]] = None, projection: Any = None) -> MemoryCursor:
+        # projections are ignored: callers only read the fields they asked for
+        return MemoryCursor(self._find(query or {}))
+
+    def _do_find_one(self, query: Optional[Dict[str, Any]] = None, projection: Any = None) -> Optional[Dict[str, Any]]:
+        found = self._find(query or {})
+        return _clone(found[0]) if found else None
+
+    def _do_aggregate(self, pipeline: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        docs = [_clone(doc) for doc in self.docs.values()]
+        return iter(run_pipeline(docs, pipeline))
+
+    def _do_delete_many(self, query: Dict[str, Any]) -> SimpleNamespace:
+        found = self._find(query)
+        for doc in found:
+            self._reindex(doc, add=False)
+            del self.docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(found), acknowledged=True)
+
+    def _do_count_documents(self, query: Dict[str, Any]) -> int:
+        return len(self._find(query))
+
+    def _call(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        self.ops += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return getattr(self, f"_do_{name}")(*args, **kwargs)
+
+    def insert_one(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return self._call("insert_one", *args, **kwargs)
+
+    def insert_many(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return self._call("insert_many", *args, **kwargs)
+
+    def update_one(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return self._call("update_one", *args, **kwargs)
+
+    def update_many(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return self._call("update_many", *args, **kwargs)
+
+    def bulk_write(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return self._call("bulk_write", *args, **kwargs)
+
+    def find(self, *args: Any, **kwargs: Any) -> MemoryCursor:
+        return self._call("find", *args, **kwargs)
+
+    def find_one(self, *args: Any, **kwargs: Any) -> Optional[Dict[str, Any]]:
+        return self._call("find_one", *args, **kwargs)
+
+    def aggregate(self, *args: Any, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        return self._call("aggregate", *args, **kwargs)
+
+    def delete_many(self, *args: Any, **kwargs: Any) -> SimpleNamespace:
+        return self._call("delete_many", *args, **kwargs)
+
+    def count_documents(self, *args: Any, **kwargs: Any) -> int:
+        return self._call("count_documents", *args, **kwargs)
+
+
+class AsyncMemoryCollection:
+    """
+    Awaitable facade over a MemoryCollection, for code written against motor.
+    The simulated latency is awaited, so it does not block the event loop.
+    """
+
+    def __init__(self, inner: MemoryCollection):
+        self.inner = inner
+
+    async def _call(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        self.inner.ops += 1
+        if self.inner.latency_ms:
+            await asyncio.sleep(self.inner.latency_ms / 1000)
+        return getattr(self.inner, f"_do_{name}")(*args, **kwargs)
+
+    async def insert_one(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("insert_one", *args, **kwargs)
+
+    async def insert_many(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("insert_many", *args, **kwargs)
+
+    async def update_one(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("update_one", *args, **kwargs)
+
+    async def bulk_write(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("bulk_write", *args, **kwargs)
+
+    async def find_one(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._call("find_one", *args, **kwargs)
@@ -1,18 +1,44 @@
 """Utility script for evaluating the severity classifier on the CSV dataset.
 
 Run with:
-    python tests/model_metrics.py
+    python tests/model_metrics.py [--providers local fake openai] [--workers 8] [--no-cache]
+    python tests/model_metrics.py --compare-modes default int8 onnx [--limit 200]
+    python tests/model_metrics.py --train-local [--holdout 0.3] [--mongo-limit 0] [--save]
 
 The script reuses the same classification pipeline that the API relies on,
 so the `AI_PROVIDER`/`AI_MODEL` environment variables continue to work.
+Rows are read with ``ai.dataset`` and every mode classifies the bare message
+text (``ai.dataset.message_text``), which is what a provider gets at serve
+time and what the local model is trained on.
+``--providers`` evaluates several providers in one run. Rows are classified
+concurrently: network providers (the LLMs and the cascade) in a thread pool,
+local models in a process pool, with ``--workers`` each (1 = one row at a
+time). Predictions are cached in a SQLite file (``--cache``) keyed by
+provider, model, prompt hash and message, so a re-run only classifies rows
+that changed. Each report ends with the p50/p95/p99 latency and throughput
+of the rows classified in that run.
+``--compare-modes`` runs the HuggingFace provider once per HF_INFERENCE_MODE
+and prints macro F1, accuracy, agreement with the first mode, model load
+time and per-message latency side by side. ``--train-local`` trains the local
+hashed n-gram model (``ai.local_model``) on part of the CSV, plus stored
+analyses with ``--mongo-limit``, and evaluates it on the held-out rows.
 """
 
 from __future__ import annotations
 
-import csv
-from dataclasses import dataclass
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Iterable, List, Sequence, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import sys
 
@@ -20,11 +46,22 @@ ROOT_DIR = Path(__file__).resolve().parents[1]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
+from ai import bert_model, dataset, local_model, providers
 from ai.configs import candidate_labels
-from ai.tasks import _classify_message
+from ai.prompting import PROMPT_INCLUDE_STATS, PROMPT_MAX_CONTENT_TOKENS, SYSTEM_PROMPT
 
 DATASET_PATH = ROOT_DIR / "data_set.csv"
+CACHE_PATH = ROOT_DIR / "data" / "model_metrics_cache.sqlite"
 
+# providers that wait on the network and share a thread pool well
+NETWORK_PROVIDERS = {*providers.LLM_CLIENTS, "cascade"}
+DEFAULT_WORKERS = {"network": 8, "local": min(4, os.cpu_count() or 1)}
+
+# changes to the prompt, its content budget, the stats snippet or the label
+# set invalidate cached predictions
+PROMPT_HASH = hashlib.sha1(
+    f"{SYSTEM_PROMPT}\n{','.join(candidate_labels)}\n{PROMPT_MAX_CONTENT_TOKENS}:{PROMPT_INCLUDE_STATS}".encode("utf-8")
+).hexdigest()[:16]
 
 @dataclass
 class LabelMetrics:
@@ -35,47 +72,151 @@ class LabelMetrics:
 
 
 def load_dataset(path: Path = DATASET_PATH) -> List[Dict[str, str]]:
-    with path.open("r", encoding="utf-8", newline="") as fh:
-        reader = csv.DictReader(fh)
-        return [row for row in reader]
+    return dataset.load_rows(str(path))
+
+
+class PredictionCache:
+    """
+    Predictions of earlier runs in SQLite, keyed by a hash of provider,
+    model, prompt hash and message. Only labels from `candidate_labels` are
+    stored, so failed rows are retried on the next run.
+    """
+
+    def __init__(self, path: Path = CACHE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, provider TEXT, model TEXT, label TEXT, tier TEXT, "
+            "latency_ms REAL, created_at TEXT)"
+        )
 
+    @staticmethod
+    def key(provider: str, model: str, message: str) -> str:
+        return hashlib.sha256("\x1f".join((provider, model, PROMPT_HASH, message)).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, Tuple[str, Optional[str]]]:
+        found: Dict[str, Tuple[str, Optional[str]]] = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            cursor = self.conn.execute(
+                f"SELECT key, label, tier FROM predictions WHERE key IN ({','.join('?' * len(chunk))})", chunk,
+            )
+            found.update({key: (label, tier) for key, label, tier in cursor})
+        return found
+
+    def put_many(self, rows: List[Tuple[str, str, str, str, Optional[str], float]]) -> None:
+        now = datetime.utcnow().isoformat(timespec="seconds")
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(*row, now) for row in rows if row[3] in candidate_labels],
+        )
+        self.conn.commit()
 
-def _format_message(row: Dict[str, str]) -> str:
-    service = row.get("service", "unknown").strip() or "unknown"
-    text = row.get("text", "").strip()
-    count_1h = row.get("count_1h", "").strip()
-    count_24h = row.get("count_24h", "").strip()
+    def close(self) -> None:
+        self.conn.close()
 
-    # Enrich the free-form text with context numbers so the classifier sees
-    # something closer to what the API stores inside the `content` field.
-    context_bits = []
-    if count_1h:
-        context_bits.append(f"1h events: {count_1h}")
-    if count_24h:
-        context_bits.append(f"24h events: {count_24h}")
 
-    context = f" ({', '.join(context_bits)})" if context_bits else ""
-    return f"[{service}] {text}{context}"
+@dataclass
+class ProviderRun:
+    provider: str
+    model: str
+    y_true: List[str]
+    y_pred: List[str]
+    cached: int = 0
+    workers: int = 1
+    pool: str = "sequential"
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    # deciding tier per row with the cascade provider
+    tiers: Counter = field(default_factory=Counter)
+
+
+def _classify_timed(provider: str, message: str) -> Tuple[str, Optional[str], float]:
+    started = time.perf_counter()
+    analysis = providers.classify(provider, message)
+    return analysis.get("label", "unknown"), analysis.get("tier"), time.perf_counter() - started
+
+
+def _init_process_worker() -> None:
+    # one inference thread per process instead of every process using all cores
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+
+def _executor(provider: str, workers: int) -> Tuple[Optional[Executor], str]:
+    if workers <= 1:
+        return None, "sequential"
+    if provider in NETWORK_PROVIDERS:
+        return ThreadPoolExecutor(max_workers=workers), "threads"
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_process_worker), "processes"
+
+
+def evaluate_provider(
+    rows: Sequence[Dict[str, str]],
+    provider: Optional[str] = None,
+    workers: Optional[int] = None,
+    cache: Optional[PredictionCache] = None,
+) -> ProviderRun:
+    """
+    Classify `rows` with `provider` (AI_PROVIDER by default), reusing cached
+    predictions and fanning the remaining rows out over `workers`.
+    """
+    provider = provider or providers.selected_provider()
+    model = providers.model_name(provider)
+    if workers is None:
+        workers = DEFAULT_WORKERS["network" if provider in NETWORK_PROVIDERS else "local"]
+
+    messages = [dataset.message_text(row) for row in rows]
+    y_true = [row["expected_label"] for row in rows]
+    keys = [PredictionCache.key(provider, model, message) for message in messages]
+    hits = cache.get_many(keys) if cache else {}
+
+    predictions: Dict[str, Tuple[str, Optional[str]]] = dict(hits)
+    pending = list(dict.fromkeys(
+        (key, message) for key, message in zip(keys, messages) if key not in hits
+    ))
+    run = ProviderRun(provider, model, y_true, [], workers=max(1, min(workers, len(pending))))
+
+    executor, run.pool = _executor(provider, run.workers)
+    fresh: List[Tuple[str, str, str, str, Optional[str], float]] = []
+    started = time.perf_counter()
+    try:
+        if executor is None:
+            results: Iterable[Tuple[str, Optional[str], float]] = (
+                _classify_timed(provider, message) for _, message in pending
+            )
+        else:
+            results = executor.map(
+                _classify_timed, [provider] * len(pending), [message for _, message in pending],
+                chunksize=1 if run.pool == "threads" else max(1, len(pending) // (run.workers * 4)),
+            )
+        for (key, _), (label, tier, latency) in zip(pending, results):
+            predictions[key] = (label, tier)
+            run.latencies.append(latency)
+            fresh.append((key, provider, model, label, tier, latency * 1000))
+            if cache and len(fresh) >= 100:
+                cache.put_many(fresh)
+                fresh = []
+    finally:
+        run.elapsed = time.perf_counter() - started
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if cache and fresh:
+            cache.put_many(fresh)
+
+    for key in keys:
+        label, tier = predictions[key]
+        run.y_pred.append(label)
+        if tier:
+            run.tiers[tier] += 1
+    run.cached = sum(1 for key in keys if key in hits)
+    return run
 
 
 def classify_rows(rows: Sequence[Dict[str, str]]) -> Tuple[List[str], List[str]]:
-    y_true: List[str] = []
-    y_pred: List[str] = []
-
-    for row in rows:
-        message = _format_message(row)
-        expected = (row.get("expected_label") or "unknown").strip().lower()
-        try:
-            prediction = _classify_message(message).get("label", "unknown")
-        except Exception as exc:  # noqa: BLE001
-            raise exc
-            print(f"[warn] failed to classify row {row}: {exc}")
-            prediction = "unknown"
-
-        y_true.append(expected)
-        y_pred.append(prediction)
-
-    return y_true, y_pred
+    run = evaluate_provider(rows, workers=1)
+    return run.y_true, run.y_pred
 
 
 def _safe_div(num: float, denom: float) -> float:
@@ -122,12 +263,152 @@ def format_report(metrics: Dict[str, LabelMetrics], y_true: Sequence[str]) -> st
     return "\n".join(lines)
 
 
-def main() -> None:
-    rows = load_dataset()
-    y_true, y_pred = classify_rows(rows)
-    per_label_metrics = compute_metrics(candidate_labels, y_true, y_pred)
+def _percentile(sorted_values: Sequence[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def format_run(run: ProviderRun) -> str:
+    """
+    Cache use, latency percentiles and throughput of one `evaluate_provider` run.
+    """
+    classified = len(run.latencies)
+    lines = [f"{run.provider} ({run.model}): {len(run.y_true)} rows, {classified} classified, {run.cached} from cache"]
+    if classified:
+        latencies = sorted(latency * 1000 for latency in run.latencies)
+        lines.append(
+            f"latency ms: p50 {_percentile(latencies, 50):.1f}, p95 {_percentile(latencies, 95):.1f}, "
+            f"p99 {_percentile(latencies, 99):.1f}; throughput {_safe_div(classified, run.elapsed):.1f} rows/sec "
+            f"({run.pool}, {run.workers} worker{'s' if run.workers > 1 else ''})"
+        )
+    if run.tiers:
+        total = sum(run.tiers.values())
+        lines.append("decided by: " + ", ".join(f"{tier} {count / total:.0%}" for tier, count in run.tiers.most_common()))
+    return "\n".join(lines)
+
 
-    print(format_report(per_label_metrics, y_true))
+def compare_modes(rows: Sequence[Dict[str, str]], modes: Sequence[str]) -> str:
+    y_true = [row["expected_label"] for row in rows]
+    messages = [dataset.message_text(row) for row in rows]
+
+    header = (
+        f"{'mode':<8} {'macro_f1':>9} {'accuracy':>9} {'agreement':>10} "
+        f"{'load_s':>7} {'p50_ms':>8} {'mean_ms':>8}"
+    )
+    lines = [header, "-" * len(header)]
+    baseline: List[str] = []
+    for mode in modes:
+        started = time.perf_counter()
+        try:
+            bert_model.get_classifier(mode)
+        except (ImportError, RuntimeError) as exc:
+            # e.g. onnx without optimum: report it and compare the others
+            lines.append(f"{mode:<8} unavailable: {exc}")
+            continue
+        load_sec = time.perf_counter() - started
+
+        y_pred: List[str] = []
+        latencies: List[float] = []
+        for message in messages:
+            started = time.perf_counter()
+            y_pred.append(providers.classify_with_huggingface(message, mode=mode).get("label", "unknown"))
+            latencies.append(time.perf_counter() - started)
+        baseline = baseline or y_pred
+
+        metrics = compute_metrics(candidate_labels, y_true, y_pred)
+        macro_f1 = sum(m.f1 for m in metrics.values()) / len(metrics)
+        accuracy = _safe_div(sum(1 for t, p in zip(y_true, y_pred) if t == p), len(y_true))
+        agreement = _safe_div(sum(1 for b, p in zip(baseline, y_pred) if b == p), len(y_pred))
+        lines.append(
+            f"{mode:<8} {macro_f1:>9.3f} {accuracy:>9.3f} {agreement:>10.3f} {load_sec:>7.1f} "
+            f"{statistics.median(latencies) * 1000:>8.1f} {statistics.fmean(latencies) * 1000:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def train_local(
+    rows: Sequence[Dict[str, str]], holdout: float, mongo_limit: int, save: bool, seed: int = 7
+) -> str:
+    rows = [row for row in rows if row["expected_label"] in candidate_labels]
+    shuffled = list(rows)
+    random.Random(seed).shuffle(shuffled)
+    cut = int(len(shuffled) * (1 - holdout))
+    train_rows, test_rows = shuffled[:cut], shuffled[cut:] or shuffled
+
+    texts = [dataset.message_text(row) for row in train_rows]
+    labels = [row["expected_label"] for row in train_rows]
+    if mongo_limit:
+        stored_texts, stored_labels = local_model.mongo_examples(mongo_limit)
+        texts += stored_texts
+        labels += stored_labels
+
+    started = time.perf_counter()
+    model = local_model.train(texts, labels)
+    train_sec = time.perf_counter() - started
+    if save:
+        model.save()
+
+    messages = [dataset.message_text(row) for row in test_rows]
+    y_true = [row["expected_label"] for row in test_rows]
+    repeats = max(1, 5000 // len(messages))
+    started = time.perf_counter()
+    for _ in range(repeats):
+        y_pred = [model.classify(message)["label"] for message in messages]
+    per_second = repeats * len(messages) / (time.perf_counter() - started)
+
+    report = format_report(compute_metrics(candidate_labels, y_true, y_pred), y_true)
+    return (
+        f"trained on {len(texts)} examples in {train_sec:.2f}s, evaluated on {len(test_rows)} held-out rows\n"
+        f"{report}\n"
+        f"throughput: {per_second:,.0f} messages/sec on one core"
+        + (f"\nsaved to {local_model.LOCAL_MODEL_PATH}" if save else "")
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--compare-modes",
+        nargs="+",
+        choices=bert_model.INFERENCE_MODES,
+        help="compare HuggingFace inference modes instead of evaluating AI_PROVIDER",
+    )
+    parser.add_argument("--train-local", action="store_true", help="train and evaluate the local model")
+    parser.add_argument("--holdout", type=float, default=0.3, help="share of rows held out by --train-local")
+    parser.add_argument("--mongo-limit", type=int, default=0, help="stored analyses added to --train-local data")
+    parser.add_argument("--save", action="store_true", help="save the --train-local model to LOCAL_MODEL_PATH")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N rows")
+    parser.add_argument(
+        "--providers", nargs="+", choices=providers.available(), help="providers to evaluate (default: AI_PROVIDER)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help=f"concurrent rows per provider (default: {DEFAULT_WORKERS['network']} threads for network "
+             f"providers, {DEFAULT_WORKERS['local']} processes for local models)",
+    )
+    parser.add_argument("--cache", type=Path, default=CACHE_PATH, help="SQLite prediction cache")
+    parser.add_argument("--no-cache", action="store_true", help="classify every row again")
+    args = parser.parse_args()
+
+    rows = load_dataset()[:args.limit]
+    if args.train_local:
+        print(train_local(rows, args.holdout, args.mongo_limit, args.save))
+        return
+    if args.compare_modes:
+        print(compare_modes(rows, args.compare_modes))
+        return
+
+    cache = None if args.no_cache else PredictionCache(args.cache)
+    try:
+        for index, provider in enumerate(args.providers or [providers.selected_provider()]):
+            run = evaluate_provider(rows, provider, args.workers, cache)
+            if index:
+                print()
+            print(format_report(compute_metrics(candidate_labels, run.y_true, run.y_pred), run.y_true))
+            print(format_run(run))
+    finally:
+        if cache:
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,360 @@
+"""Replay millions of timestamped events through the notification dispatch rules.
+
+Usage:
+    python tests/notification_simulator.py [--scale 100] [--days 7] [--intervals 1 5 15 60]
+                                           [--modes batch digest] [--save-events events.npz]
+    python tests/notification_simulator.py --replay events.npz
+
+``tests/efficiency_metrics.py`` estimates notifications with "critical: every
+occurrence, anything else: one per row". This is a discrete-event version of
+the same question. Every ``data_set.csv`` row is one message template (one
+fingerprint) with its expected label. Its ``count_24h`` (times ``--scale``)
+occurrences per simulated day are generated with NumPy. ``count_1h`` of them
+fall in a one-hour burst at a random time of day, and the rest are spread
+over the day. Each event gets an analysis delay (exponential, mean
+``--analysis-delay-sec``).
+
+The simulation runs the real rules from ``notification_service.rules`` against
+an in-memory column store of the ``messages`` fields they read:
+
+* a critical message is sent by ``send_message`` once its analysis is done
+* every interval the dispatch beat evaluates ``pending_non_critical_filter``
+  (unsent, not analysed as critical, older than the cutoff). It then fans out
+  ``send_batch`` chunks of ``--chunk-size`` or, in digest mode,
+  ``send_digests`` chunks of ``--chunk-size`` ``digest_group_id`` groups.
+
+Messages that are still unanalysed at the cutoff match the filter like they
+do in MongoDB, so a slow critical analysis can be sent twice. ``--fail-rate``
+fails a share of deliveries, and those messages stay unsent until the next
+dispatch.
+
+For each mode and interval the report lists the notifications sent (and the
+reduction against one per event) and the notification delay of non-critical
+and critical events. It also counts the ``messages`` operations and Celery
+tasks of the notification path.
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from ai import dataset
+from notification_service import rules
+
+DATASET_PATH = ROOT_DIR / "data_set.csv"
+LABELS = ["critical", "high", "medium", "low", "unknown"]
+CRITICAL = LABELS.index("critical")
+NO_ANALYSIS = -1
+
+EPOCH = datetime(2024, 1, 1)
+HOUR = 3600.0
+DAY = 24 * HOUR
+
+
+def load_templates(path: Path = DATASET_PATH) -> List[Dict[str, Any]]:
+    return [
+        {
+            "service": row["service"] or "unknown",
+            "text": row["text"],
+            "label": row["expected_label"] if row["expected_label"] in LABELS else "unknown",
+            "count_1h": int(row["count_1h"] or 0),
+            "count_24h": int(row["count_24h"] or 0),
+        }
+        for row in dataset.load_rows(str(path))
+    ]
+
+
+def generate_events(templates: List[Dict[str, Any]], scale: float, days: int, seed: int) -> Dict[str, np.ndarray]:
+    """
+    Timestamps (seconds since the start) and template index of every event,
+    sorted by time, plus per-template service and label codes.
+    """
+    rng = np.random.default_rng(seed)
+    per_day = np.rint(np.array([t["count_24h"] for t in templates]) * scale).astype(np.int64)
+    burst = np.minimum(np.rint(np.array([t["count_1h"] for t in templates]) * scale).astype(np.int64), per_day)
+
+    # one (template, day) slot per template and day
+    slot_template = np.repeat(np.arange(len(templates)), days)
+    slot_day = np.tile(np.arange(days), len(templates))
+    burst_start = rng.uniform(0, DAY - HOUR, size=len(slot_template))
+
+    burst_slot = np.repeat(np.arange(len(slot_template)), np.repeat(burst, days))
+    burst_ts = slot_day[burst_slot] * DAY + burst_start[burst_slot] + rng.uniform(0, HOUR, size=len(burst_slot))
+    spread_slot = np.repeat(np.arange(len(slot_template)), np.repeat(per_day - burst, days))
+    spread_ts = slot_day[spread_slot] * DAY + rng.uniform(0, DAY, size=len(spread_slot))
+
+    ts = np.concatenate([burst_ts, spread_ts])
+    template = slot_template[np.concatenate([burst_slot, spread_slot])]
+    order = np.argsort(ts, kind="stable")
+
+    services = sorted({t["service"] for t in templates})
+    return {
+        "ts": ts[order],
+        "template": template[order].astype(np.int32),
+        "template_service": np.array([services.index(t["service"]) for t in templates], dtype=np.int32),
+        "template_label": np.array([LABELS.index(t["label"]) for t in templates], dtype=np.int8),
+        "days": np.array(days),
+    }
+
+
+class ColumnStore:
+    """
+    The `messages` fields the dispatch rules read, one NumPy array each,
+    ordered by `timestamp`. `sent` and `analysis.label` are derived from
+    `sent_at` / `analyzed_at` at the simulated clock `now`, so a Mongo filter
+    can be evaluated as of any moment with `find(query, lo, hi)`.
+    """
+
+    def __init__(self, events: Dict[str, np.ndarray], analyzed_at: np.ndarray):
+        template = events["template"]
+        self.timestamp = events["ts"]
+        self.columns = {
+            "fingerprint": template,
+            "service": events["template_service"][template],
+        }
+        self.label = events["template_label"][template]
+        self.analyzed_at = analyzed_at
+        self.sent_at = np.full(len(template), np.inf)
+        self.now = 0.0
+        self.ops: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def column(self, path: str, lo: int, hi: int) -> np.ndarray:
+        if path == "timestamp":
+            return self.timestamp[lo:hi]
+        if path == "sent":
+            return self.sent_at[lo:hi] <= self.now
+        if path == "analysis.label":
+            return np.where(self.analyzed_at[lo:hi] <= self.now, self.label[lo:hi], NO_ANALYSIS)
+        return self.columns[path][lo:hi]
+
+    @staticmethod
+    def _encode(path: str, value: Any) -> Any:
+        if isinstance(value, datetime):
+            return (value - EPOCH).total_seconds()
+        if path == "analysis.label":
+            return LABELS.index(value)
+        return value
+
+    def find(self, query: Dict[str, Any], lo: int, hi: int) -> np.ndarray:
+        """
+        Indexes in [lo, hi) matching `query` (equality, $ne, $lte, $gte).
+        """
+        mask = np.ones(hi - lo, dtype=bool)
+        for path, condition in query.items():
+            column = self.column(path, lo, hi)
+            if not isinstance(condition, dict):
+                mask &= column == self._encode(path, condition)
+                continue
+            for op, operand in condition.items():
+                operand = self._encode(path, operand)
+                if op == "$ne":
+                    mask &= column != operand
+                elif op == "$lte":
+                    mask &= column <= operand
+                elif op == "$gte":
+                    mask &= column >= operand
+                else:
+                    raise NotImplementedError(f"filter operator {op} is not simulated")
+        return lo + np.flatnonzero(mask)
+
+
+def simulate(
+    events: Dict[str, np.ndarray],
+    mode: str,
+    interval: int,
+    chunk_size: int = 500,
+    analysis_delay: float = 3.0,
+    task_latency: float = 0.5,
+    fail_rate: float = 0.0,
+    by_service: bool = False,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    rng = np.random.default_rng(seed)
+    analyzed_at = events["ts"] + rng.exponential(analysis_delay, size=len(events["ts"])) if analysis_delay else events["ts"]
+    store = ColumnStore(events, analyzed_at)
+    tasks: Counter = Counter()
+    notifications = failed = duplicates = 0
+
+    # analyze_message -> schedule_immediate_if_critical -> send_message
+    critical = np.flatnonzero(store.label == CRITICAL)
+    tasks["send_message"] += len(critical)
+    store.ops["update_one"] += len(critical)
+    notifications += len(critical)
+    store.sent_at[critical] = analyzed_at[critical] + task_latency
+    notified_at = store.sent_at.copy()
+
+    group_fields = [field.lstrip("$") for field in rules.digest_group_id("fingerprint", by_service).values()]
+    interval_sec = interval * 60.0
+    horizon = float(events["ts"][-1]) if len(store) else 0.0
+    lo = 0
+    tick = interval_sec
+    while True:
+        store.now = tick
+        cutoff = rules.dispatch_cutoff(EPOCH + timedelta(seconds=tick), interval)
+        hi = int(np.searchsorted(store.timestamp, store._encode("timestamp", cutoff), side="right"))
+        # everything before `lo` has been sent already: skip it like the partial index does
+        while lo < hi and store.sent_at[lo] <= tick:
+            unsent = np.flatnonzero(store.sent_at[lo:hi] > tick)
+            lo = lo + int(unsent[0]) if len(unsent) else hi
+        pending = store.find(rules.pending_non_critical_filter(cutoff), lo, hi)
+        tasks["dispatch_non_critical"] += 1
+        duplicates += int(np.count_nonzero(store.label[pending] == CRITICAL))
+
+        if mode == "digest":
+            store.ops["aggregate"] += 1
+            if len(pending):
+                keys = np.stack([store.columns[field][pending] for field in group_fields], axis=1)
+                _, group_of = np.unique(keys, axis=0, return_inverse=True)
+                group_of = group_of.reshape(-1)
+                groups = int(group_of.max()) + 1
+                delivered = rng.random(groups) >= fail_rate
+                notifications += int(delivered.sum())
+                failed += int((~delivered).sum())
+                for chunk in rules.chunked(range(groups), chunk_size):
+                    tasks["send_digests"] += 1
+                    if delivered[chunk].any():
+                        store.ops["bulk_write"] += 1
+                members = pending[delivered[group_of]]
+                store.sent_at[members] = tick + task_latency
+                notified_at[members] = np.minimum(notified_at[members], tick + task_latency)
+        else:
+            store.ops["find"] += max(1, math.ceil(len(pending) / chunk_size))
+            for chunk in rules.chunked(pending, chunk_size):
+                chunk = np.asarray(chunk)
+                tasks["send_batch"] += 1
+                store.ops["find"] += 1
+                delivered = rng.random(len(chunk)) >= fail_rate
+                notifications += int(delivered.sum())
+                failed += int((~delivered).sum())
+                if delivered.any():
+                    store.ops["bulk_write"] += 1
+                    sent = chunk[delivered]
+                    store.sent_at[sent] = tick + task_latency
+                    notified_at[sent] = np.minimum(notified_at[sent], tick + task_latency)
+
+        if tick > horizon + interval_sec and not np.isinf(store.sent_at[lo:]).any():
+            break
+        if tick > horizon + 100 * interval_sec:
+            break
+        tick += interval_sec
+
+    delays = notified_at - store.timestamp
+    is_critical = store.label == CRITICAL
+    return {
+        "mode": mode,
+        "interval": interval,
+        "events": len(store),
+        "notifications": notifications,
+        "failed": failed,
+        "duplicates": duplicates,
+        "unsent": int(np.isinf(store.sent_at).sum()),
+        "delay_sec": _delay_percentiles(delays[~is_critical]),
+        "critical_delay_sec": _delay_percentiles(delays[is_critical]),
+        "db_ops": dict(store.ops),
+        "tasks": dict(tasks),
+    }
+
+
+def _delay_percentiles(delays: np.ndarray) -> Dict[str, Optional[float]]:
+    delays = delays[np.isfinite(delays)]
+    if not len(delays):
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(delays, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(delays.max())}
+
+
+def naive_estimate(events: Dict[str, np.ndarray]) -> int:
+    """
+    The `efficiency_metrics.compute_counts` rule over the same events: every
+    critical occurrence, plus one notification per other template and day.
+    """
+    labels = events["template_label"][events["template"]]
+    critical = int(np.count_nonzero(labels == CRITICAL))
+    day = (events["ts"] // DAY).astype(np.int64)
+    other = labels != CRITICAL
+    return critical + len(np.unique(np.stack([events["template"][other], day[other]], axis=1), axis=0))
+
+
+def _seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f"{value / 60:.1f}m" if value >= 600 else f"{value:.1f}s"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=100.0, help="multiplier for the dataset's event counts")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--intervals", type=int, nargs="*", default=[1, 5, 15, 60], help="DISPATCH_INTERVAL_MINUTES values")
+    parser.add_argument("--modes", nargs="*", choices=["batch", "digest"], default=["batch", "digest"])
+    parser.add_argument("--chunk-size", type=int, default=500, help="DISPATCH_CHUNK_SIZE")
+    parser.add_argument("--by-service", action="store_true", help="DIGEST_GROUP_BY_SERVICE=1")
+    parser.add_argument("--analysis-delay-sec", type=float, default=3.0, help="mean time from ingest to analysis")
+    parser.add_argument("--task-latency-sec", type=float, default=0.5, help="queueing and delivery time of a send task")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of failed deliveries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-events", type=Path, help="write the generated events to an .npz file")
+    parser.add_argument("--replay", type=Path, help="replay events saved with --save-events")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.replay:
+        with np.load(args.replay) as data:
+            events = {key: data[key] for key in data.files}
+    else:
+        events = generate_events(load_templates(), args.scale, args.days, args.seed)
+    if args.save_events:
+        np.savez_compressed(args.save_events, **events)
+    print(f"{len(events['ts']):,} events over {int(events['days'])} days, generated in {time.perf_counter() - started:.1f}s")
+    print(f"one notification per event: {len(events['ts']):,}; efficiency_metrics rule: {naive_estimate(events):,}")
+    print()
+
+    header = (
+        f"{'mode':<7} {'interval':>8} {'notifications':>13} {'reduction':>9} {'delay p50':>9} {'p95':>7} "
+        f"{'max':>7} {'crit p99':>8} {'dup':>5} {'db ops':>9} {'tasks':>9} {'sim s':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for mode in args.modes:
+        for interval in args.intervals:
+            started = time.perf_counter()
+            result = simulate(
+                events, mode, interval,
+                chunk_size=args.chunk_size,
+                analysis_delay=args.analysis_delay_sec,
+                task_latency=args.task_latency_sec,
+                fail_rate=args.fail_rate,
+                by_service=args.by_service,
+                seed=args.seed,
+            )
+            elapsed = time.perf_counter() - started
+            delay = result["delay_sec"]
+            reduction = 1 - result["notifications"] / result["events"] if result["events"] else 0.0
+            print(
+                f"{mode:<7} {str(interval) + 'm':>8} {result['notifications']:>13,} {reduction:>9.1%} "
+                f"{_seconds(delay['p50']):>9} {_seconds(delay['p95']):>7} {_seconds(delay['max']):>7} "
+                f"{_seconds(result['critical_delay_sec']['p99']):>8} {result['duplicates']:>5} "
+                f"{sum(result['db_ops'].values()):>9,} {sum(result['tasks'].values()):>9,} {elapsed:>6.1f}"
+            )
+            if result["failed"] or result["unsent"]:
+                print(f"        failed deliveries: {result['failed']:,}, still unsent: {result['unsent']:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Benchmark the MinHash LSH index used for near-duplicate clustering.
+
+Usage:
+    python tests/similarity_benchmark.py [--messages 1000000] [--queries 10000]
+
+Assigns synthetic distinct log lines to clusters with
+``api.similarity.MinHashIndex`` the way ``ClusterAssigner`` does, then reports
+index memory, assignment cost and lookup latency for near-duplicates of
+indexed lines (new path / host / quoted values and one word replaced) and for
+unseen lines. ``matched`` is the recall for near-duplicates and the false
+merge rate for unseen lines. Mongo is not touched.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+# api.services needs a URI at import time; clients connect lazily
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system")
+
+from api.similarity import SIMILARITY_THRESHOLD, MinHashIndex, band_keys, compact, signature
+from api.stats import normalize
+
+SLOTS = [
+    lambda rng: f"/{_word(rng)}/{_word(rng)}/{_word(rng)}.log",
+    lambda rng: f"{_word(rng)}.{_word(rng)}.internal",
+    lambda rng: f"'{_word(rng)} {_word(rng)}'",
+    lambda rng: str(rng.randint(1, 10_000)),
+]
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+
+
+class Corpus:
+    """
+    Log-like lines: 6-14 words drawn from a Zipf-distributed vocabulary plus
+    1-2 variable slots (path, host, quoted value, number), so common words are
+    shared across many lines the way they are in real logs.
+    """
+
+    def __init__(self, rng: random.Random, vocabulary: int = 20_000):
+        self.rng = rng
+        self.words = [_word(rng) for _ in range(vocabulary)]
+        weights = 1.0 / np.arange(1, vocabulary + 1)
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def _words(self, count: int) -> List[str]:
+        picks = np.searchsorted(self.cdf, [self.rng.random() for _ in range(count)])
+        return [self.words[min(i, len(self.words) - 1)] for i in picks]
+
+    def template(self) -> List[Optional[str]]:
+        """Words with `None` where a variable slot goes."""
+        tokens: List[Optional[str]] = list(self._words(self.rng.randint(6, 14)))
+        for _ in range(self.rng.randint(1, 2)):
+            tokens.insert(self.rng.randrange(len(tokens) + 1), None)
+        return tokens
+
+    def render(self, template: List[Optional[str]]) -> str:
+        return " ".join(token or self.rng.choice(SLOTS)(self.rng) for token in template)
+
+    def near_duplicate(self, template: List[Optional[str]]) -> str:
+        # fresh slot values and one word replaced
+        tokens = list(template)
+        words = [i for i, token in enumerate(tokens) if token]
+        tokens[self.rng.choice(words)] = self._words(1)[0]
+        return self.render(tokens)
+
+
+def _percentiles(samples: List[float]) -> str:
+    values = np.array(samples) * 1e6
+    return f"p50={np.percentile(values, 50):.1f}us p99={np.percentile(values, 99):.1f}us max={values.max():.1f}us"
+
+
+Query = Tuple[np.ndarray, List[int]]
+
+
+def _prepare(text: str) -> Query:
+    sig = signature(normalize(text))
+    return compact(sig), band_keys(sig)
+
+
+def _lookups(index: MinHashIndex, queries: List[Query]) -> Tuple[List[float], float]:
+    latency: List[float] = []
+    matched = 0
+    for compact_sig, keys in queries:
+        t0 = time.perf_counter()
+        found = index.query(compact_sig, keys)
+        latency.append(time.perf_counter() - t0)
+        matched += found is not None
+    return latency, matched / len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--threshold", type=float, nargs="*", default=[SIMILARITY_THRESHOLD])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = Corpus(rng)
+    index = MinHashIndex(threshold=args.threshold[0])
+    samples: List[List[Optional[str]]] = []
+    assign_latency: List[float] = []
+
+    started = time.perf_counter()
+    for i in range(args.messages):
+        template = corpus.template()
+        text = normalize(corpus.render(template))
+        t0 = time.perf_counter()
+        sig = signature(text)
+        compact_sig, keys = compact(sig), band_keys(sig)
+        found = index.query(compact_sig, keys)
+        if found is None:
+            cluster = index.new_cluster(hashlib.sha1(text.encode("utf-8")).hexdigest())
+            index.add(compact_sig, keys, cluster)
+        elif found[1] < 1.0:
+            index.add(compact_sig, keys, found[0])
+        if i % 100 == 0:
+            assign_latency.append(time.perf_counter() - t0)
+        if len(samples) < args.queries:
+            samples.append(template)
+        if (i + 1) % 100_000 == 0:
+            print(f"  assigned {i + 1:,} in {time.perf_counter() - started:.1f}s")
+    build_seconds = time.perf_counter() - started
+
+    near = [_prepare(corpus.near_duplicate(template)) for template in samples]
+    unseen = [_prepare(corpus.render(corpus.template())) for _ in range(args.queries)]
+
+    print(f"messages          {args.messages:,} ({len(index):,} indexed, {index.clusters:,} clusters)")
+    print(f"index memory      {index.memory_bytes() / 2**20:.1f} MiB ({index.memory_bytes() / max(1, len(index)):.0f} B/line)")
+    print(f"assign            {_percentiles(assign_latency)} (signature + lookup + add), total {build_seconds:.1f}s")
+    for threshold in args.threshold:
+        index.threshold = threshold
+        for name, queries in (("near-dup", near), ("unseen", unseen)):
+            latency, matched = _lookups(index, queries)
+            print(f"t={threshold:<4} {name:<9} {_percentiles(latency)} matched={matched:.3f}")
+
+if __name__ == "__main__":
+    main()
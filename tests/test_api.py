@@ -60,3 +60,28 @@ async def test_create_multiple_messages():
     db = mongo_client.get_default_database()
     count = db["messages"].count_documents({})
     assert count == len(samples)
+
+@pytest.mark.asyncio
+async def test_create_messages_batch():
+    samples = [
+        {"service": "auth", "level": "error", "content": "Token expired for user 42"},
+        {"service": "auth", "level": "error", "content": "Token expired for user 43"},
+        {"service": "db", "level": "warning"},
+    ]
+
+    async with AsyncClient(base_url="http://localhost:8000") as client:
+        response = await client.post("/messages/batch", json=samples)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["inserted"] == 2
+    assert data["failed"] == 1
+    assert [item["index"] for item in data["items"]] == [0, 1, 2]
+    assert "id" in data["items"][0] and "id" in data["items"][1]
+    assert "error" in data["items"][2]
+
+    db = mongo_client.get_default_database()
+    docs = list(db["messages"].find({}, {"fingerprint": 1, "context_stats": 1}))
+    assert len(docs) == 2
+    assert docs[0]["fingerprint"] == docs[1]["fingerprint"]
+    assert all("context_stats" in doc for doc in docs)
@@ -0,0 +1,112 @@
+# tests/test_async_stats.py
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import api.main as api_main
+import api.tasks as api_tasks
+from api import rollups, stats
+from tests.memory_store import MemoryCollection
+
+
+class Published:
+    """Stands in for a celery group/chain and records what was published."""
+
+    calls = []
+
+    def __init__(self, kind, *parts):
+        self.kind, self.parts = kind, parts
+
+    def apply_async(self):
+        Published.calls.append(self)
+
+
+@pytest.fixture
+def published(monkeypatch):
+    Published.calls = []
+    monkeypatch.setattr(api_main, "group", lambda tasks: Published("group", *tasks))
+    monkeypatch.setattr(api_main, "chain", lambda *tasks: Published("chain", *tasks))
+    return Published.calls
+
+
+def _names(parts):
+    return [part.task if hasattr(part, "task") else part.kind for part in parts]
+
+
+def test_inline_mode_publishes_only_analysis(published, monkeypatch):
+    monkeypatch.setattr(api_main, "STATS_MODE", "inline")
+
+    api_main._enqueue_background(["a", "b"])
+
+    assert [call.kind for call in published] == ["group"]
+    assert _names(published[0].parts) == ["ai.tasks.analyze_message"] * 2
+
+
+def test_async_mode_chains_stats_before_analysis(published, monkeypatch):
+    monkeypatch.setattr(api_main, "STATS_MODE", "async")
+    monkeypatch.setattr(api_main, "STATS_ORDERING", "before_analysis")
+
+    api_main._enqueue_background(["a", "b"])
+
+    (call,) = published
+    assert call.kind == "chain"
+    assert _names(call.parts) == ["api.tasks.build_context_stats", "group"]
+    assert call.parts[0].args == (["a", "b"],)
+
+
+def test_parallel_ordering_publishes_stats_alongside_analysis(published, monkeypatch):
+    monkeypatch.setattr(api_main, "STATS_MODE", "async")
+    monkeypatch.setattr(api_main, "STATS_ORDERING", "parallel")
+
+    api_main._enqueue_background(["a"])
+
+    (call,) = published
+    assert call.kind == "group"
+    assert _names(call.parts) == ["api.tasks.build_context_stats", "ai.tasks.analyze_message"]
+
+
+def test_build_context_stats_updates_rollups_and_attaches_stats(monkeypatch):
+    messages, buckets = MemoryCollection(), MemoryCollection()
+    monkeypatch.setattr(api_tasks, "get_sync_messages_collection", lambda: messages)
+    monkeypatch.setattr(api_tasks, "get_sync_rollups_collection", lambda: buckets)
+    monkeypatch.setattr(rollups, "get_sync_rollups_collection", lambda: buckets)
+    monkeypatch.setattr(stats, "STATS_SOURCE", "rollup")
+    now = datetime.utcnow()
+    ids = []
+    for minutes in (1, 2):
+        doc = {"_id": ObjectId(), "fingerprint": "fp", "content": "db down", "service": "auth",
+               "created_at": now - timedelta(minutes=minutes)}
+        messages.insert_one(doc)
+        ids.append(str(doc["_id"]))
+
+    result = api_tasks.build_context_stats(ids)
+
+    assert result == {"ids": ids, "updated": 2}
+    for doc in messages.docs.values():
+        window = doc["context_stats"]["windows"]["1h"]
+        assert window["count"] == 2
+        assert window["top_services"] == [("auth", 2)]
+
+
+class BrokenCollection(MemoryCollection):
+    def find(self, *args, **kwargs):
+        raise ConnectionError("mongo is down")
+
+
+@pytest.mark.parametrize("messages, ids", [
+    (BrokenCollection(), [str(ObjectId())]),
+    (MemoryCollection(), ["not-an-object-id"]),
+])
+def test_build_context_stats_swallows_load_errors(messages, ids, monkeypatch):
+    monkeypatch.setattr(api_tasks, "get_sync_messages_collection", lambda: messages)
+
+    result = api_tasks.build_context_stats(ids)
+
+    assert result["ids"] == ids
+    assert "error" in result
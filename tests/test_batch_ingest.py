@@ -0,0 +1,127 @@
+# tests/test_batch_ingest.py
+
+import asyncio
+import os
+
+import httpx
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import api.main as api_main
+from api import rollups, stats
+from tests.memory_store import AsyncMemoryCollection, MemoryCollection, apply_update, matches
+
+
+@pytest.fixture
+def store(monkeypatch):
+    messages = MemoryCollection(indexed=["fingerprint"])
+    rollup_docs = MemoryCollection(indexed=["fingerprint"])
+    enqueued = []
+    monkeypatch.setattr(api_main, "get_async_messages_collection", lambda: AsyncMemoryCollection(messages))
+    monkeypatch.setattr(api_main, "get_async_rollups_collection", lambda: AsyncMemoryCollection(rollup_docs))
+    monkeypatch.setattr(api_main, "_enqueue_background", enqueued.extend)
+    monkeypatch.setattr(api_main, "STATS_MODE", "inline")
+    monkeypatch.setattr(api_main, "CLUSTERING", False)
+    monkeypatch.setattr(stats, "STATS_SOURCE", "rollup")
+    monkeypatch.setattr(stats, "get_sync_messages_collection", lambda: messages)
+    monkeypatch.setattr(rollups, "get_sync_rollups_collection", lambda: rollup_docs)
+    return messages, rollup_docs, enqueued
+
+
+def _post_batch(payload):
+    async def post():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/messages/batch", json=payload)
+
+    return asyncio.run(post())
+
+
+def test_memory_store_filters():
+    doc = {"a": {"b": 3}, "label": "low"}
+
+    assert matches(doc, {"a.b": {"$gte": 3, "$lt": 4}, "label": {"$in": ["low", "high"]}})
+    assert matches(doc, {"label": {"$ne": "critical"}, "missing": {"$exists": False}})
+    assert not matches(doc, {"missing": {"$in": [None]}})
+    assert not matches(doc, {"a.b": {"$gt": 3}})
+
+
+def test_memory_store_updates():
+    doc = {"count": 1}
+
+    apply_update(doc, {
+        "$inc": {"count": 2},
+        "$max": {"last": 5},
+        "$setOnInsert": {"created": True},
+        "$push": {"examples": {"$each": ["a", "b", "c"], "$slice": -2}},
+    }, inserted=False)
+
+    assert doc == {"count": 3, "last": 5, "examples": ["b", "c"]}
+
+
+def test_batch_stores_valid_items_and_reports_invalid_ones(store):
+    messages, rollup_docs, enqueued = store
+    payload = [
+        {"service": "db", "level": "error", "content": "Connection refused on port 5432"},
+        {"service": "db", "level": "error"},
+        {"service": "db", "level": "error", "content": "Connection refused on port 5433"},
+    ]
+
+    response = _post_batch(payload)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["inserted"], body["failed"]) == (2, 1)
+    assert [("id" in item, "error" in item) for item in body["items"]] == [(True, False), (False, True), (True, False)]
+    ids = [ObjectId(body["items"][i]["id"]) for i in (0, 2)]
+    assert enqueued == [str(mid) for mid in ids]
+    stored = [messages.docs[mid] for mid in ids]
+    assert stored[0]["fingerprint"] == stored[1]["fingerprint"]
+    assert all(doc["sent"] is False for doc in stored)
+
+
+def test_batch_reports_non_object_items(store):
+    messages, _, enqueued = store
+    payload = ["Connection refused", {"service": "db", "level": "error", "content": "Connection refused"}, None]
+
+    body = _post_batch(payload).json()
+
+    assert (body["inserted"], body["failed"]) == (1, 2)
+    assert ["error" in item for item in body["items"]] == [True, False, True]
+    assert enqueued == [body["items"][1]["id"]]
+    assert len(messages.docs) == 1
+
+
+def test_single_message_gets_the_same_defaults_as_a_batch(store, monkeypatch):
+    messages, _, _ = store
+    monkeypatch.setattr(api_main.celery_app, "send_task", lambda *args, **kwargs: None)
+
+    async def post():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/messages", json={"service": "db", "level": "error", "content": "Disk full"})
+
+    doc = messages.docs[ObjectId(asyncio.run(post()).json()["id"])]
+
+    assert doc["timestamp"] is not None
+    assert doc["created_at"] == doc["timestamp"]
+    assert doc["sent"] is False
+
+
+def test_batch_updates_rollups_and_attaches_stats(store):
+    messages, rollup_docs, _ = store
+    payload = [{"service": "db", "level": "error", "content": f"Disk usage {n}% on node {n}"} for n in (91, 92, 93)]
+
+    body = _post_batch(payload).json()
+
+    assert rollup_docs.docs
+    for item in body["items"]:
+        windows = messages.docs[ObjectId(item["id"])]["context_stats"]["windows"]
+        assert windows["1h"]["count"] == 3
+
+
+def test_empty_batch():
+    assert _post_batch([]).json() == {"items": [], "inserted": 0, "failed": 0}
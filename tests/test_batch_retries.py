@@ -0,0 +1,100 @@
+# tests/test_batch_retries.py
+
+import os
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import ai.tasks as ai_tasks
+from ai.rate_limit import ProviderRetryableError
+from tests.memory_store import MemoryCollection
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    coll = MemoryCollection()
+    monkeypatch.setattr(ai_tasks, "get_sync_messages_collection", lambda: coll)
+    monkeypatch.setattr(ai_tasks, "get_sync_rollups_collection", lambda: MemoryCollection())
+    monkeypatch.setattr(ai_tasks.providers, "selected_provider", lambda: "fake")
+    monkeypatch.setattr(ai_tasks.classification_cache, "get", lambda *args: None)
+    monkeypatch.setattr(ai_tasks.classification_cache, "put", lambda *args: None)
+    monkeypatch.setattr(ai_tasks, "schedule_immediate_if_critical", lambda *args: False)
+    return coll
+
+
+@pytest.fixture
+def republished(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        ai_tasks.analyze_message, "apply_async",
+        lambda args, kwargs=None, countdown=None: calls.append((args[0], kwargs["attempt"], countdown)),
+    )
+    monkeypatch.setattr(ai_tasks, "backoff_delay", lambda retries, retry_after=None: 10.0 * 2 ** retries)
+    return calls
+
+
+def _throttled(*args, **kwargs):
+    raise ProviderRetryableError("rate limited", retry_after=1)
+
+
+def _insert(coll, content="Database is down"):
+    doc = {"_id": ObjectId(), "content": content, "fingerprint": "fp", "created_at": datetime.utcnow()}
+    coll.insert_one(doc)
+    return str(doc["_id"])
+
+
+def test_batch_item_round_trip():
+    assert ai_tasks._batch_item("abc") == "abc"
+    assert ai_tasks._parse_batch_item(ai_tasks._batch_item("abc", 3)) == ("abc", 3)
+    assert ai_tasks._parse_batch_item("abc") == ("abc", 0)
+
+
+def test_throttled_batch_is_republished_with_the_next_attempt(messages, republished, monkeypatch):
+    monkeypatch.setattr(ai_tasks.providers, "classify_batch", _throttled)
+    first, second = _insert(messages), _insert(messages)
+
+    analyses = ai_tasks._analyze_batch([first, ai_tasks._batch_item(second, 2)])
+
+    assert analyses == {}
+    assert sorted(republished) == sorted([(first, 1, 10.0), (second, 3, 40.0)])
+    assert all("analysis" not in doc for doc in messages.docs.values())
+
+
+def test_throttled_batch_stores_unknown_after_max_retries(messages, republished, monkeypatch):
+    monkeypatch.setattr(ai_tasks.providers, "classify_batch", _throttled)
+    retried, exhausted = _insert(messages), _insert(messages)
+
+    analyses = ai_tasks._analyze_batch([retried, ai_tasks._batch_item(exhausted, ai_tasks.LLM_MAX_RETRIES)])
+
+    assert [call[0] for call in republished] == [retried]
+    assert analyses[exhausted]["label"] == "unknown"
+    assert "rate limited" in analyses[exhausted]["error"]
+    assert messages.docs[ObjectId(exhausted)]["analysis"]["label"] == "unknown"
+    assert "analysis" not in messages.docs[ObjectId(retried)]
+
+
+def test_throttled_fallback_keeps_the_answered_entries(messages, republished, monkeypatch):
+    # the fake batch drops every second entry, whose fallback is throttled
+    monkeypatch.setattr(ai_tasks.providers._load("ai.fake_client"), "FAKE_LLM_DROP_EVERY", 2)
+    monkeypatch.setattr(ai_tasks.providers, "_llm_response", _throttled)
+    answered, missing = _insert(messages, "Database connection failure"), _insert(messages)
+
+    analyses = ai_tasks._analyze_batch([answered, missing])
+
+    assert list(analyses) == [answered]
+    assert analyses[answered]["label"] == "critical"
+    assert messages.docs[ObjectId(answered)]["analysis"]["label"] == "critical"
+    assert republished == [(missing, 1, 10.0)]
+    assert "analysis" not in messages.docs[ObjectId(missing)]
+
+
+def test_failed_batch_is_republished_with_the_next_attempt(republished):
+    items = ["a", ai_tasks._batch_item("b", 1), ai_tasks._batch_item("c", ai_tasks.LLM_MAX_RETRIES)]
+
+    ai_tasks._requeue_batch(items, RuntimeError("mongo down"))
+
+    assert sorted(republished) == [("a", 1, 10.0), ("b", 2, 20.0)]
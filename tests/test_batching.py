@@ -0,0 +1,71 @@
+# tests/test_batching.py
+
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_URL", "memory://")
+
+from ai import batching
+
+
+class ListRedis:
+    """The list commands `ai.batching` uses, over a Python list."""
+
+    def __init__(self):
+        self.items = []
+
+    def rpush(self, key, *values):
+        self.items.extend(value.encode() for value in values)
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.items.insert(0, value.encode())
+
+    def llen(self, key):
+        return len(self.items)
+
+    def lpop(self, key, count):
+        popped, self.items = self.items[:count], self.items[count:]
+        return popped or None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = ListRedis()
+    monkeypatch.setattr(batching, "_get_redis", lambda: fake)
+    monkeypatch.setattr(batching, "HF_BATCH_WAIT_MS", 0)
+    return fake
+
+
+def test_submit_processes_at_most_one_batch(client):
+    client.rpush(batching.PENDING_KEY, "a", "b", "c", "d")
+    batches = []
+
+    processed = batching.submit("e", batches.append, size=2)
+
+    assert processed == 2
+    assert batches == [["a", "b"]]
+    assert client.items == [b"c", b"d", b"e"]
+
+
+def _failing(items):
+    raise RuntimeError("mongo down")
+
+
+def test_failed_batch_is_pushed_back_to_the_head(client):
+    client.rpush(batching.PENDING_KEY, "a")
+
+    processed = batching.submit("b", _failing, size=2)
+
+    assert processed == 0
+    assert client.items == [b"a", b"b"]
+
+
+def test_failed_batch_goes_to_on_failure(client):
+    failures = []
+
+    batching.submit("a", _failing, size=2, on_failure=lambda items, exc: failures.append((items, str(exc))))
+
+    assert failures == [(["a"], "mongo down")]
+    assert client.items == []
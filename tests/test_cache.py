@@ -0,0 +1,102 @@
+# tests/test_cache.py
+
+from fnmatch import fnmatchcase
+
+import pytest
+
+from ai import cache
+
+
+class DictRedis:
+    """The string commands `ai.cache` uses, over a dict."""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+        self.ttls[key] = ex
+
+    def scan_iter(self, match, count=None):
+        return [key for key in list(self.values) if fnmatchcase(key, match)]
+
+    def delete(self, *keys):
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = DictRedis()
+    monkeypatch.setattr(cache, "_get_redis", lambda: client)
+    monkeypatch.setattr(cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "_local", cache.OrderedDict())
+    monkeypatch.setattr(cache, "FLUSH_EVERY", 10 ** 9)
+    return client
+
+
+def test_hits_carry_neither_raw_payload_nor_token_usage(redis_client):
+    analysis = {"label": "high", "raw": {"id": "resp"}, "usage": {"input_tokens": 120, "output_tokens": 3}}
+
+    cache.put("fp", "openai", "gpt", analysis)
+    cache._local.clear()
+
+    assert cache.get("fp", "openai", "gpt") == {"label": "high"}
+    assert analysis["usage"]["input_tokens"] == 120
+
+
+def test_lru_evicts_the_least_recently_used(redis_client, monkeypatch):
+    monkeypatch.setattr(cache, "LRU_SIZE", 2)
+    for fp in ("a", "b"):
+        cache.put(fp, "fake", "fake", {"label": "low"})
+    cache.get("a", "fake", "fake")
+
+    cache.put("c", "fake", "fake", {"label": "low"})
+
+    assert [key.rsplit(":", 1)[1] for key in cache._local] == ["a", "c"]
+
+
+def test_redis_entries_get_the_ttl_and_refill_the_lru(redis_client, monkeypatch):
+    monkeypatch.setattr(cache, "TTL_SECONDS", 60)
+    cache.put("fp", "fake", "fake", {"label": "critical"})
+    cache._local.clear()
+    before = dict(cache._counters)
+
+    assert cache.get("fp", "fake", "fake") == {"label": "critical"}
+    assert cache.get("fp", "fake", "fake") == {"label": "critical"}
+    assert cache.get("other", "fake", "fake") is None
+
+    assert set(redis_client.ttls.values()) == {60}
+    assert cache._counters["redis_hits"] - before["redis_hits"] == 1
+    assert cache._counters["lru_hits"] - before["lru_hits"] == 1
+    assert cache._counters["misses"] - before["misses"] == 1
+
+
+def test_hits_are_copies(redis_client):
+    cache.put("fp", "fake", "fake", {"label": "low"})
+
+    cache.get("fp", "fake", "fake")["cached"] = True
+
+    assert "cached" not in cache.get("fp", "fake", "fake")
+
+
+def test_invalidate_by_provider(redis_client):
+    cache.put("fp", "fake", "fake", {"label": "low"})
+    cache.put("fp", "local", "local_model.npz:0123abcd", {"label": "low"})
+
+    assert cache.invalidate(provider="local") == 1
+
+    assert cache.get("fp", "local", "local_model.npz:0123abcd") is None
+    assert cache.get("fp", "fake", "fake") == {"label": "low"}
+
+
+def test_disabled_cache_stores_nothing(redis_client, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_ENABLED", False)
+
+    cache.put("fp", "fake", "fake", {"label": "low"})
+
+    assert cache.get("fp", "fake", "fake") is None
+    assert redis_client.values == {}
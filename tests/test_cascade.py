@@ -0,0 +1,75 @@
+# tests/test_cascade.py
+
+import os
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import ai.tasks as ai_tasks
+from ai import cascade
+from ai.rate_limit import ProviderRetryableError
+from tests.memory_store import MemoryCollection
+
+
+def _tiers(local_confidence):
+    def classify(name, content, stats=None):
+        if name == "local":
+            return {"label": "high", "confidence": local_confidence, "provider": "local"}
+        raise ProviderRetryableError("openai rate limited", retry_after=2)
+    return classify
+
+
+@pytest.fixture(autouse=True)
+def tiers(monkeypatch):
+    monkeypatch.setattr(cascade, "CASCADE_TIERS", ["local", "openai"])
+    monkeypatch.setattr(cascade, "CASCADE_CONFIDENCE_THRESHOLD", 0.8)
+
+
+def test_settled_first_tier_does_not_escalate(monkeypatch):
+    monkeypatch.setattr(cascade.providers, "classify", _tiers(0.9))
+
+    analysis = cascade.classify("disk almost full")
+
+    assert analysis["tier"] == "local"
+    assert [tier["provider"] for tier in analysis["tiers"]] == ["local"]
+
+
+def test_throttled_escalation_carries_the_lower_tier_answer(monkeypatch):
+    monkeypatch.setattr(cascade.providers, "classify", _tiers(0.5))
+
+    with pytest.raises(ProviderRetryableError) as raised:
+        cascade.classify("disk almost full")
+
+    fallback = raised.value.fallback
+    assert raised.value.retry_after == 2
+    assert fallback["label"] == "high"
+    assert fallback["tier"] == "local"
+    assert fallback["escalation_skipped"] == "throttled"
+    assert "rate limited" in fallback["tiers"][-1]["error"]
+
+
+def test_last_attempt_stores_the_fallback(monkeypatch):
+    messages = MemoryCollection()
+    monkeypatch.setattr(ai_tasks, "get_sync_messages_collection", lambda: messages)
+    monkeypatch.setattr(ai_tasks, "get_sync_rollups_collection", lambda: MemoryCollection())
+    monkeypatch.setattr(ai_tasks.providers, "selected_provider", lambda: "cascade")
+    monkeypatch.setattr(ai_tasks.providers, "model_name", lambda provider: "cascade")
+    monkeypatch.setattr(ai_tasks.classification_cache, "get", lambda *args: None)
+    monkeypatch.setattr(ai_tasks, "schedule_immediate_if_critical", lambda *args: False)
+    tier = _tiers(0.5)
+    monkeypatch.setattr(
+        cascade.providers, "classify",
+        lambda name, content, stats=None: cascade.classify(content) if name == "cascade" else tier(name, content),
+    )
+    message_id = ObjectId()
+    messages.insert_one({"_id": message_id, "content": "disk almost full", "created_at": datetime.utcnow()})
+
+    ai_tasks.analyze_message(str(message_id), attempt=ai_tasks.LLM_MAX_RETRIES)
+
+    stored = messages.docs[message_id]["analysis"]
+    assert stored["label"] == "high"
+    assert stored["escalation_skipped"] == "throttled"
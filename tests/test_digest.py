@@ -0,0 +1,132 @@
+# tests/test_digest.py
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import notification_service.tasks as notification_tasks
+from notification_service.rules import digest_group_id, highest_severity
+from notification_service.transports import DeliveryError
+from tests.memory_store import MemoryCollection
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    coll = MemoryCollection()
+    monkeypatch.setattr(notification_tasks, "messages_collection", coll)
+    return coll
+
+
+def _insert(coll, fingerprint="fp", label="low", minutes_ago=30, service="api"):
+    doc = {
+        "_id": ObjectId(),
+        "content": f"{fingerprint} {label}",
+        "fingerprint": fingerprint,
+        "service": service,
+        "timestamp": datetime.utcnow() - timedelta(minutes=minutes_ago),
+        "sent": False,
+        "analysis": {"label": label},
+    }
+    coll.insert_one(doc)
+    return doc["_id"]
+
+
+def _digest(cutoff, **fields):
+    return {"fingerprint": "fp", "group_by": "fingerprint", "count": 2, "cutoff": cutoff.isoformat(), **fields}
+
+
+def test_digest_group_id():
+    assert digest_group_id("fingerprint", False) == {"fingerprint": "$fingerprint"}
+    assert digest_group_id("cluster_id", True) == {"fingerprint": "$cluster_id", "service": "$service"}
+
+
+def test_highest_severity():
+    assert highest_severity(["low", "high", "medium"]) == "high"
+    assert highest_severity([None, "unknown"]) == "unknown"
+
+
+def test_send_digest_marks_only_its_group_before_cutoff(messages, monkeypatch):
+    delivered = []
+    monkeypatch.setattr(notification_tasks, "deliver", lambda notifications: [delivered.extend(notifications)])
+    members = [_insert(messages), _insert(messages, label="high")]
+    others = [_insert(messages, fingerprint="other"), _insert(messages, minutes_ago=0), _insert(messages, label="critical")]
+
+    result = notification_tasks.send_digest(_digest(datetime.utcnow() - timedelta(minutes=5)))
+
+    assert [n["kind"] for n in delivered] == ["digest"]
+    assert result == {"fingerprint": "fp", "count": 2, "marked_sent": 2}
+    assert all(messages.docs[mid]["sent"] for mid in members)
+    assert not any(messages.docs[mid]["sent"] for mid in others)
+
+
+def test_send_digests_delivers_several_in_one_task(messages, monkeypatch):
+    calls = []
+
+    def deliver(notifications):
+        calls.append([n["fingerprint"] for n in notifications])
+        return [None if n["fingerprint"] != "broken" else "timeout" for n in notifications]
+
+    monkeypatch.setattr(notification_tasks, "deliver", deliver)
+    fp, other, broken = _insert(messages), _insert(messages, fingerprint="other"), _insert(messages, fingerprint="broken")
+    cutoff = datetime.utcnow()
+    ops = messages.ops
+
+    result = notification_tasks.send_digests([
+        _digest(cutoff), _digest(cutoff, fingerprint="other"), _digest(cutoff, fingerprint="broken"),
+    ])
+
+    assert calls == [["fp", "other", "broken"]]
+    assert messages.ops - ops == 1
+    assert result == {"sent": 2, "failed": 1, "marked_sent": 2}
+    assert messages.docs[fp]["sent"] and messages.docs[other]["sent"]
+    assert messages.docs[broken]["sent"] is False
+
+
+def test_send_digest_by_service(messages, monkeypatch):
+    monkeypatch.setattr(notification_tasks, "deliver", lambda notifications: [None])
+    api, worker = _insert(messages), _insert(messages, service="worker")
+
+    notification_tasks.send_digest(_digest(datetime.utcnow(), service="worker"))
+
+    assert messages.docs[api]["sent"] is False
+    assert messages.docs[worker]["sent"] is True
+
+
+def test_failed_digest_marks_nothing(messages, monkeypatch):
+    monkeypatch.setattr(notification_tasks, "deliver", lambda notifications: ["timeout"])
+    member = _insert(messages)
+
+    with pytest.raises(DeliveryError):
+        notification_tasks.send_digest(_digest(datetime.utcnow()))
+
+    assert messages.docs[member]["sent"] is False
+
+
+def test_dispatch_digests_sends_groups_in_chunks(messages, monkeypatch):
+    now = datetime.utcnow()
+    groups = [
+        {"_id": {"fingerprint": "fp"}, "count": 3, "first_seen": now, "last_seen": now,
+         "sample": "db down", "labels": ["low", "high"]},
+        {"_id": {"fingerprint": "other"}, "count": 1, "first_seen": now, "last_seen": now,
+         "sample": "disk", "labels": ["medium"]},
+        {"_id": {"fingerprint": "third"}, "count": 2, "first_seen": now, "last_seen": now,
+         "sample": "cache", "labels": ["low"]},
+    ]
+    sent = []
+    monkeypatch.setattr(messages, "aggregate", lambda pipeline: iter(groups), raising=False)
+    monkeypatch.setattr(notification_tasks.send_digests, "apply_async", lambda args: sent.append(args[0]))
+    monkeypatch.setattr(notification_tasks, "DIGEST_GROUP_BY_SERVICE", False)
+    monkeypatch.setattr(notification_tasks, "DISPATCH_CHUNK_SIZE", 2)
+
+    result = notification_tasks._dispatch_digests(now)
+
+    assert result == {"dispatched_non_critical": 6, "digests": 3, "chunks": 2}
+    assert [[(d["fingerprint"], d["severity"], d["count"]) for d in chunk] for chunk in sent] == [
+        [("fp", "high", 3), ("other", "medium", 1)],
+        [("third", "low", 2)],
+    ]
@@ -0,0 +1,124 @@
+# tests/test_dispatch.py
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import api.indexes as api_indexes
+import notification_service.tasks as notification_tasks
+from notification_service.rules import chunked
+from tests.memory_store import MemoryCollection
+
+
+@pytest.fixture
+def migrations(monkeypatch):
+    coll = MemoryCollection()
+    monkeypatch.setattr(api_indexes, "get_sync_migrations_collection", lambda: coll)
+    monkeypatch.setattr(notification_tasks, "_sent_backfilled", False)
+    return coll
+
+
+@pytest.fixture
+def messages(monkeypatch, migrations):
+    coll = MemoryCollection()
+    monkeypatch.setattr(notification_tasks, "messages_collection", coll)
+    return coll
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    calls = []
+    monkeypatch.setattr(notification_tasks, "DISPATCH_MODE", "batch")
+    monkeypatch.setattr(notification_tasks.send_batch, "apply_async", lambda args: calls.append(args[0]))
+    return calls
+
+
+def _insert(coll, label="low", minutes_ago=30, sent=False):
+    doc = {
+        "_id": ObjectId(),
+        "content": f"{label} message",
+        "timestamp": datetime.utcnow() - timedelta(minutes=minutes_ago),
+        "sent": sent,
+        "analysis": {"label": label},
+    }
+    coll.insert_one(doc)
+    return doc["_id"]
+
+
+def test_chunked_splits_without_empty_tail():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked(range(4), 2)) == [[0, 1], [2, 3]]
+    assert list(chunked([], 2)) == []
+
+
+def test_dispatch_sends_pending_non_critical_in_chunks(messages, batches, monkeypatch):
+    monkeypatch.setattr(notification_tasks, "DISPATCH_CHUNK_SIZE", 2)
+    pending = {str(_insert(messages)) for _ in range(5)}
+    _insert(messages, label="critical")
+    _insert(messages, sent=True)
+    _insert(messages, minutes_ago=0)
+
+    result = notification_tasks.dispatch_non_critical()
+
+    assert result == {"dispatched_non_critical": 5, "chunks": 3}
+    assert [len(chunk) for chunk in batches] == [2, 2, 1]
+    assert {mid for chunk in batches for mid in chunk} == pending
+
+
+def test_send_batch_leaves_failed_deliveries_unsent(messages, monkeypatch):
+    first, second = _insert(messages), _insert(messages)
+    monkeypatch.setattr(
+        notification_tasks, "deliver",
+        lambda notifications: [None if n["id"] == str(first) else "timeout" for n in notifications],
+    )
+
+    result = notification_tasks.send_batch([str(first), str(second)])
+
+    assert result == {"sent": 1, "failed": 1, "requested": 2}
+    assert messages.docs[first]["sent"] is True
+    assert messages.docs[second]["sent"] is False
+
+
+def test_send_batch_skips_already_sent(messages, monkeypatch):
+    sent = _insert(messages, sent=True)
+    delivered = []
+    monkeypatch.setattr(
+        notification_tasks, "deliver",
+        lambda notifications: [delivered.append(n["id"]) for n in notifications],
+    )
+
+    result = notification_tasks.send_batch([str(sent)])
+
+    assert delivered == []
+    assert result == {"sent": 0, "failed": 0, "requested": 1}
+
+
+def test_backfill_sent_in_batches_then_records_a_marker(messages, migrations):
+    legacy = [_insert(messages) for _ in range(3)]
+    for mid in legacy:
+        del messages.docs[mid]["sent"]
+
+    assert api_indexes.backfill_sent(2, messages) is False
+    assert api_indexes.backfill_sent(2, messages) is True
+    assert all(messages.docs[mid]["sent"] is False for mid in legacy)
+    assert api_indexes.SENT_BACKFILL_MARKER in migrations.docs
+
+    ops = messages.ops
+    assert api_indexes.backfill_sent(2, messages) is True
+    assert messages.ops == ops
+
+
+def test_dispatch_backfills_messages_stored_without_sent(messages, batches, monkeypatch):
+    legacy = _insert(messages)
+    del messages.docs[legacy]["sent"]
+
+    result = notification_tasks.dispatch_non_critical()
+
+    assert result["dispatched_non_critical"] == 1
+    assert batches == [[str(legacy)]]
+    assert notification_tasks._sent_backfilled is True
@@ -0,0 +1,25 @@
+# tests/test_indexes.py
+
+import os
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from api.indexes import MESSAGES_INDEXES, _changed_indexes
+
+
+def test_cluster_index_is_partial():
+    (model,) = [m for m in MESSAGES_INDEXES if m.document["name"] == "cluster_id_created_at"]
+
+    assert "sparse" not in model.document
+    assert model.document["partialFilterExpression"] == {"cluster_id": {"$exists": True}}
+
+
+def test_indexes_with_changed_options_are_replaced():
+    existing = {
+        "_id_": {"key": [("_id", 1)]},
+        "fingerprint_created_at": {"key": [("fingerprint", 1), ("created_at", 1)]},
+        "cluster_id_created_at": {"key": [("cluster_id", 1), ("created_at", 1)], "sparse": True},
+        "unsent_timestamp": {"key": [("timestamp", 1)], "partialFilterExpression": {"sent": False}},
+    }
+
+    assert _changed_indexes(existing, MESSAGES_INDEXES) == ["cluster_id_created_at"]
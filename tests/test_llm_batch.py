@@ -0,0 +1,132 @@
+# tests/test_llm_batch.py
+
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from ai import fake_client, llm_batch, prompting, providers
+from ai.configs import candidate_labels, system_prompt
+from ai.rate_limit import ProviderRetryableError
+
+
+@pytest.fixture(autouse=True)
+def reset_fake(monkeypatch):
+    monkeypatch.setattr(fake_client, "requests", 0)
+    monkeypatch.setattr(fake_client, "FAKE_LLM_DROP_EVERY", 0)
+
+
+def test_entries_are_numbered_single_lines():
+    text = llm_batch.entries(["first\nline", "  second  "])
+    assert text == "[0] first line\n[1] second"
+
+
+def test_parse_results_matches_by_index_and_validates_labels():
+    payload = json.dumps([
+        {"index": 2, "severity": "Critical"},
+        {"index": 0, "severity": "low"},
+        {"index": 1, "severity": "catastrophic"},
+        {"index": 7, "severity": "high"},
+    ])
+    parsed = llm_batch.parse_results(payload, 3, candidate_labels)
+    assert parsed[0]["severity"] == "low"
+    assert parsed[1] is None
+    assert parsed[2]["severity"] == "critical"
+
+
+def test_parse_results_drops_repeated_indices_and_bad_payloads():
+    payload = '```json\n[{"index": 0, "severity": "low"}, {"index": 0, "severity": "high"}]\n```'
+    assert llm_batch.parse_results(payload, 1, candidate_labels) == [None]
+    assert llm_batch.parse_results("not json at all", 2, candidate_labels) == [None, None]
+
+
+def test_parse_results_accepts_wrapped_and_bare_arrays():
+    wrapped = json.dumps({"results": [{"index": 0, "severity": "medium"}]})
+    assert llm_batch.parse_results(wrapped, 1, candidate_labels)[0]["severity"] == "medium"
+    bare = json.dumps(["low", "high"])
+    assert [r["severity"] for r in llm_batch.parse_results(bare, 2, candidate_labels)] == ["low", "high"]
+
+
+def test_batch_uses_one_request_per_batch():
+    contents = ["Database is down for all users", "Slow query warning", "User typed a wrong password"]
+    analyses = providers.classify_batch("fake", contents)
+
+    assert fake_client.requests == 1
+    assert [a["label"] for a in analyses] == ["critical", "medium", "low"]
+    assert all(a["provider"] == "fake" for a in analyses)
+
+
+def test_batch_falls_back_per_item_for_missing_entries(monkeypatch):
+    monkeypatch.setattr(fake_client, "FAKE_LLM_DROP_EVERY", 2)
+    contents = ["Upstream timeout on /pay", "Service unavailable", "cache miss", "Replica lag growing"]
+    analyses = fake_client.classify_severity_batch(contents, system_prompt=system_prompt, labels=candidate_labels)
+
+    # one batched request plus single calls for entries 1 and 3
+    assert fake_client.requests == 3
+    assert [a["label"] for a in analyses] == ["high", "critical", "low", "medium"]
+    assert analyses[0]["raw"] == {"batch_size": 4, "index": 0}
+    assert analyses[1]["raw"] == {"severity": "critical"}
+
+
+def test_batch_matches_single_message_results():
+    contents = ["Transaction rollback due to deadlock", "Memory pressure during ETL job", "404 for missing user"]
+    single = [providers.classify_with_fake(content)["label"] for content in contents]
+    batched = [analysis["label"] for analysis in providers.classify_batch("fake", contents)]
+    assert batched == single
+
+
+def test_prompt_sends_instructions_once_and_caps_content(monkeypatch):
+    monkeypatch.setattr(prompting, "PROMPT_MAX_CONTENT_TOKENS", 50)
+    long_content = "start " + "x" * 1000 + " the actual error"
+    user = prompting.user_message(long_content)
+
+    assert system_prompt.strip() not in user
+    assert prompting.SYSTEM_PROMPT.startswith(system_prompt.strip())
+    assert user.endswith("the actual error")
+    assert len(user) < 300 and "chars omitted" in user
+
+
+def test_stats_snippet_only_when_enabled(monkeypatch):
+    stats = {"windows": {"24h": {"count": 12, "labels_distribution": {"high": 3}}, "1h": {"count": 2}}}
+    assert "Historical stats" not in prompting.user_message("boom", stats)
+    monkeypatch.setattr(prompting, "PROMPT_INCLUDE_STATS", True)
+    assert "count=12" in prompting.user_message("boom", stats)
+    assert "count=12" in prompting.entry("boom", stats)
+
+
+def test_usage_is_recorded_on_analysis():
+    single = providers.classify_with_fake("Replica lag growing")
+    batched = providers.classify_batch("fake", ["Replica lag growing", "cache miss"])
+
+    assert single["usage"]["input_tokens"] > 0
+    assert batched[0]["usage"]["batch_size"] == 2
+    assert batched[0]["usage"]["input_tokens"] < single["usage"]["input_tokens"] * 2
+
+
+def test_batch_prompt_asks_only_for_an_array():
+    batch = llm_batch.instructions(prompting.BATCH_SYSTEM_PROMPT, candidate_labels)
+
+    assert "JSON object" not in batch
+    assert "JSON array" in batch
+    assert "JSON object" in prompting.SYSTEM_PROMPT
+
+
+def test_throttled_fallback_carries_the_answered_entries():
+    def throttled(index):
+        raise ProviderRetryableError("rate limited")
+
+    with pytest.raises(ProviderRetryableError) as info:
+        llm_batch.classify_batch(
+            ["Database is down", "Slow query", "Disk is full"],
+            send=lambda instructions, entries: ('[{"index": 0, "severity": "critical"}]', {}),
+            classify_one=throttled,
+            system_prompt=prompting.BATCH_SYSTEM_PROMPT,
+            labels=candidate_labels,
+            provider="fake",
+        )
+
+    partial = info.value.partial
+    assert partial[0]["label"] == "critical"
+    assert partial[1:] == [None, None]
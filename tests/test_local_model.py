@@ -0,0 +1,60 @@
+# tests/test_local_model.py
+
+from pathlib import Path
+
+from ai import dataset, local_model
+from ai.configs import candidate_labels
+
+DATASET_PATH = Path(__file__).resolve().parents[1] / "data_set.csv"
+
+ROW = {"service": "Auth", "text": " Database connection refused. ", "expected_label": "critical",
+       "count_1h": "6", "count_24h": "54"}
+
+
+def test_message_text_is_the_stored_content():
+    assert dataset.message_text(ROW) == "Database connection refused."
+
+
+def test_every_dataset_row_loads_with_its_label():
+    rows = dataset.load_rows(str(DATASET_PATH))
+    texts, labels = local_model.csv_examples(str(DATASET_PATH))
+
+    assert len(rows) == len(texts) == 108
+    assert set(labels) <= set(candidate_labels)
+    assert all(row["count_1h"].isdigit() and row["count_24h"].isdigit() for row in rows)
+
+
+def test_unquoted_commas_stay_in_the_text(tmp_path):
+    path = tmp_path / "data_set.csv"
+    path.write_text(
+        "service,text,expected_label,count_1h,count_24h\n"
+        "Payments,Cache miss, fallback to DB.,Medium,3,20\n"
+        'Auth,"Quoted, text.",low,1,2\n'
+    )
+
+    rows = dataset.load_rows(str(path))
+
+    assert [(row["text"], row["expected_label"], row["count_24h"]) for row in rows] == [
+        ("Cache miss, fallback to DB.", "medium", "20"),
+        ("Quoted, text.", "low", "2"),
+    ]
+
+
+def test_model_trained_on_csv_rows_classifies_stored_content():
+    rows = [ROW, dict(ROW, text="User login failed due to wrong password.", expected_label="low")]
+    model = local_model.train([dataset.message_text(row) for row in rows], [row["expected_label"] for row in rows])
+
+    assert model.classify("Database connection refused.")["label"] == "critical"
+    assert model.classify("User login failed due to wrong password.")["label"] == "low"
+
+
+def test_retrained_model_gets_a_new_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_model, "LOCAL_MODEL_PATH", str(tmp_path / "local_model.npz"))
+    ids = []
+    for label in ("critical", "low"):
+        local_model.train([dataset.message_text(ROW)], [label]).save(local_model.LOCAL_MODEL_PATH)
+        monkeypatch.setattr(local_model, "_model", None)
+        ids.append(local_model.model_id())
+
+    assert ids[0] != ids[1]
+    assert all(model_id.startswith("local_model.npz:") for model_id in ids)
@@ -0,0 +1,66 @@
+# tests/test_model_metrics.py
+
+import os
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from ai.configs import candidate_labels
+from tests import model_metrics
+
+
+def test_dataset_labels_are_all_candidates():
+    rows = model_metrics.load_dataset()
+
+    assert len(rows) == 108
+    assert {row["expected_label"] for row in rows} <= set(candidate_labels)
+
+
+def test_providers_are_scored_on_the_training_text(monkeypatch):
+    seen = []
+
+    def classify(provider, message):
+        seen.append(message)
+        return "low", None, 0.0
+
+    monkeypatch.setattr(model_metrics, "_classify_timed", classify)
+    rows = [{"service": "Auth", "text": "Login failed.", "expected_label": "low", "count_1h": "6", "count_24h": "54"}]
+
+    run = model_metrics.evaluate_provider(rows, "fake", workers=1)
+
+    assert seen == ["Login failed."]
+    assert (run.y_true, run.y_pred) == (["low"], ["low"])
+
+
+def test_compare_modes_uses_each_mode_without_touching_the_default(monkeypatch):
+    from ai import bert_model
+
+    def pipeline(label):
+        def classify(text, candidate_labels, hypothesis_template):
+            return {"labels": [label], "scores": [1.0]}
+        return classify
+
+    def no_onnx():
+        raise RuntimeError("no optimum")
+
+    # cached pipelines: get_classifier never imports transformers
+    monkeypatch.setattr(bert_model, "_classifiers", {"default": pipeline("low"), "int8": pipeline("high")})
+    monkeypatch.setattr(bert_model, "_onnx_pipeline", no_onnx)
+    default_mode = bert_model.HF_INFERENCE_MODE
+    rows = [{"service": "db", "text": "Disk full", "expected_label": "high", "count_1h": "1", "count_24h": "1"}]
+
+    report = model_metrics.compare_modes(rows, ["default", "int8", "onnx"]).splitlines()
+
+    assert report[2].split()[:4] == ["default", "0.000", "0.000", "1.000"]
+    assert report[3].split()[:4] == ["int8", "0.250", "1.000", "0.000"]
+    assert report[4] == "onnx     unavailable: no optimum"
+    assert bert_model.HF_INFERENCE_MODE == default_mode
+
+
+def test_cached_huggingface_analyses_are_keyed_by_mode(monkeypatch):
+    from ai import providers
+
+    monkeypatch.delenv("HF_INFERENCE_MODE", raising=False)
+    default_name = providers.model_name("huggingface")
+    monkeypatch.setenv("HF_INFERENCE_MODE", "int8")
+
+    assert providers.model_name("huggingface") == f"{default_name}:int8"
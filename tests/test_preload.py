@@ -0,0 +1,43 @@
+# tests/test_preload.py
+
+import sys
+
+import pytest
+
+from ai import preload
+
+FAKE_TORCH = """
+threads = []
+def set_num_threads(n):
+    threads.append(n)
+def set_num_interop_threads(n):
+    pass
+"""
+
+
+@pytest.fixture
+def fake_torch(tmp_path, monkeypatch):
+    # an importable `torch` that is not imported yet, like a fresh worker child
+    (tmp_path / "torch.py").write_text(FAKE_TORCH)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "torch", raising=False)
+    yield
+    sys.modules.pop("torch", None)
+
+
+def test_child_applies_configured_threads_before_torch_is_imported(fake_torch, monkeypatch):
+    monkeypatch.setenv("TORCH_NUM_THREADS", "2")
+
+    preload._configure_child()
+
+    assert sys.modules["torch"].threads == [2]
+
+
+def test_child_does_not_import_torch_without_configured_threads(fake_torch, monkeypatch):
+    monkeypatch.delenv("TORCH_NUM_THREADS", raising=False)
+    monkeypatch.setattr(preload, "HF_PRELOAD", True)
+    monkeypatch.setattr(preload, "_worker_concurrency", 4)
+
+    preload._configure_child()
+
+    assert "torch" not in sys.modules
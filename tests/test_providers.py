@@ -0,0 +1,47 @@
+# tests/test_providers.py
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from ai import providers
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+
+def test_every_provider_is_registered():
+    assert providers.available() == ["cascade", "fake", "gemini", "huggingface", "local", "openai"]
+
+
+def test_unknown_provider_falls_back_to_huggingface():
+    assert providers.get_classifier("nope") is providers.get_classifier("huggingface")
+
+
+def test_stats_reach_only_stats_aware_providers(monkeypatch):
+    seen = {}
+    monkeypatch.setitem(providers._registry, "fake", lambda content, stats=None: seen.setdefault("fake", stats))
+    monkeypatch.setitem(providers._registry, "local", lambda content: seen.setdefault("local", content))
+
+    providers.classify("fake", "db down", {"windows": {}})
+    providers.classify("local", "db down", {"windows": {}})
+
+    assert seen == {"fake": {"windows": {}}, "local": "db down"}
+
+
+def test_classifying_imports_only_the_selected_client():
+    code = (
+        "import sys\n"
+        "from ai import providers\n"
+        "print(providers.classify('fake', 'Database is down')['label'])\n"
+        "heavy = ['torch', 'transformers', 'openai', 'google.generativeai', 'ai.bert_model', 'ai.openai_client']\n"
+        "print(sorted(name for name in heavy if name in sys.modules))\n"
+    )
+    env = dict(os.environ, FAKE_LLM_LATENCY_MS="0")
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout.splitlines()
+
+    assert output == ["critical", "[]"]
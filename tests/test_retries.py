@@ -0,0 +1,108 @@
+# tests/test_retries.py
+
+import os
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import ai.tasks as ai_tasks
+from ai import rate_limit
+from ai.rate_limit import ProviderRetryableError, backoff_delay
+from tests.memory_store import MemoryCollection
+
+
+class Retry(Exception):
+    pass
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    coll = MemoryCollection()
+    monkeypatch.setattr(ai_tasks, "get_sync_messages_collection", lambda: coll)
+    monkeypatch.setattr(ai_tasks, "get_sync_rollups_collection", lambda: MemoryCollection())
+    monkeypatch.setattr(ai_tasks.providers, "selected_provider", lambda: "fake")
+    monkeypatch.setattr(ai_tasks.batching, "enabled", lambda provider: False)
+    monkeypatch.setattr(ai_tasks.classification_cache, "get", lambda *args: None)
+    monkeypatch.setattr(ai_tasks.classification_cache, "put", lambda *args: None)
+    monkeypatch.setattr(ai_tasks, "schedule_immediate_if_critical", lambda *args: False)
+    return coll
+
+
+@pytest.fixture
+def retries(monkeypatch):
+    calls = []
+
+    def fake_retry(exc=None, countdown=None, **kwargs):
+        calls.append(countdown)
+        return Retry()
+
+    monkeypatch.setattr(ai_tasks.analyze_message, "retry", fake_retry)
+    return calls
+
+
+def _insert(coll, content="Database is down"):
+    doc = {"_id": ObjectId(), "content": content, "fingerprint": "fp", "created_at": datetime.utcnow()}
+    coll.insert_one(doc)
+    return doc["_id"]
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(rate_limit, "BACKOFF_BASE_SECONDS", 2.0)
+    monkeypatch.setattr(rate_limit, "BACKOFF_MAX_SECONDS", 30.0)
+
+    for retries, (low, high) in enumerate([(1, 2), (2, 4), (4, 8), (8, 16), (15, 30), (15, 30)]):
+        delays = [backoff_delay(retries) for _ in range(50)]
+        assert all(low <= delay <= high for delay in delays)
+
+
+def test_backoff_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limit, "BACKOFF_MAX_SECONDS", 30.0)
+
+    assert backoff_delay(0, retry_after=45) == 45
+
+
+def test_throttled_message_is_retried_with_backoff(messages, retries, monkeypatch):
+    def throttled(provider, content, stats=None):
+        raise ProviderRetryableError("rate limited", retry_after=7)
+
+    monkeypatch.setattr(ai_tasks.providers, "classify", throttled)
+    monkeypatch.setattr(ai_tasks, "backoff_delay", lambda retries, retry_after=None: max(3.0, retry_after or 0))
+    message_id = _insert(messages)
+
+    with pytest.raises(Retry):
+        ai_tasks.analyze_message(str(message_id))
+
+    assert retries == [7]
+    assert "analysis" not in messages.docs[message_id]
+
+
+def test_exhausted_retries_store_unknown(messages, retries, monkeypatch):
+    def throttled(provider, content, stats=None):
+        raise ProviderRetryableError("rate limited")
+
+    monkeypatch.setattr(ai_tasks.providers, "classify", throttled)
+    message_id = _insert(messages)
+
+    result = ai_tasks.analyze_message(str(message_id), attempt=ai_tasks.LLM_MAX_RETRIES)
+
+    assert retries == []
+    assert result["analysis"]["label"] == "unknown"
+    assert messages.docs[message_id]["analysis"]["error"] == "rate limited"
+
+
+def test_exhausted_retries_store_the_fallback(messages, retries, monkeypatch):
+    fallback = {"label": "warning", "tier": "local", "escalation_skipped": "throttled"}
+
+    def throttled(provider, content, stats=None):
+        raise ProviderRetryableError("rate limited", fallback=fallback)
+
+    monkeypatch.setattr(ai_tasks.providers, "classify", throttled)
+    message_id = _insert(messages)
+
+    ai_tasks.analyze_message(str(message_id), attempt=ai_tasks.LLM_MAX_RETRIES)
+
+    assert messages.docs[message_id]["analysis"] == fallback
@@ -0,0 +1,89 @@
+# tests/test_rollups.py
+
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+from api import rollups
+from tests.memory_store import MemoryCollection
+
+CREATED_AT = datetime(2026, 10, 1, 12, 34, 56)
+WINDOWS = {"1h": timedelta(hours=1), "24h": timedelta(hours=24), "7d": timedelta(days=7)}
+
+
+def _message(**fields):
+    doc = {"_id": ObjectId(), "fingerprint": "fp", "content": "db down", "created_at": CREATED_AT}
+    doc.update(fields)
+    return doc
+
+
+def test_label_ops_upsert_the_same_bucket_as_ingest():
+    ingested, labelled = MemoryCollection(), MemoryCollection()
+    ingested.bulk_write(rollups.ingest_ops([_message()]))
+
+    labelled.bulk_write(rollups.label_ops("fp", CREATED_AT, "critical"))
+
+    for bucket_id, bucket in labelled.docs.items():
+        expected = ingested.docs[bucket_id]
+        for field in ("fingerprint", "granularity", "bucket", "expires_at"):
+            assert bucket[field] == expected[field]
+        assert bucket["labels"] == {"critical": 1}
+
+
+def test_labels_are_recorded_only_for_the_first_analysis(monkeypatch):
+    import ai.tasks as ai_tasks
+
+    buckets = MemoryCollection()
+    monkeypatch.setattr(ai_tasks, "get_sync_rollups_collection", lambda: buckets)
+    fresh, analysed = _message(), _message(analysis={"label": "low"})
+    analyses = {str(doc["_id"]): {"label": "critical"} for doc in (fresh, analysed)}
+
+    ai_tasks._record_labels([fresh, analysed], analyses)
+
+    assert {bucket["granularity"]: bucket["labels"] for bucket in buckets.docs.values()} == {
+        "minute": {"critical": 1},
+        "hour": {"critical": 1},
+    }
+
+
+def test_window_bounds_align_to_the_bucket_size():
+    now = datetime(2026, 10, 1, 12, 34, 56)
+
+    bounds = rollups.window_bounds(now, {"1h": timedelta(hours=1), "24h": timedelta(hours=24)})
+
+    assert bounds == {"1h": datetime(2026, 10, 1, 11, 34), "24h": datetime(2026, 9, 30, 12, 0)}
+
+
+def test_ingest_ops_fold_messages_into_one_upsert_per_bucket():
+    docs = [
+        _message(service="auth"),
+        _message(service="auth", created_at=CREATED_AT + timedelta(seconds=2)),
+        _message(service="billing", created_at=CREATED_AT + timedelta(minutes=3)),
+    ]
+
+    ops = rollups.ingest_ops(docs)
+
+    # two minute buckets and one hour bucket
+    assert len(ops) == 3
+    hour = next(op for op in ops if ":hour:" in op._filter["_id"])
+    assert hour._upsert
+    assert hour._doc["$inc"] == {"count": 3, "services.auth": 2, "services.billing": 1}
+    assert hour._doc["$max"] == {"last_seen": CREATED_AT + timedelta(minutes=3)}
+
+
+def test_rollup_stats_count_each_window():
+    buckets = MemoryCollection()
+    now = CREATED_AT + timedelta(hours=2)
+    docs = [_message(), _message(created_at=now - timedelta(minutes=10)), _message(created_at=now - timedelta(days=3))]
+    buckets.bulk_write(rollups.ingest_ops(docs))
+    buckets.bulk_write(rollups.label_ops("fp", now - timedelta(minutes=10), "critical"))
+
+    result = rollups.build_stats_from_rollups("fp", now, WINDOWS, collection=buckets)
+
+    assert {key: window["count"] for key, window in result["windows"].items()} == {"1h": 1, "24h": 2, "7d": 3}
+    assert result["windows"]["1h"]["labels_distribution"] == {"critical": 1}
+    assert result["last_seen_at"] == now - timedelta(minutes=10)
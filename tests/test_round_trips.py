@@ -0,0 +1,78 @@
+# tests/test_round_trips.py
+
+import os
+from datetime import datetime
+
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import ai.tasks as ai_tasks
+import notification_service.tasks as notification_tasks
+from tests.memory_store import MemoryCollection
+
+DB_METHODS = {
+    "find", "find_one", "find_one_and_update", "insert_one", "insert_many",
+    "update_one", "update_many", "bulk_write", "aggregate",
+}
+
+
+class CountingCollection:
+    def __init__(self, inner, calls):
+        self._inner = inner
+        self.calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if name not in DB_METHODS:
+            return attr
+
+        def wrapper(*args, **kwargs):
+            self.calls.append(name)
+            return attr(*args, **kwargs)
+        return wrapper
+
+
+def test_critical_message_round_trips(monkeypatch):
+    raw = MemoryCollection()
+    message_id = str(raw.insert_one({
+        "service": "db",
+        "level": "critical",
+        "content": "Database connection failure",
+        "fingerprint": "fp",
+        "created_at": datetime.utcnow(),
+        "timestamp": datetime.utcnow(),
+        "sent": False,
+    }).inserted_id)
+
+    ops = raw.ops
+    calls = []
+    counting = CountingCollection(raw, calls)
+    monkeypatch.setattr(ai_tasks, "get_sync_messages_collection", lambda: counting)
+    monkeypatch.setattr(ai_tasks, "get_sync_rollups_collection", lambda: MemoryCollection())
+    monkeypatch.setattr(ai_tasks.batching, "enabled", lambda provider: False)
+    monkeypatch.setattr(notification_tasks, "messages_collection", counting)
+    monkeypatch.setattr(ai_tasks, "_classify_message", lambda content, fingerprint=None, stats=None: {
+        "label": "critical", "provider": "test",
+    })
+
+    ops_before_notifier = []
+    sent = []
+
+    def fake_apply_async(args=None, kwargs=None, **options):
+        ops_before_notifier.append(len(calls))
+        sent.append(notification_tasks.send_message(*(args or []), **(kwargs or {})))
+
+    monkeypatch.setattr(notification_tasks.send_message, "apply_async", fake_apply_async)
+
+    ai_tasks.analyze_message(message_id)
+
+    assert sent == [{"id": message_id, "sent": True}]
+    assert ops_before_notifier == [2]
+    assert calls == ["find_one", "update_one", "update_one"]
+    assert raw.ops - ops == 3
+
+    doc = raw.find_one({"_id": ObjectId(message_id)})
+    assert doc["analysis"]["label"] == "critical"
+    assert doc["sent"] is True
@@ -0,0 +1,56 @@
+# tests/test_rules.py
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from notification_service.rules import dispatch_cutoff, is_critical, pending_non_critical_filter
+from tests.memory_store import matches
+from tests.notification_simulator import generate_events, simulate
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+def _templates():
+    return [
+        {"service": "db", "text": "database down", "label": "critical", "count_1h": 2, "count_24h": 4},
+        {"service": "db", "text": "slow query", "label": "low", "count_1h": 10, "count_24h": 40},
+        {"service": "web", "text": "cache miss", "label": "medium", "count_1h": 5, "count_24h": 20},
+    ]
+
+
+def test_is_critical():
+    assert is_critical({"label": "critical"})
+    assert not is_critical({"label": "high"})
+    assert not is_critical(None)
+
+
+def test_dispatch_cutoff_lags_by_one_interval():
+    assert dispatch_cutoff(NOW, 5) == NOW - timedelta(minutes=5)
+
+
+@pytest.mark.parametrize("doc, pending", [
+    ({"sent": False, "analysis": {"label": "low"}, "timestamp": NOW - timedelta(minutes=10)}, True),
+    ({"sent": False, "timestamp": NOW - timedelta(minutes=10)}, True),
+    ({"sent": False, "analysis": {"label": "critical"}, "timestamp": NOW - timedelta(minutes=10)}, False),
+    ({"sent": True, "analysis": {"label": "low"}, "timestamp": NOW - timedelta(minutes=10)}, False),
+    ({"sent": False, "analysis": {"label": "low"}, "timestamp": NOW}, False),
+])
+def test_pending_non_critical_filter(doc, pending):
+    assert matches(doc, pending_non_critical_filter(dispatch_cutoff(NOW, 5))) is pending
+
+
+def test_simulated_dispatch_sends_everything_once():
+    events = generate_events(_templates(), scale=1, days=2, seed=0)
+
+    batch = simulate(events, "batch", interval=5, analysis_delay=0)
+    digest = simulate(events, "digest", interval=5, analysis_delay=0)
+
+    assert len(events["ts"]) == 128
+    for result in (batch, digest):
+        assert result["unsent"] == 0
+        assert result["duplicates"] == 0
+        assert result["critical_delay_sec"]["max"] == pytest.approx(0.5)
+        assert result["delay_sec"]["max"] <= 10 * 60 + 0.5
+    assert batch["notifications"] == len(events["ts"])
+    assert digest["notifications"] < batch["notifications"]
@@ -0,0 +1,85 @@
+# tests/test_send_retries.py
+
+import asyncio
+import os
+
+import pytest
+from bson import ObjectId
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+os.environ.setdefault("REDIS_URL", "memory://")
+
+import notification_service.tasks as notification_tasks
+from notification_service import transports
+from notification_service.transports import DeliveryError, Transport
+from tests.memory_store import MemoryCollection
+
+
+class FlakyTransport(Transport):
+    """Two destinations; `b` fails the first `failures` sends."""
+
+    def __init__(self, failures=1):
+        super().__init__(retries=0)
+        self.failures = failures
+        self.sent = []
+
+    def destinations(self):
+        return ["a", "b"]
+
+    async def _send_to(self, destination, notification):
+        if destination == "b" and self.failures:
+            self.failures -= 1
+            raise DeliveryError("b is down")
+        self.sent.append(destination)
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    coll = MemoryCollection()
+    monkeypatch.setattr(notification_tasks, "messages_collection", coll)
+    return coll
+
+
+class Retry(Exception):
+    pass
+
+
+@pytest.fixture
+def retries(monkeypatch):
+    calls = []
+
+    def fake_retry(exc=None, countdown=None, kwargs=None):
+        calls.append(kwargs)
+        return Retry()
+
+    monkeypatch.setattr(notification_tasks.send_message, "retry", fake_retry)
+    return calls
+
+
+def test_failed_destination_does_not_stop_the_others():
+    transport = FlakyTransport()
+
+    with pytest.raises(DeliveryError) as raised:
+        asyncio.run(transport.send({"kind": "message"}))
+
+    assert raised.value.delivered == ["a"]
+    assert asyncio.run(transport.send({"kind": "message"}, skip=["a"])) == ["b"]
+    assert transport.sent == ["a", "b"]
+
+
+def test_send_message_retries_only_failed_destinations(messages, retries, monkeypatch):
+    transport = FlakyTransport()
+    monkeypatch.setattr(transports, "get_transport", lambda: transport)
+    message_id = ObjectId()
+    messages.insert_one({"_id": message_id, "content": "db down", "sent": False})
+
+    with pytest.raises(Retry):
+        notification_tasks.send_message(str(message_id), content="db down", severity="critical")
+    assert retries == [{"content": "db down", "severity": "critical", "delivered_to": ["a"]}]
+    assert messages.docs[message_id]["sent"] is False
+
+    result = notification_tasks.send_message(str(message_id), **retries[0])
+
+    assert result == {"id": str(message_id), "sent": True}
+    assert transport.sent == ["a", "b"]
+    assert messages.docs[message_id]["sent"] is True
@@ -0,0 +1,53 @@
+# tests/test_similarity.py
+
+import os
+
+import pytest
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from api import similarity
+from tests.memory_store import MemoryCollection
+
+LINE = "connection to db-7.internal timed out after 3000 ms"
+VARIANT = "connection to db-9.internal timed out after 5000 ms"
+OTHER = "user 42 uploaded avatar.png"
+
+
+@pytest.fixture
+def clusters(monkeypatch):
+    coll = MemoryCollection()
+    monkeypatch.setattr(similarity, "get_sync_clusters_collection", lambda: coll)
+    return coll
+
+
+def test_similar_lines_share_a_cluster(clusters):
+    assigner = similarity.ClusterAssigner(refresh_seconds=0)
+
+    first = assigner.assign(LINE, "a" * 40)
+
+    assert assigner.assign(VARIANT, "b" * 40) == first
+    assert assigner.assign(OTHER, "c" * 40) == "c" * 40
+    assert set(clusters.docs) == {"a" * 40, "c" * 40}
+
+
+def test_clusters_from_other_processes_are_loaded_once(clusters):
+    other, local = similarity.ClusterAssigner(refresh_seconds=0), similarity.ClusterAssigner(refresh_seconds=0)
+    local.lookup(OTHER)
+    cluster_id = other.assign(LINE, "a" * 40)
+
+    assert local.lookup(VARIANT) == cluster_id
+    # later refreshes return the same document again (`$gte`)
+    local.lookup("nothing like the others")
+    local.lookup("still nothing like the others")
+    assert local.index.clusters == 1
+    assert len(local.index) == 1
+
+
+def test_misses_do_not_read_mongo_before_the_refresh_is_due(clusters):
+    assigner = similarity.ClusterAssigner(refresh_seconds=3600)
+    assigner.lookup(LINE)
+    reads = clusters.ops
+
+    assert assigner.lookup(OTHER) is None
+    assert clusters.ops == reads
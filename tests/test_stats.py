@@ -0,0 +1,94 @@
+# tests/test_stats.py
+
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from api import stats
+from tests.memory_store import MemoryCollection
+
+NOW = datetime(2026, 10, 1, 12, 0, 0)
+
+
+class CannedAggregate:
+    """Records pipelines and answers with one canned `$facet` document."""
+
+    def __init__(self, result):
+        self.result = result
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter([self.result])
+
+
+def test_all_windows_share_one_aggregation():
+    collection = CannedAggregate({})
+    since = {key: NOW - delta for key, delta in stats.TIME_WINDOWS.items()}
+
+    stats.aggregate_window_stats(collection, {"fingerprint": "fp"}, NOW, since)
+
+    assert len(collection.pipelines) == 1
+    match, facets = collection.pipelines[0][0]["$match"], collection.pipelines[0][-1]["$facet"]
+    assert match == {"fingerprint": "fp", "created_at": {"$gte": NOW - timedelta(days=30), "$lte": NOW}}
+    assert {name.split("__")[0] for name in facets} == set(stats.TIME_WINDOWS)
+    assert facets["1h__summary"][0] == {"$match": {"created_at": {"$gte": NOW - timedelta(hours=1)}}}
+
+
+def test_facet_rows_are_shaped_per_window():
+    last_seen = NOW - timedelta(minutes=5)
+    collection = CannedAggregate({
+        "1h__summary": [{"count": 4, "last_seen": last_seen}],
+        "1h__labels": [{"_id": "critical", "count": 3}, {"_id": "low", "count": 1}],
+        "1h__services": [{"_id": "auth", "count": 4}],
+        "1h__ttrs": [{"median": 20.0}],
+        "1h__examples": [{"_id": "m1", "fragment": "db down"}],
+    })
+
+    since = {"1h": NOW - timedelta(hours=1), "24h": NOW - timedelta(hours=24)}
+
+    result = stats.aggregate_window_stats(collection, {"fingerprint": "fp"}, NOW, since)
+
+    hour = result["windows"]["1h"]
+    assert result["last_seen_at"] == last_seen
+    assert hour["count"] == 4
+    assert hour["labels_distribution"] == {"critical": 3, "low": 1}
+    assert hour["top_services"] == [("auth", 4)]
+    assert hour["median_ttr_sec"] == 20.0
+    assert hour["examples"] == [{"id": "m1", "fragment": "db down"}]
+    assert result["windows"]["24h"]["count"] == 0
+    assert result["windows"]["24h"]["median_ttr_sec"] is None
+
+
+def test_pipeline_runs_over_stored_messages():
+    collection = MemoryCollection()
+
+    def message(minutes_ago, ttr=None, **fields):
+        created_at = NOW - timedelta(minutes=minutes_ago)
+        doc = {"fingerprint": "fp", "created_at": created_at, "content": "db down", **fields}
+        if ttr is not None:
+            doc["resolved_at"] = created_at + timedelta(seconds=ttr)
+        collection.insert_one(doc)
+
+    message(5, ttr=30, service="auth", analysis={"label": "critical"})
+    message(10, ttr=10, service="auth", analysis={"label": "critical"})
+    message(20, ttr=20, service="db")
+    message(120, ttr=600, service="db", analysis={"label": "low"})
+    message(3 * 24 * 60, service="")
+    message(1, ttr=1, fingerprint="other")
+    since = {key: NOW - delta for key, delta in stats.TIME_WINDOWS.items()}
+
+    result = stats.aggregate_window_stats(collection, {"fingerprint": "fp"}, NOW, since)
+
+    hour, day, week = (result["windows"][key] for key in ("1h", "24h", "7d"))
+    assert result["last_seen_at"] == NOW - timedelta(minutes=5)
+    assert [hour["count"], day["count"], week["count"]] == [3, 4, 5]
+    assert hour["labels_distribution"] == {"critical": 2}
+    assert day["labels_distribution"] == {"critical": 2, "low": 1}
+    assert hour["top_services"] == [("auth", 2), ("db", 1)]
+    assert week["top_services"] == [("auth", 2), ("db", 2)]
+    assert hour["median_ttr_sec"] == 20.0
+    assert week["median_ttr_sec"] == 25.0
+    assert hour["examples"][0]["fragment"] == "db down"
+    assert result["windows"]["1h"]["top_components"] == []
@@ -0,0 +1,61 @@
+# tests/test_templates.py
+
+import os
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/notification_system_test")
+
+from api.templates import WILDCARD, TemplateMiner, tokenize
+from tests.memory_store import MemoryCollection
+
+
+def test_tokenize_masks_tokens_with_digits():
+    assert tokenize("Timeout after 30s on 10.0.0.1 req=ab12") == ["timeout", "after", WILDCARD, "on", WILDCARD, WILDCARD]
+
+
+def test_variable_positions_generalize_and_keep_the_id():
+    miner = TemplateMiner()
+
+    first = miner.add("login failed for user alice from web")
+    first_id = first.id
+    second = miner.add("login failed for user bob from web")
+
+    assert second is first
+    assert second.id == first_id
+    assert second.text() == f"login failed for user {WILDCARD} from web"
+    assert second.size == 2
+    assert len(miner) == 1
+
+
+def test_dissimilar_lines_get_their_own_templates():
+    miner = TemplateMiner()
+
+    disk = miner.add("disk full on volume data")
+    database = miner.add("database connection refused by primary")
+    short = miner.add("disk full")
+
+    assert len({disk.id, database.id, short.id}) == 3
+    assert len(miner) == 3
+
+
+def test_least_recently_matched_template_is_evicted():
+    miner = TemplateMiner(max_templates=2)
+
+    disk = miner.add("disk full on volume data")
+    miner.add("database connection refused by primary")
+    miner.add("disk full on volume data")
+    miner.add("queue consumer lagging behind producer")
+
+    assert len(miner) == 2
+    assert disk.id in miner._templates
+
+
+def test_workers_sharing_a_collection_converge_on_ids():
+    templates = MemoryCollection()
+    first = TemplateMiner(collection=templates)
+    second = TemplateMiner(collection=templates)
+
+    created = first.add("login failed for user alice from web")
+    found = second.add("login failed for user bob from web")
+
+    assert found.id == created.id
+    assert templates.docs[created.id]["tokens"] == ["login", "failed", "for", "user", WILDCARD, "from", "web"]
@@ -0,0 +1,91 @@
+# tests/test_vector_index.py
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from ai.vector_index import ID_BYTES, VectorIndex
+
+DIM = 16
+
+
+def _vectors(count, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _ids(count):
+    return [str(ObjectId()) for _ in range(count)]
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_append_and_search_finds_the_same_vector(tmp_path, dtype):
+    index = VectorIndex(str(tmp_path), dim=DIM, dtype=dtype)
+    ids, vectors = _ids(50), _vectors(50)
+    index.append(ids, vectors)
+
+    (best_id, similarity), *_ = index.search(vectors[7], k=3)
+
+    assert len(index) == 50
+    assert best_id == ids[7]
+    assert 0.99 <= similarity <= 1.0
+
+
+def test_reopened_index_keeps_rows_and_layout(tmp_path):
+    ids, vectors = _ids(10), _vectors(10)
+    VectorIndex(str(tmp_path), dim=DIM, dtype="float16").append(ids, vectors)
+
+    reopened = VectorIndex(str(tmp_path))
+
+    assert (reopened.dim, reopened.dtype, len(reopened)) == (DIM, "float16", 10)
+    assert reopened.search(vectors[3], k=1)[0][0] == ids[3]
+    with pytest.raises(ValueError):
+        VectorIndex(str(tmp_path), dim=DIM + 1)
+
+
+def test_partial_write_is_dropped_before_the_next_append(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=DIM)
+    ids, vectors = _ids(5), _vectors(5)
+    index.append(ids[:3], vectors[:3])
+    # a crashed writer left half a row and a few id bytes behind
+    with open(tmp_path / "vectors.int8", "ab") as fh:
+        fh.write(b"\x01" * (DIM // 2))
+    with open(tmp_path / "ids.bin", "ab") as fh:
+        fh.write(b"\x02" * (ID_BYTES // 2))
+    assert len(index) == 3
+
+    index.append(ids[3:], vectors[3:])
+
+    assert len(index) == 5
+    assert (tmp_path / "vectors.int8").stat().st_size == 5 * DIM
+    assert (tmp_path / "ids.bin").stat().st_size == 5 * ID_BYTES
+    assert [index.search(v, k=1)[0][0] for v in vectors] == ids
+
+
+def test_trained_ivf_matches_brute_force(tmp_path):
+    ids, vectors = _ids(2000), _vectors(2000)
+    index = VectorIndex(str(tmp_path), dim=DIM, mode="ivf", nprobe=8)
+    index.append(ids[:1500], vectors[:1500])
+
+    assert index.train(lists=16, sample=1500) == 16
+    # appended after training: assigned to lists on the way in
+    index.append(ids[1500:], vectors[1500:])
+    assert (tmp_path / "assign.i32").stat().st_size == 2000 * 4
+
+    queries = _vectors(50, seed=1)
+    exact = vectors @ queries.T
+    recall = []
+    for q, query in enumerate(queries):
+        expected = {ids[i] for i in np.argsort(-exact[:, q])[:5]}
+        found = {message_id for message_id, _ in index.search(query, k=5)}
+        recall.append(len(expected & found) / 5)
+
+    assert np.mean(recall) >= 0.8
+
+
+def test_empty_index_searches_nothing(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=DIM)
+
+    assert index.search(_vectors(1)[0]) == []
+    with pytest.raises(ValueError):
+        index.train()
@@ -0,0 +1,107 @@
+"""Benchmark the similar-incident vector index: brute-force versus IVF search.
+
+Usage:
+    python tests/vector_index_benchmark.py [--rows 1000000] [--dim 384] [--queries 200]
+
+Builds an index in a temporary directory from synthetic clustered unit vectors
+(appended in batches, as the stats task does), trains the IVF lists and
+reports, per storage dtype: disk size, append rate, query latency p50/p99 for
+brute force and IVF, and IVF recall@k against brute force.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from bson import ObjectId
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from ai.vector_index import VECTOR_INDEX_NPROBE, VectorIndex
+
+
+def _vectors(rng: np.random.Generator, centers: np.ndarray, count: int, noise: float) -> np.ndarray:
+    picked = centers[rng.integers(len(centers), size=count)]
+    vectors = picked + rng.normal(scale=noise, size=picked.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) * 1000
+
+
+def _run(dtype: str, args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(args.centers, args.dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as path:
+        index = VectorIndex(path, dim=args.dim, dtype=dtype, nprobe=args.nprobe or VECTOR_INDEX_NPROBE)
+        started = time.perf_counter()
+        for start in range(0, args.rows, args.batch):
+            count = min(args.batch, args.rows - start)
+            index.append([str(ObjectId()) for _ in range(count)], _vectors(rng, centers, count, args.noise))
+        append_rate = args.rows / (time.perf_counter() - started)
+        disk = sum(f.stat().st_size for f in Path(path).iterdir())
+
+        started = time.perf_counter()
+        index.train(lists=args.lists, sample=args.sample)
+        train_sec = time.perf_counter() - started
+
+        queries = _vectors(rng, centers, args.queries, args.noise)
+        results = {}
+        for mode in ("brute", "ivf"):
+            index.mode = mode
+            index.search(queries[0], args.k)  # warm the page cache and the list grouping
+            timings, hits = [], []
+            for query in queries:
+                started = time.perf_counter()
+                hits.append({mid for mid, _ in index.search(query, args.k)})
+                timings.append(time.perf_counter() - started)
+            results[mode] = (timings, hits)
+
+        recall = np.mean([len(ivf & exact) / args.k for ivf, exact in zip(results["ivf"][1], results["brute"][1])])
+        for mode, (timings, _) in results.items():
+            print(
+                f"{dtype:<8} {mode:<6} {disk / 2 ** 20:>9.0f} {append_rate:>12,.0f} {train_sec:>8.1f} "
+                f"{_percentile_ms(timings, 50):>8.2f} {_percentile_ms(timings, 99):>8.2f} "
+                f"{recall if mode == 'ivf' else 1.0:>9.3f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=1000, help="rows per append")
+    parser.add_argument("--centers", type=int, default=5000, help="synthetic incident kinds")
+    parser.add_argument("--noise", type=float, default=0.04)
+    parser.add_argument("--lists", type=int, default=1024)
+    parser.add_argument("--sample", type=int, default=100_000)
+    parser.add_argument("--nprobe", type=int, default=None, help="defaults to VECTOR_INDEX_NPROBE")
+    parser.add_argument("--dtype", choices=["float16", "int8"], action="append")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    header = (
+        f"{'dtype':<8} {'mode':<6} {'disk MiB':>9} {'appends/s':>12} {'train s':>8} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'recall@k':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for dtype in args.dtype or ["float16", "int8"]:
+        _run(dtype, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Compare memory and throughput of prefork children with and without preloading.
+
+Usage:
+    python tests/worker_memory_report.py [--children 4] [--messages 20] [--threads N]
+
+Each mode runs in a fresh interpreter that forks ``--children`` processes the
+way the Celery prefork pool does, and every child classifies ``--messages``
+rows from ``data_set.csv`` with the HuggingFace pipeline:
+
+* ``per_child`` - every child loads its own copy of the model (default worker)
+* ``preload`` - the parent loads the model before forking (HF_PRELOAD=1)
+* ``preload_shared`` - as ``preload`` with weights in shared memory
+  (HF_PRELOAD=1 HF_SHARE_MEMORY=1)
+
+Memory is read from ``/proc/<pid>/smaps_rollup`` after the child has run its
+messages. PSS splits shared pages between the processes that map them, so the
+summed PSS is the real footprint of the pool. Linux only.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+DATASET_PATH = ROOT_DIR / "data_set.csv"
+MODES = ("per_child", "preload", "preload_shared")
+
+
+def _load_messages(limit: int) -> List[str]:
+    with DATASET_PATH.open("r", encoding="utf-8", newline="") as fh:
+        rows = list(csv.DictReader(fh))
+    return [f"[{row['service']}] {row['text']}" for row in rows[:limit]]
+
+
+def _memory_kb(pid: int) -> Dict[str, int]:
+    values: Dict[str, int] = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values
+
+
+def _child(messages: List[str], threads: int | None, write_fd: int) -> None:
+    from ai.bert_model import get_classifier
+    from ai.configs import candidate_labels, hypothesis_template, prompt
+    from ai.preload import limit_torch_threads
+
+    classifier = get_classifier()
+    limit_torch_threads(threads)
+
+    started = time.perf_counter()
+    for message in messages:
+        classifier(prompt + message, candidate_labels=candidate_labels, hypothesis_template=hypothesis_template)
+    elapsed = time.perf_counter() - started
+
+    memory = _memory_kb(os.getpid())
+    payload = {"elapsed": elapsed, "rss_kb": memory.get("Rss", 0), "pss_kb": memory.get("Pss", 0)}
+    os.write(write_fd, json.dumps(payload).encode())
+    os._exit(0)
+
+
+def run_mode(mode: str, children: int, messages: List[str], threads: int | None) -> Dict[str, object]:
+    if mode != "per_child":
+        from ai.preload import preload_classifier
+
+        preload_classifier(share_memory=(mode == "preload_shared"))
+
+    started = time.perf_counter()
+    readers = []
+    for _ in range(children):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _child(messages, threads, write_fd)
+        os.close(write_fd)
+        readers.append((pid, read_fd))
+
+    results = []
+    for pid, read_fd in readers:
+        chunks = []
+        while True:
+            chunk = os.read(read_fd, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        results.append(json.loads(b"".join(chunks)))
+    wall = time.perf_counter() - started
+
+    total = children * len(messages)
+    return {
+        "mode": mode,
+        "children": children,
+        "threads_per_child": threads,
+        "total_pss_mb": sum(r["pss_kb"] for r in results) / 1024,
+        "avg_rss_mb": sum(r["rss_kb"] for r in results) / len(results) / 1024,
+        "wall_sec": wall,
+        "msgs_per_sec": total / wall if wall else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--children", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per child (default cpu_count // children)")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.children)
+
+    if args.mode:
+        result = run_mode(args.mode, args.children, _load_messages(args.messages), threads)
+        print(json.dumps(result))
+        return
+
+    rows = []
+    for mode in MODES:
+        out = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--children", str(args.children),
+             "--messages", str(args.messages), "--threads", str(threads)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        rows.append(json.loads(out.strip().splitlines()[-1]))
+
+    header = f"{'mode':<16} {'children':>8} {'threads':>8} {'PSS total MB':>13} {'RSS avg MB':>11} {'msgs/sec':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['mode']:<16} {row['children']:>8} {row['threads_per_child']:>8} "
+            f"{row['total_pss_mb']:>13.1f} {row['avg_rss_mb']:>11.1f} {row['msgs_per_sec']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()